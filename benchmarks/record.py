@@ -0,0 +1,330 @@
+"""Capture-to-disk throughput benchmark.
+
+Records synthetic frames through the real recorders, writer pools and
+``save_data`` functions of each camera module, sweeping camera type, camera
+count, resolution, device FPS, storage format and drop policy. Every frame the simulated
+device produces is recorded, so the benchmark measures how much the stack can
+sustain. Metrics are computed from the capture manifests:
+
+- ``sustained_fps``: frames written per second, all cameras together
+- ``latency_ms``: percentiles of the grab stage (device to recorder) and the
+  write stage (recorder to frame on disk)
+- ``dropped``: frames the device produced that were never grabbed
+- ``write_dropped``: grabbed frames the recorder's drop policy discarded
+- ``write_mb_s``: bytes written per second
+- ``peak_rss_mb``: largest resident set of any recorder or writer process
+
+Results are printed as JSON along with the commit and host they were taken on,
+so runs can be compared between commits.
+
+Usage:
+    python -m benchmarks.record --cameras d455 zed --counts 1 2 --fps 30 --formats files container
+    python -m benchmarks.record --output results.json
+"""
+
+from contextlib import redirect_stdout
+from multiprocessing import Process, Queue
+from pathlib import Path
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from cameras.simulated import (
+    CAMERAS,
+    SyntheticSource,
+    camera_stream_spec,
+    make_recorder,
+)
+from utils.frame_store import STORAGE_FORMATS
+from utils.manifest import read_drops, read_manifest
+from utils.writer_pool import DROP_POLICIES
+
+PERCENTILES = [50, 90, 99]
+
+
+def scale_spec(streams, scale):
+    """Stream spec with the image dimensions scaled by ``scale``."""
+    return {
+        name: (
+            (max(1, round(shape[0] * scale)), max(1, round(shape[1] * scale)))
+            + tuple(shape[2:]),
+            dtype,
+        )
+        for name, (shape, dtype) in streams.items()
+    }
+
+
+def record_camera(camera, index, streams, fps, num_frames, output_path, kwargs):
+    source = SyntheticSource(streams, fps=fps, num_frames=num_frames, seed=index)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        recorder = make_recorder(
+            camera, source, index, output_path=output_path, record_fps=None, **kwargs
+        )
+        recorder.initialize_camera()
+        recorder.record_frames()
+
+
+def run_cameras(config, output_path, results):
+    """Record all cameras of one configuration, report the peak RSS."""
+    streams = scale_spec(camera_stream_spec(config["camera"]), config["scale"])
+    num_frames = int(config["fps"] * config["duration"])
+    kwargs = dict(
+        num_writers=config["num_writers"],
+        num_slots=config["num_slots"],
+        storage_format=config["format"],
+        compression=config["compression"],
+        drop_policy=config["drop_policy"],
+    )
+    processes = [
+        Process(
+            target=record_camera,
+            args=(
+                config["camera"],
+                index,
+                streams,
+                config["fps"],
+                num_frames,
+                output_path,
+                kwargs,
+            ),
+        )
+        for index in range(config["count"])
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    # Children that exited are included along with the writers they waited for
+    peak_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    results.put(peak_kb)
+
+
+def percentiles(values):
+    if not len(values):
+        return None
+    stats = dict(
+        zip((f"p{p}" for p in PERCENTILES), np.percentile(values, PERCENTILES))
+    )
+    stats["max"] = np.max(values)
+    return {name: round(float(value), 3) for name, value in stats.items()}
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+def run_config(config, work_dir):
+    """Run one configuration of the sweep and return its result."""
+    output_path = Path(tempfile.mkdtemp(dir=work_dir))
+    try:
+        results = Queue()
+        p = Process(target=run_cameras, args=(config, str(output_path), results))
+        start = time.monotonic_ns()
+        p.start()
+        p.join()
+        if p.exitcode != 0:
+            raise RuntimeError(f"Benchmark run failed: {config}")
+        peak_kb = results.get(timeout=5)
+        wall_s = (time.monotonic_ns() - start) / 1e9
+
+        camera_dirs = list(output_path.glob("*/camera_*"))
+        records = [read_manifest(camera_dir) for camera_dir in camera_dirs]
+        write_dropped = sum(
+            (read_drops(camera_dir)["stream"] == b"*").sum()
+            for camera_dir in camera_dirs
+        )
+        captured = sum(len(r) for r in records)
+        written = [r[r["write_done_ns"] >= 0] for r in records]
+        num_written = sum(len(w) for w in written)
+
+        # Every frame the simulated devices produced is either captured or
+        # dropped because the recorder was late to grab it
+        dropped = config["count"] * int(config["fps"] * config["duration"]) - captured
+
+        if num_written:
+            first = min(w["host_ns"].min() for w in written if len(w))
+            last = max(w["write_done_ns"].max() for w in written if len(w))
+            active_s = max(last - first, 1) / 1e9
+        else:
+            active_s = wall_s
+        grab_ms = np.concatenate([r["grab_latency_us"] for r in records] or [[]]) / 1e3
+        write_ms = (
+            np.concatenate([w["write_done_ns"] - w["host_ns"] for w in written] or [[]])
+            / 1e6
+        )
+        num_bytes = directory_size(output_path)
+
+        return dict(
+            config=config,
+            captured=captured,
+            written=num_written,
+            dropped=dropped,
+            write_dropped=int(write_dropped),
+            failed_writes=captured - num_written - int(write_dropped),
+            sustained_fps=round(num_written / active_s, 3),
+            latency_ms=dict(grab=percentiles(grab_ms), write=percentiles(write_ms)),
+            write_mb_s=round(num_bytes / active_s / 1e6, 3),
+            bytes_written=num_bytes,
+            peak_rss_mb=round(peak_kb / 1024, 1),
+            wall_s=round(wall_s, 3),
+        )
+    finally:
+        shutil.rmtree(output_path, ignore_errors=True)
+
+
+def host_info():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return dict(
+        commit=commit or None,
+        hostname=platform.node(),
+        platform=platform.platform(),
+        python=platform.python_version(),
+        cpu_count=os.cpu_count(),
+    )
+
+
+def main(args):
+    configs = [
+        dict(
+            camera=camera,
+            count=count,
+            scale=scale,
+            fps=fps,
+            format=storage_format,
+            drop_policy=drop_policy,
+            compression=args.compression if storage_format == "container" else None,
+            duration=args.duration,
+            num_writers=args.num_writers,
+            num_slots=args.num_slots,
+        )
+        for camera, count, scale, fps, storage_format, drop_policy in itertools.product(
+            args.cameras,
+            args.counts,
+            args.scales,
+            args.fps,
+            args.formats,
+            args.drop_policies,
+        )
+    ]
+
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    results = []
+    for i, config in enumerate(configs):
+        print(f"[{i + 1}/{len(configs)}] {config}")
+        result = run_config(config, work_dir)
+        print(
+            f"    {result['sustained_fps']} fps, {result['dropped']} dropped, {result['write_dropped']} write-dropped, {result['write_mb_s']} MB/s"
+        )
+        results.append(result)
+
+    report = dict(host=host_info(), results=results)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark capture-to-disk throughput")
+    parser.add_argument(
+        "--cameras",
+        type=str,
+        nargs="+",
+        choices=CAMERAS,
+        help="Camera types to simulate",
+        default=["d455"],
+    )
+    parser.add_argument(
+        "--counts", type=int, nargs="+", help="Numbers of cameras", default=[1]
+    )
+    parser.add_argument(
+        "--scales",
+        type=float,
+        nargs="+",
+        help="Resolution scales relative to each camera's native resolution",
+        default=[1.0],
+    )
+    parser.add_argument(
+        "--fps", type=float, nargs="+", help="Device frame rates", default=[30]
+    )
+    parser.add_argument(
+        "--formats",
+        type=str,
+        nargs="+",
+        choices=STORAGE_FORMATS,
+        help="Storage formats",
+        default=["files"],
+    )
+    parser.add_argument(
+        "--drop_policies",
+        type=str,
+        nargs="+",
+        choices=DROP_POLICIES,
+        help="Recorder drop policies",
+        default=["block"],
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=["zlib"],
+        help="Chunk compression for the container format",
+        default=None,
+    )
+    parser.add_argument(
+        "--duration", type=float, help="Seconds of frames per configuration", default=5
+    )
+    parser.add_argument(
+        "--num_writers",
+        type=int,
+        help="Number of writer processes per camera",
+        default=2,
+    )
+    parser.add_argument(
+        "--num_slots",
+        type=int,
+        help="Number of shared-memory frame slots per camera",
+        default=8,
+    )
+    parser.add_argument(
+        "--work_dir",
+        type=str,
+        help="Directory the benchmark records into, cleaned after each run",
+        default="./benchmark_data",
+    )
+    parser.add_argument(
+        "--output", type=str, help="Save the JSON results to this file", default=None
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -1,26 +1,46 @@
-import numpy as np
 import time
-from pathlib import Path
-from datetime import datetime
-from multiprocessing import Process
-import cv2
-import pyk4a
-from pyk4a import Config, PyK4A
-
-fps_dict = {
-    5: pyk4a.FPS.FPS_5,
-    15: pyk4a.FPS.FPS_15,
-    30: pyk4a.FPS.FPS_30,
-}
+
+import numpy as np
+
+try:
+    import pyk4a
+    from pyk4a import Config, PyK4A
+
+    fps_dict = {
+        5: pyk4a.FPS.FPS_5,
+        15: pyk4a.FPS.FPS_15,
+        30: pyk4a.FPS.FPS_30,
+    }
+except ImportError:
+    pyk4a = None  # Only simulated sources are available
+
+from cameras.recorder import CameraSource, Recorder, make_camera_dir, select_streams
+from utils import tracing
+from utils.calibration import camera_calibration, make_calibration
+from utils.depth_encoding import write_depth_info
+from utils.pointcloud import intrinsics_from_matrix
+
+# Resolutions (width, height) of the configured RES_1080P color and
+# WFOV_UNBINNED depth modes
+color_resolution = (1920, 1080)
+depth_resolution = (1024, 1024)
 
 RECORD_FPS = 5
 
 
-def save_data(color, depth, ir, camera_dir, frame_count):
-    cv2.imwrite(str(camera_dir / f"color_{frame_count}.png"), color)
-    # Convert depth to uint16 and save
-    cv2.imwrite(str(camera_dir / f"depth_{frame_count}.png"), depth.astype(np.uint16))
-    cv2.imwrite(str(camera_dir / f"ir_{frame_count}.png"), ir)
+def save_data(
+    store, frame_count, color=None, depth=None, ir=None, unaligned_depth=None
+):
+    if color is not None:
+        store.write_image("color", frame_count, color)
+    if depth is not None:
+        # Convert depth to uint16 and save
+        store.write_image("depth", frame_count, depth.astype(np.uint16))
+    if unaligned_depth is not None:
+        store.write_image("unaligned_depth", frame_count, unaligned_depth)
+    if ir is not None:
+        store.write_image("ir", frame_count, ir)
+    store.finish_frame(frame_count)
 
 
 def init_kinect(fps=15):
@@ -37,94 +57,172 @@ def init_kinect(fps=15):
     return device
 
 
-class KinectRecorder:
-    def __init__(self, vis, output_path="./recorded_data"):
-        self.camera_name = "kinect"
-        self.vis = vis
-
-        # Create output directory
-        output_path = Path(output_path)
-        output_path.mkdir(exist_ok=True)
-
-        # Create timestamp-based directory
-        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-        session_dir = output_path / self.timestamp
-
-        # Create camera directory
-        self.camera_dir = session_dir / f"camera_{self.camera_name}"
-        self.camera_dir.mkdir(parents=True, exist_ok=True)
-
-        self.frame_count = 0
-
-    def initialize_camera(self):
-        print(f"Initializing device: {self.camera_name}")
+def stream_spec(align=True):
+    """Shapes and dtypes of the recorded frames.
+
+    Depth is transformed to the color camera, IR stays at depth resolution.
+    Without ``align``, depth is recorded in the depth camera as
+    ``unaligned_depth``.
+    """
+    color_width, color_height = color_resolution
+    depth_width, depth_height = depth_resolution
+    if align:
+        depth = {"depth": ((color_height, color_width), np.uint16)}
+    else:
+        depth = {"unaligned_depth": ((depth_height, depth_width), np.uint16)}
+    return {
+        "color": ((color_height, color_width, 4), np.uint8),
+        **depth,
+        "ir": ((depth_height, depth_width), np.uint16),
+    }
+
+
+class KinectSource(CameraSource):
+    """Color, depth and IR of an Azure Kinect.
+
+    Depth is transformed to the color camera on the host unless ``align`` is
+    False, in which case native depth is recorded along with the calibration
+    needed to align it offline with ``utils.align_depth``.
+    """
+
+    def __init__(self, streams=None, align=True):
+        self.depth_stream = "depth" if align else "unaligned_depth"
+        if streams is not None:
+            streams = [self.depth_stream if s == "depth" else s for s in streams]
+        self.spec = select_streams(stream_spec(align), streams)
+        self.align = align
+        self.device = None
+
+    def open(self):
         self.device = init_kinect()
 
         # Wait for the first frame to ensure camera is running
         self.device.get_capture()
         print("Kinect Kinect initialized successfully")
 
-    def record_frames(self):
-        start_time = time.time()
-        print(f"CAM {self.camera_name}: Starting recording...")
-
-        try:
-            while True:
-                record_time_start = time.time()
-                # Get capture
-                capture = self.device.get_capture()
-
-                if capture.color is not None and capture.depth is not None:
-                    # Get color, depth, and IR images
-                    color = capture.color
-                    depth = capture.depth
-                    ir = capture.ir
-
-                    # Align depth to color
-                    transformed_depth = pyk4a.depth_image_to_color_camera(
-                        depth, self.device.calibration, thread_safe=True
-                    )
-                    # transformed_color = pyk4a.color_image_to_depth_camera(color, depth, self.device.calibration, thread_safe=True) # Not good
-
-                    # Save frames asynchronously
-                    save_process = Process(
-                        target=save_data,
-                        args=(
-                            color.copy(),
-                            transformed_depth.copy(),
-                            ir.copy(),
-                            self.camera_dir,
-                            self.frame_count,
-                        ),
-                    )
-                    save_process.start()
-
-                    if self.vis:
-                        cv2.imshow(f"{self.camera_name} Visualization", color)
-                        cv2.waitKey(1)
-
-                    self.frame_count += 1
-
-                    # Display progress
-                    if self.frame_count % 30 == 0:
-                        print(
-                            f"CAM {self.camera_name}: Recorded... {int(time.time() - start_time)} seconds, {self.frame_count} frames"
-                        )
-
-                    time.sleep(
-                        max(0, 1 / RECORD_FPS - (time.time() - record_time_start))
-                    )  # fps = RECORD_FPS
-
-        except KeyboardInterrupt:
-            print("\nRecording stopped by user")
-            self.stop_record()
-
-    def stop_record(self):
-        if hasattr(self, "device"):
+        calibration = self.device.calibration
+        depth_type = pyk4a.CalibrationType.DEPTH
+        color_type = pyk4a.CalibrationType.COLOR
+        if self.align:
+            # Depth is transformed to the color camera, so it has its intrinsics
+            self.intrinsics = intrinsics_from_matrix(
+                calibration.get_camera_matrix(color_type), *color_resolution
+            )
+        else:
+            self.intrinsics = intrinsics_from_matrix(
+                calibration.get_camera_matrix(depth_type), *depth_resolution
+            )
+            rotation, translation = calibration.get_extrinsic_parameters(
+                depth_type, color_type
+            )
+            # The Azure Kinect's rational Brown-Conrady model and coefficient
+            # order are OpenCV's
+            self.calibration = make_calibration(
+                camera_calibration(
+                    calibration.get_camera_matrix(depth_type),
+                    *depth_resolution,
+                    calibration.get_distortion_coefficients(depth_type),
+                ),
+                camera_calibration(
+                    calibration.get_camera_matrix(color_type),
+                    *color_resolution,
+                    calibration.get_distortion_coefficients(color_type),
+                ),
+                rotation,
+                np.asarray(translation) / 1000,  # millimeters
+                0.001,
+            )
+        return self.spec
+
+    def grab(self):
+        # Get capture
+        capture = self.device.get_capture()
+        while capture.color is None or capture.depth is None:
+            capture = self.device.get_capture()
+        if tracing.tracer:
+            tracing.tracer.lap("get_capture")
+        return self.read_capture(capture)
+
+    def grab_latest(self):
+        # Drain the queued captures without blocking, keep the newest complete
+        # one
+        latest = None
+        while True:
+            try:
+                capture = self.device.get_capture(timeout=0)
+            except pyk4a.K4ATimeoutException:
+                break
+            if capture.color is not None and capture.depth is not None:
+                latest = capture
+        if tracing.tracer:
+            tracing.tracer.lap("get_capture")
+        if latest is None:
+            return self.grab()
+        return self.read_capture(latest)
+
+    def read_capture(self, capture):
+        streams = {}
+        if "color" in self.spec:
+            streams["color"] = capture.color
+        if "depth" in self.spec:
+            # Align depth to color
+            align_start_ns = time.monotonic_ns()
+            streams["depth"] = pyk4a.depth_image_to_color_camera(
+                capture.depth, self.device.calibration, thread_safe=True
+            )
+            self.align_us = (time.monotonic_ns() - align_start_ns) // 1000
+            if tracing.tracer:
+                tracing.tracer.lap("align")
+        if "unaligned_depth" in self.spec:
+            streams["unaligned_depth"] = capture.depth
+            # transformed_color = pyk4a.color_image_to_depth_camera(color, depth, self.device.calibration, thread_safe=True) # Not good
+        if "ir" in self.spec:
+            streams["ir"] = capture.ir
+
+        return streams, capture.depth_timestamp_usec
+
+    def close(self):
+        if self.device is not None:
             self.device.stop()
-
-    def __del__(self):
-        self.stop_record()
+            self.device = None
+
+
+class KinectRecorder(Recorder):
+    """Record color, depth aligned to color and IR from an Azure Kinect.
+
+    ``streams`` selects the recorded streams of ``stream_spec``, default all.
+    ``align=False`` records native depth for offline alignment, see
+    ``KinectSource``. Pass ``source`` (see ``cameras.simulated``) to record
+    without a device.
+    """
+
+    def __init__(
+        self,
+        vis,
+        output_path="./recorded_data",
+        source=None,
+        camera_name="kinect",
+        streams=None,
+        align=True,
+        timestamp=None,
+        **recorder_kwargs,
+    ):
+        if source is None:
+            source = KinectSource(streams, align)
+
+        recorder_kwargs.setdefault("record_fps", RECORD_FPS)
+        recorder_kwargs.setdefault("droppable_streams", ("ir",))
+        super().__init__(
+            camera_name,
+            make_camera_dir(output_path, f"camera_{camera_name}", timestamp),
+            source,
+            save_data,
+            vis,
+            **recorder_kwargs,
+        )
+        # Kinect depth is in millimeters
+        depth_stream = "depth" if align else "unaligned_depth"
+        write_depth_info(self.camera_dir, [(depth_stream, "uint16")], "m", 1000.0)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,29 @@
-from mecheye.shared import *
-from mecheye.area_scan_3d_camera import *
-from mecheye.area_scan_3d_camera_utils import *
+try:
+    from mecheye.shared import *
+    from mecheye.area_scan_3d_camera import *
+    from mecheye.area_scan_3d_camera_utils import *
+except ImportError:
+    pass  # Only simulated sources are available
 
 from multiprocessing import Process
-from pathlib import Path
+from functools import partial
 import argparse
 import numpy as np
-import cv2
 import time
-from datetime import datetime
-import imageio
 
-from visualization.visualize_depth import colorize_depth_map
+from utils import tracing
+from utils.colorize import colorize
+from utils.depth_encoding import ENCODINGS, write_depth, write_depth_info
+from utils.reprojection import DepthReprojector
+from utils.frame_store import STORAGE_FORMATS
+from cameras.recorder import (
+    CameraSource,
+    Recorder,
+    load_stream_config,
+    make_camera_dir,
+    select_streams,
+)
+from utils.pointcloud import intrinsics_from_matrix
 
 CAM_LIST = {
     "192.168.23.100": "lsr-s",
@@ -20,24 +32,39 @@ CAM_LIST = {
 }
 
 
-def save_data(color, depth, pcd, normal, camera_dir, frame_count):
-    cv2.imwrite(str(camera_dir / f"color_{frame_count}.png"), color)
-    np.save(
-        str(camera_dir / f"raw_depth_{frame_count}.npy"), depth
-    )  # 32-bit float array
+# Depth streams stored for each depth_encoding, see utils.depth_encoding
+depth_encodings = {
+    "float32": [("raw_depth", "float32")],
+    "float16": [("raw_depth", "float16")],
+    "uint16": [("raw_depth", "uint16")],
+}
 
-    # depth_img = depth * 1000
-    # depth_img = np.nan_to_num(depth_img, 0)
-    # depth_img[depth_img > 65535] = 65535
-    # depth_img[depth_img < 1e-5] = 0
 
-    # Convert depth to uint16 and save
-    # cv2.imwrite(str(camera_dir / f"depth_{frame_count}.png"), depth_img.astype(np.uint16)) # 16-bit uint array
-    cv2.imwrite(
-        str(camera_dir / f"depth_{frame_count}.png"), depth
-    )  # 16-bit uint array
-    np.save(str(camera_dir / f"pcd_{frame_count}.npy"), pcd)  # 32-bit float array
-    np.save(str(camera_dir / f"normal_{frame_count}.npy"), normal)  # 32-bit float array
+def save_data(
+    store,
+    frame_count,
+    color=None,
+    raw_depth=None,
+    pcd=None,
+    normal=None,
+    depth_encoding="float32",
+    depth_scale=1.0,
+):
+    if color is not None:
+        store.write_image("color", frame_count, color)
+    if raw_depth is not None:
+        # Depth aligned to color in millimeters
+        for stream, encoding in depth_encodings[depth_encoding]:
+            write_depth(store, stream, frame_count, raw_depth, encoding, depth_scale)
+
+        # Colorized depth for viewing, over the valid depth of the frame
+        depth_img = colorize(raw_depth, cmap="jet", invalid=(0, 0, 0))
+        store.write_image("depth", frame_count, depth_img)
+    if pcd is not None:
+        store.write_array("pcd", frame_count, pcd)  # 32-bit float array
+    if normal is not None:
+        store.write_array("normal", frame_count, normal)  # 32-bit float array
+    store.finish_frame(frame_count)
 
 
 def init_mecheye(ip):
@@ -47,7 +74,11 @@ def init_mecheye(ip):
     return camera
 
 
-def align_depth_to_color(camera, depth, color):
+def get_depth_to_texture_reprojector(camera, depth_shape, color_shape):
+    """Build a DepthReprojector from the camera's intrinsics and extrinsics.
+
+    Queries the camera over the network, so call it once per session.
+    """
     intrinsic = CameraIntrinsics()
     camera.get_camera_intrinsics(intrinsic)
     depth_matrix = np.zeros((3, 3))
@@ -67,159 +98,181 @@ def align_depth_to_color(camera, depth, color):
     translation = np.array(intrinsic.depth_to_texture.translation)
     rotation = np.array(intrinsic.depth_to_texture.rotation)
 
-    # Get image dimensions
-    height, width = depth.shape
-    height_color, width_color = color.shape[:2]
-
-    # Create output mapped image
-    mapped_image = np.zeros((height_color, width_color))
+    return DepthReprojector(
+        depth_matrix,
+        texture_matrix,
+        rotation,
+        translation,
+        depth_shape,
+        color_shape,
+    )
 
-    for y in range(height):
-        for x in range(width):
-            if depth[y, x] > 0:  # Only process valid depth points
-                # Convert depth point to 3D coordinates
-                depth_point = (
-                    np.array(
-                        [
-                            (x - depth_matrix[0, 2]) / depth_matrix[0, 0],
-                            (y - depth_matrix[1, 2]) / depth_matrix[1, 1],
-                            1.0,
-                        ]
-                    )
-                    * depth[y, x]
-                )
 
-                # Transform point to texture space
-                texture_point = np.dot(rotation, depth_point) + translation
-
-                # Project to texture image coordinates
-                texture_image_point = np.dot(texture_matrix, texture_point)
+def align_depth_to_color(camera, depth, color):
+    reprojector = get_depth_to_texture_reprojector(camera, depth.shape, color.shape)
+    return reprojector(depth)
 
-                # Perspective division
-                if texture_image_point[2] != 0:
-                    texture_x = int(texture_image_point[0] / texture_image_point[2])
-                    texture_y = int(texture_image_point[1] / texture_image_point[2])
 
-                    # Check if point is within image bounds
-                    if 0 <= texture_x < width_color and 0 <= texture_y < height_color:
-                        mapped_image[texture_y, texture_x] = depth[y, x]
+def stream_spec(color_resolution=(1920, 1200)):
+    """Shapes and dtypes of the recorded frames.
 
-    return mapped_image
+    Real cameras are sized from their first capture; this is used to simulate
+    one. Depth is aligned to the color image, in millimeters.
+    """
+    width, height = color_resolution
+    return {
+        "color": ((height, width, 3), np.uint8),
+        "raw_depth": ((height, width), np.float32),
+        "pcd": ((height, width, 6), np.float32),
+        "normal": ((height, width, 3), np.float32),
+    }
 
 
-class MecheyeRecorder:
-    def __init__(self, ip, interval, vis=False, output_path="./mech_data"):
+class MecheyeSource(CameraSource):
+    def __init__(self, ip, streams=None):
         self.ip = ip
-        self.camera_name = CAM_LIST[ip]
-        self.vis = vis
-        self.interval = interval
-
-        # Create output directory
-        output_path = Path(output_path)
-        output_path.mkdir(exist_ok=True)
-
-        # Create timestamp-based directory
-        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-        session_dir = output_path / self.timestamp
+        # Shapes come from the first capture, only the names are checked here
+        self.streams = list(select_streams(stream_spec(), streams))
+        self.device = None
+        self.reprojector = None
 
-        # Create camera directory
-        self.camera_dir = session_dir / f"camera_{self.camera_name}"
-        self.camera_dir.mkdir(parents=True, exist_ok=True)
-
-        self.frame_count = 0
-
-    def initialize_camera(self):
-        print(f"Initializing device: {self.camera_name}")
+    def open(self):
         self.device = init_mecheye(self.ip)
-        print(f"{self.camera_name} initialized successfully")
-
-    def record_frames(self):
-        start_time = time.time()
-        print(f"CAM {self.camera_name}: Starting recording...")
-
-        try:
-            while True:
-                frame2d_and_3d = Frame2DAnd3D()
-                self.device.capture_2d_and_3d(frame2d_and_3d)
-
-                textured_pcd = frame2d_and_3d.get_textured_point_cloud_with_normals()
-                depth_map = frame2d_and_3d.frame_3d().get_depth_map()
-                rgb_map = frame2d_and_3d.frame_2d().get_color_image()
-                depth = depth_map.data()
-                depth = np.nan_to_num(depth, 0)
-                color = rgb_map.data()
-                depth = align_depth_to_color(self.device, depth, color)
-                # print(depth.shape, depth.min(), depth.max())
-                # depth = colorize_depth_map(depth, min_value=0, max_value=2000)
-
-                depth = cv2.normalize(
-                    depth, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U
-                )
-                depth = cv2.applyColorMap(depth, cv2.COLORMAP_JET)
-
+        print(f"{CAM_LIST.get(self.ip, self.ip)} initialized successfully")
+        # Frame sizes depend on the camera model, so the shared memory ring is
+        # sized from the first capture
+        return None
+
+    def grab(self):
+        frame2d_and_3d = Frame2DAnd3D()
+        self.device.capture_2d_and_3d(frame2d_and_3d)
+        if tracing.tracer:
+            tracing.tracer.lap("capture_2d_and_3d")
+        # The capture call is synchronous, so its completion is the capture
+        # time; logged as wall clock since the SDK has none
+        device_us = time.time_ns() // 1000
+
+        depth_map = frame2d_and_3d.frame_3d().get_depth_map()
+        rgb_map = frame2d_and_3d.frame_2d().get_color_image()
+        depth = depth_map.data()
+        depth = np.nan_to_num(depth, 0)
+        color = rgb_map.data()
+        if self.reprojector is None:
+            # Calibration is fixed for the session, fetch it only once
+            self.reprojector = get_depth_to_texture_reprojector(
+                self.device, depth.shape, color.shape
+            )
+            # Depth is aligned to the texture camera, so it has its intrinsics
+            self.intrinsics = intrinsics_from_matrix(
+                self.reprojector.target_matrix, color.shape[1], color.shape[0]
+            )
+
+        streams = {}
+        if "color" in self.streams:
+            streams["color"] = color
+        if "raw_depth" in self.streams:
+            streams["raw_depth"] = self.reprojector(depth)
+            if tracing.tracer:
+                tracing.tracer.lap("align")
+            # print(depth.shape, depth.min(), depth.max())
+        if "pcd" in self.streams or "normal" in self.streams:
+            # Can be derived from depth and intrinsics instead, see
+            # utils.pointcloud
+            textured_pcd = frame2d_and_3d.get_textured_point_cloud_with_normals()
+            if "pcd" in self.streams:
                 pcd = textured_pcd.vertices()
                 pcd_color = textured_pcd.colors()
-                pcds = np.concatenate((pcd, pcd_color), axis=-1)
-                normals = textured_pcd.normals()
-
-                # Save frames asynchronously
-                save_process = Process(
-                    target=save_data,
-                    args=(
-                        color.copy(),
-                        depth.copy(),
-                        pcds.copy(),
-                        normals.copy(),
-                        self.camera_dir,
-                        self.frame_count,
-                    ),
-                )
-                save_process.start()
-
-                if self.vis:
-                    cv2.imshow(f"{self.camera_name} Visualization", color)
-                    cv2.waitKey(1)
-
-                self.frame_count += 1
-
-                # Display progress
-                if self.frame_count % 30 == 0:
-                    print(
-                        f"CAM {self.camera_name}: Recorded... {int(time.time() - start_time)} seconds, {self.frame_count} frames"
-                    )
-
-                time.sleep(self.interval)
-
-        except KeyboardInterrupt:
-            print("\nRecording stopped by user")
-            self.stop_record()
-
-    def stop_record(self):
-        self.device.disconnect()
-
-    def __del__(self):
-        self.stop_record()
+                streams["pcd"] = np.concatenate((pcd, pcd_color), axis=-1)
+            if "normal" in self.streams:
+                streams["normal"] = textured_pcd.normals()
+            if tracing.tracer:
+                tracing.tracer.lap("point_cloud")
+
+        return streams, device_us
+
+    def close(self):
+        if self.device is not None:
+            self.device.disconnect()
+            self.device = None
+
+
+class MecheyeRecorder(Recorder):
+    """Record color, aligned depth, point cloud and normals from a Mech-Eye camera.
+
+    Captures are taken every ``interval`` seconds. ``streams`` selects the
+    recorded streams of ``stream_spec``, default all. ``depth_encoding`` selects
+    how depth is stored (see ``depth_encodings``), ``depth_scale`` is the uint16
+    depth units per millimeter. Pass ``source`` (see ``cameras.simulated``) to
+    record without a device.
+    """
+
+    def __init__(
+        self,
+        ip,
+        interval,
+        vis=False,
+        output_path="./mech_data",
+        source=None,
+        camera_name=None,
+        streams=None,
+        depth_encoding="float32",
+        depth_scale=1.0,
+        timestamp=None,
+        **recorder_kwargs,
+    ):
+        self.ip = ip
+        self.interval = interval
+        if camera_name is None:
+            camera_name = CAM_LIST[ip]
+        if source is None:
+            source = MecheyeSource(ip, streams)
+
+        recorder_kwargs.setdefault("num_slots", 4)
+        recorder_kwargs.setdefault("droppable_streams", ("pcd", "normal"))
+        super().__init__(
+            camera_name,
+            make_camera_dir(output_path, f"camera_{camera_name}", timestamp),
+            source,
+            partial(save_data, depth_encoding=depth_encoding, depth_scale=depth_scale),
+            vis,
+            record_fps=1 / interval if interval else None,
+            **recorder_kwargs,
+        )
+        write_depth_info(
+            self.camera_dir, depth_encodings[depth_encoding], "mm", depth_scale
+        )
 
 
 class MecheyeRecordProcess(Process):
-    def __init__(self, ip, interval, vis=False):
+    def __init__(self, ip, interval, vis=False, **recorder_kwargs):
         super(MecheyeRecordProcess, self).__init__()
         self.vis = vis
         self.ip = ip
         self.interval = interval
+        self.recorder_kwargs = recorder_kwargs
 
     def run(self):
-        recorder = MecheyeRecorder(self.ip, self.interval, self.vis)
+        recorder = MecheyeRecorder(
+            self.ip, self.interval, self.vis, **self.recorder_kwargs
+        )
         recorder.initialize_camera()
         recorder.record_frames()
 
 
 def main(args):
     processes = []
+    stream_config = load_stream_config(args.stream_config, args.streams)
 
     for ip in CAM_LIST.keys():
         p = MecheyeRecordProcess(
-            ip, interval=args.interval, vis=str.lower(args.vis) in CAM_LIST[ip]
+            ip,
+            interval=args.interval,
+            vis=str.lower(args.vis) in CAM_LIST[ip],
+            num_writers=args.num_writers,
+            storage_format=args.format,
+            compression=args.compression,
+            depth_encoding=args.depth_encoding,
+            streams=stream_config.get(CAM_LIST[ip]),
         )
         p.start()
         processes.append(p)
@@ -234,6 +287,43 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Record from MechMind cameras")
     parser.add_argument("--interval", type=float, help="Interval time", default=4)
     parser.add_argument("--vis", type=str, help="Visualization", default="none")
+    parser.add_argument(
+        "--num_writers", type=int, help="Number of writer processes", default=2
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=STORAGE_FORMATS,
+        help="Save loose PNG/NPY files or one chunked container per stream",
+        default="files",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=["zlib"],
+        help="Chunk compression for the container format",
+        default=None,
+    )
+    parser.add_argument(
+        "--depth_encoding",
+        type=str,
+        choices=ENCODINGS,
+        help="Store depth as float32, float16 or uint16 millimeters",
+        default="float32",
+    )
+    parser.add_argument(
+        "--streams",
+        type=str,
+        action="append",
+        help="Streams to record as <camera>=<stream>,..., e.g. lsr-s=color,raw_depth",
+        default=[],
+    )
+    parser.add_argument(
+        "--stream_config",
+        type=str,
+        help="JSON file mapping camera names to the streams to record",
+        default=None,
+    )
     return parser.parse_args()
 
 
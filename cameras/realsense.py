@@ -1,13 +1,18 @@
+import time
+
 try:
     import pyrealsense2.pyrealsense2 as rs
 except ImportError:
-    import pyrealsense2 as rs
+    try:
+        import pyrealsense2 as rs
+    except ImportError:
+        rs = None  # Only simulated sources are available
 import numpy as np
-import time
-from pathlib import Path
-from datetime import datetime
-from multiprocessing import Process
-import cv2
+
+from cameras.recorder import CameraSource, Recorder, make_camera_dir, select_streams
+from utils.calibration import camera_calibration, make_calibration
+from utils import tracing
+from utils.depth_encoding import write_depth_info
 
 serial_number_dict = {
     "f0221682": "l515",
@@ -49,12 +54,22 @@ fps_dict = {
     "d455": 30,
 }
 
+# Settings of models missing from the tables above, supported by every D400
+DEFAULT_DEPTH_RESOLUTION = (1280, 720)
+DEFAULT_COLOR_RESOLUTION = (1280, 720)
+DEFAULT_FPS = 30
+
 RECORD_FPS = 5
 
 
-def save_data(depth_image, color_image, camera_dir, frame_count):
-    cv2.imwrite(str(camera_dir / f"depth_{frame_count}.png"), depth_image)
-    cv2.imwrite(str(camera_dir / f"color_{frame_count}.png"), color_image)
+def save_data(store, frame_count, depth=None, color=None, unaligned_depth=None):
+    if depth is not None:
+        store.write_image("depth", frame_count, depth)
+    if unaligned_depth is not None:
+        store.write_image("unaligned_depth", frame_count, unaligned_depth)
+    if color is not None:
+        store.write_image("color", frame_count, color)
+    store.finish_frame(frame_count)
 
 
 def get_depth_filter():
@@ -107,31 +122,85 @@ def depth_process(
     return frame
 
 
-class RealSenseRecorder:
-    def __init__(self, serial_number, vis, output_path="./recorded_data"):
-        self.pipeline = None
-        self.config = None
+def device_model(serial_number):
+    """Model of a connected camera as named in the tables above, e.g. "d455".
+
+    None if the camera is not connected or its model is not in the tables.
+    """
+    if rs is None:
+        return None
+    for device in rs.context().query_devices():
+        if device.get_info(rs.camera_info.serial_number) == serial_number:
+            # e.g. "Intel RealSense D455"
+            model = device.get_info(rs.camera_info.name).split()[-1].lower()
+            return model if model in color_resolution_dict else None
+    return None
+
+
+def stream_spec(camera_name, align=True):
+    """Shapes and dtypes of the frames recorded from ``camera_name``.
+
+    Aligned depth has the color resolution. Without ``align``, depth is
+    recorded at its native resolution as ``unaligned_depth``. Unknown models
+    get the default resolutions.
+    """
+    width, height = color_resolution_dict.get(camera_name, DEFAULT_COLOR_RESOLUTION)
+    if align:
+        depth = {"depth": ((height, width), np.uint16)}
+    else:
+        depth_width, depth_height = depth_resolution_dict.get(
+            camera_name, DEFAULT_DEPTH_RESOLUTION
+        )
+        depth = {"unaligned_depth": ((depth_height, depth_width), np.uint16)}
+    return {**depth, "color": ((height, width, 3), np.uint8)}
 
-        self.serial_number = serial_number
-        self.camera_name = serial_number_dict.get(serial_number, "unknown")
 
-        self.vis = vis
+def intrinsic_matrix(intrinsics):
+    """3x3 matrix of ``rs.intrinsics``."""
+    return [
+        [intrinsics.fx, 0, intrinsics.ppx],
+        [0, intrinsics.fy, intrinsics.ppy],
+        [0, 0, 1],
+    ]
 
-        # Create output directory
-        output_path = Path(output_path)
-        output_path.mkdir(exist_ok=True)
 
-        # Create timestamp-based directory
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-        session_dir = output_path / timestamp
+def distortion_model(intrinsics):
+    """Calibration distortion model name of ``rs.intrinsics``."""
+    # librealsense's Brown-Conrady is OpenCV's model; the inverse and modified
+    # variants are not, and their coefficients are refused by alignment
+    if intrinsics.model == rs.distortion.brown_conrady:
+        return "opencv"
+    return str(intrinsics.model).split(".")[-1]
 
-        # Create camera directory
-        self.camera_dir = session_dir / f"camera_{self.camera_name}"
-        self.camera_dir.mkdir(parents=True, exist_ok=True)
 
-    def initialize_camera(self):
-        print(f"Initializing device: {self.serial_number} {self.camera_name}")
+class RealSenseSource(CameraSource):
+    """Depth and color of a RealSense camera.
 
+    Depth is aligned to color on the host unless ``align`` is False, in which
+    case native depth is recorded along with the calibration needed to align
+    it offline with ``utils.align_depth``.
+    """
+
+    # Meters per depth unit, read from the device when it starts
+    depth_scale = 0.001
+
+    def __init__(self, serial_number, camera_name, streams=None, align=True):
+        self.serial_number = serial_number
+        self.camera_name = camera_name
+        # Cameras missing from serial_number_dict are configured by model
+        self.model = camera_name
+        if camera_name not in color_resolution_dict:
+            self.model = device_model(serial_number) or camera_name
+        self.depth_stream = "depth" if align else "unaligned_depth"
+        if streams is not None:
+            streams = [self.depth_stream if s == "depth" else s for s in streams]
+        self.spec = select_streams(stream_spec(self.model, align), streams)
+        self.align = None
+        self.align_depth = align
+        self.pipeline = None
+        self.config = None
+
+    def open(self):
         # Setup pipeline and config for each camera
         self.pipeline = rs.pipeline()
         self.config = rs.config()
@@ -139,27 +208,29 @@ class RealSenseRecorder:
 
         self.config.enable_device(self.serial_number)
 
-        # Enable streams
-        self.config.enable_stream(
-            rs.stream.depth,
-            *depth_resolution_dict[self.camera_name],
-            rs.format.z16,
-            fps_dict[self.camera_name],
-        )
+        # Enable streams, color is always needed to align depth to
+        if self.depth_stream in self.spec:
+            self.config.enable_stream(
+                rs.stream.depth,
+                *depth_resolution_dict.get(self.model, DEFAULT_DEPTH_RESOLUTION),
+                rs.format.z16,
+                fps_dict.get(self.model, DEFAULT_FPS),
+            )
         self.config.enable_stream(
             rs.stream.color,
-            *color_resolution_dict[self.camera_name],
+            *color_resolution_dict.get(self.model, DEFAULT_COLOR_RESOLUTION),
             rs.format.bgr8,
-            fps_dict[self.camera_name],
+            fps_dict.get(self.model, DEFAULT_FPS),
         )
-        # Create alignment primitive with color as its target stream
-        self.align = rs.align(rs.stream.color)
-        # self.align = rs.align(rs.stream.depth)
+        if self.align_depth:
+            # Create alignment primitive with color as its target stream
+            self.align = rs.align(rs.stream.color)
+            # self.align = rs.align(rs.stream.depth)
 
         # Start streaming
         profile = self.pipeline.start(self.config)
 
-        depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
+        self.depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
         sensor_dep = profile.get_device().first_depth_sensor()
 
         # print(f"Depth Scale is: {depth_scale}") # Should be 0.001
@@ -171,71 +242,144 @@ class RealSenseRecorder:
         # exp = sensor_dep.get_option(rs.option.exposure)
         # print("New exposure = ", exp)
 
-        self.frame_count = 0
-
-    def record_frames(self):
-        start_time = time.time()
-        print(f"CAM {self.serial_number} {self.camera_name}: Starting recording...")
-
-        while True:
-            try:
-                record_time_start = time.time()
-                # Wait for frames
-                frames = self.pipeline.wait_for_frames()
-                aligned_frames = self.align.process(frames)
-                depth_frame = aligned_frames.get_depth_frame()
-                color_frame = aligned_frames.get_color_frame()
-
-                # Convert frames to numpy arrays
-                depth_image = np.asanyarray(depth_frame.get_data())
-                color_image = np.asanyarray(color_frame.get_data())
-                # print(depth_image.shape, color_image.shape)
-
-                # Save frames
-                # Create a process to save data asynchronously
-                save_process = Process(
-                    target=save_data,
-                    args=(
-                        depth_image.copy(),
-                        color_image.copy(),
-                        self.camera_dir,
-                        self.frame_count,
-                    ),
-                )
-                save_process.start()
-
-                if self.vis:
-                    cv2.imshow(f"{self.camera_name} Visualization", color_image)
-                    cv2.waitKey(1)
-
-                # depth_frame = depth_process(depth_frame, *self.depth_filters)
-
-                if not depth_frame or not color_frame:
-                    raise Exception("Failed to acquire frames")
-
-                # Display progress
-                if self.frame_count % 30 == 0:
-                    print(
-                        f"CAM {serial_number_dict[self.serial_number]}: Recorded... {int(time.time() - start_time)} seconds, {self.frame_count} frames"
-                    )
-
-                time.sleep(
-                    max(0, 1 / RECORD_FPS - (time.time() - record_time_start))
-                )  # fps = RECORD_FPS
-
-                self.frame_count += 1
-
-            except KeyboardInterrupt:
-                print(f"CAM {self.camera_name}: Stopping recording...")
-                self.pipeline.stop()
-
-            except Exception as e:
-                print(f"CAM {self.camera_name}: Error - {e}")
-                break
-
-    def stop_recording(self):
-        self.pipeline.stop()
-        self.frame_count = 0
+        color_profile = profile.get_stream(rs.stream.color).as_video_stream_profile()
+        # Aligned depth has the color intrinsics
+        intrinsics = color_profile.get_intrinsics()
+        if self.depth_stream in self.spec and not self.align_depth:
+            depth_profile = profile.get_stream(
+                rs.stream.depth
+            ).as_video_stream_profile()
+            extrinsics = depth_profile.get_extrinsics_to(color_profile)
+            depth_intrinsics = depth_profile.get_intrinsics()
+            self.calibration = make_calibration(
+                camera_calibration(
+                    intrinsic_matrix(depth_intrinsics),
+                    depth_intrinsics.width,
+                    depth_intrinsics.height,
+                    depth_intrinsics.coeffs,
+                    distortion_model(depth_intrinsics),
+                ),
+                camera_calibration(
+                    intrinsic_matrix(intrinsics),
+                    intrinsics.width,
+                    intrinsics.height,
+                    intrinsics.coeffs,
+                    distortion_model(intrinsics),
+                ),
+                # librealsense rotations are column-major
+                np.array(extrinsics.rotation).reshape(3, 3).T,
+                extrinsics.translation,
+                self.depth_scale,
+            )
+            intrinsics = depth_intrinsics
+        self.intrinsics = dict(
+            fx=intrinsics.fx,
+            fy=intrinsics.fy,
+            cx=intrinsics.ppx,
+            cy=intrinsics.ppy,
+            width=intrinsics.width,
+            height=intrinsics.height,
+        )
+
+        return self.spec
+
+    def grab(self):
+        # Wait for frames
+        frames = self.pipeline.wait_for_frames()
+        if tracing.tracer:
+            tracing.tracer.lap("wait_for_frames")
+        return self.read_frames(frames)
+
+    def grab_latest(self):
+        # Drain the pipeline queue, only the newest frameset is aligned
+        latest = None
+        frames = self.pipeline.poll_for_frames()
+        while frames:
+            latest = frames
+            frames = self.pipeline.poll_for_frames()
+        if tracing.tracer:
+            tracing.tracer.lap("poll_for_frames")
+        if latest is None:
+            return self.grab()
+        return self.read_frames(latest)
+
+    def read_frames(self, frames):
+        if self.align is not None and self.depth_stream in self.spec:
+            align_start_ns = time.monotonic_ns()
+            frames = self.align.process(frames)
+            self.align_us = (time.monotonic_ns() - align_start_ns) // 1000
+            if tracing.tracer:
+                tracing.tracer.lap("align")
+        color_frame = frames.get_color_frame()
+        if not color_frame:
+            raise Exception("Failed to acquire frames")
+
+        streams = {}
+        if self.depth_stream in self.spec:
+            depth_frame = frames.get_depth_frame()
+            # depth_frame = depth_process(depth_frame, *self.depth_filters)
+            if not depth_frame:
+                raise Exception("Failed to acquire frames")
+            # Convert frames to numpy arrays
+            streams[self.depth_stream] = np.asanyarray(depth_frame.get_data())
+        if "color" in self.spec:
+            streams["color"] = np.asanyarray(color_frame.get_data())
+        if tracing.tracer:
+            tracing.tracer.lap("convert")
+
+        return streams, int(frames.get_timestamp() * 1000)
+
+    def close(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+
+class RealSenseRecorder(Recorder):
+    """Record aligned depth and color from a RealSense camera.
+
+    ``streams`` selects the recorded streams of ``stream_spec``, default all.
+    ``align=False`` records native depth for offline alignment, see
+    ``RealSenseSource``. Pass ``source`` (see ``cameras.simulated``) to record
+    without a device. Cameras missing from ``serial_number_dict`` are named by
+    serial number and configured by the model the device reports, or with the
+    default resolutions.
+    """
+
+    def __init__(
+        self,
+        serial_number,
+        vis,
+        output_path="./recorded_data",
+        source=None,
+        streams=None,
+        align=True,
+        timestamp=None,
+        **recorder_kwargs,
+    ):
+        self.serial_number = serial_number
+        self.depth_stream = "depth" if align else "unaligned_depth"
+        camera_name = serial_number_dict.get(serial_number, serial_number)
+        if source is None:
+            source = RealSenseSource(serial_number, camera_name, streams, align)
+
+        recorder_kwargs.setdefault("record_fps", RECORD_FPS)
+        super().__init__(
+            camera_name,
+            make_camera_dir(output_path, f"camera_{camera_name}", timestamp),
+            source,
+            save_data,
+            vis,
+            **recorder_kwargs,
+        )
+
+    def initialize_camera(self):
+        super().initialize_camera()
+        # The depth unit depends on the model, e.g. 0.25 mm on the L515
+        depth_scale = getattr(self.source, "depth_scale", RealSenseSource.depth_scale)
+        write_depth_info(
+            self.camera_dir, [(self.depth_stream, "uint16")], "m", 1 / depth_scale
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,354 @@
+from collections import Counter
+from datetime import datetime
+from multiprocessing import Process
+from pathlib import Path
+import json
+import time
+
+from utils import tracing
+from utils.calibration import write_calibration
+from utils.frame_store import open_store
+from utils.manifest import CaptureManifest, DropLog
+from utils.pointcloud import write_intrinsics
+from utils.preview import PreviewBoard, run_compositor
+from utils.scheduler import CaptureScheduler
+from utils.shared_ring import SharedFrameRing
+from utils.writer_pool import WriterPool
+
+
+def make_camera_dir(output_path, camera_dir_name, timestamp=None):
+    """Create ``<output_path>/<timestamp>/<camera_dir_name>`` and return it."""
+    output_path = Path(output_path)
+    output_path.mkdir(exist_ok=True)
+
+    # Create timestamp-based directory
+    if timestamp is None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    session_dir = output_path / timestamp
+
+    # Create camera directory
+    camera_dir = session_dir / camera_dir_name
+    camera_dir.mkdir(parents=True, exist_ok=True)
+    return camera_dir
+
+
+def select_streams(spec, streams):
+    """Restrict a stream spec to the names in ``streams``, None keeps all."""
+    if streams is None:
+        return spec
+    unknown = [stream for stream in streams if stream not in spec]
+    if unknown:
+        raise ValueError(
+            f"Unknown streams {', '.join(unknown)}, available: {', '.join(spec)}"
+        )
+    return {name: value for name, value in spec.items() if name in streams}
+
+
+def load_stream_config(path=None, stream_args=None):
+    """Streams to record per camera, from a JSON file and/or the command line.
+
+    The file maps camera names to stream lists, e.g.
+    ``{"zed2i": ["color", "raw_depth"], "d455": ["color", "depth"]}``.
+    Command line entries ``<camera>=<stream>,<stream>`` override the file.
+
+    Returns:
+        dict: Camera name -> list of streams; cameras not listed record all
+    """
+    config = {}
+    if path is not None:
+        with open(path) as f:
+            config.update(json.load(f))
+    for arg in stream_args or []:
+        camera, _, streams = arg.partition("=")
+        config[camera] = [stream for stream in streams.split(",") if stream]
+    return config
+
+
+def join_processes(processes):
+    """Wait for the recording processes to exit, through Ctrl-C.
+
+    Ctrl-C reaches every process of the terminal; the recorders stop on it
+    themselves and finish writing their frames, so the parent keeps waiting.
+    """
+    for process in processes:
+        while True:
+            try:
+                process.join()
+                break
+            except KeyboardInterrupt:
+                pass
+
+
+class CameraSource:
+    """Where a recorder gets its frames from: a device SDK or a simulation.
+
+    ``grab`` returns ``(streams, device_us)``: a dict of arrays keyed by the
+    recorder's ``save_data`` keyword arguments, and the device timestamp of
+    the frame in microseconds (-1 if unknown). It returns None once the source
+    is exhausted, which ends the recording.
+
+    ``intrinsics`` holds the pinhole intrinsics of the depth stream (see
+    ``utils.pointcloud``) once known, at the latest after the first frame.
+    Sources recording unaligned depth set ``calibration`` (see
+    ``utils.calibration``) the same way. Sources aligning depth on the host
+    set ``align_us`` to the alignment time of the last frame.
+    """
+
+    intrinsics = None
+    calibration = None
+    align_us = None
+
+    def open(self):
+        """Start the source and return its stream spec.
+
+        Returns:
+            dict: Stream name -> (shape, dtype), or None if frame sizes are
+                only known from the first frame
+        """
+        raise NotImplementedError
+
+    def grab(self):
+        raise NotImplementedError
+
+    def grab_latest(self):
+        """Freshest frame, discarding older frames queued by the device.
+
+        Used when recording at a fixed rate. Sources whose ``grab`` already
+        returns the newest frame need not override it.
+        """
+        return self.grab()
+
+    def close(self):
+        pass
+
+
+class Recorder:
+    """Capture loop shared by all cameras.
+
+    Pulls frames from a CameraSource, copies them into the shared-memory ring,
+    hands them to the writer pool and logs them in the capture manifest.
+
+    Args:
+        camera_name (str): Name used in logs and window titles
+        camera_dir (Path): Output directory of this camera
+        source (CameraSource): Frame source
+        save_data (callable): Writer target, ``save_data(store, frame_count, **streams)``
+        vis (bool): Preview the color and depth streams while recording, in a
+            compositor process of this camera unless ``preview`` is given
+        record_fps (float): Recording rate, None to record every frame as
+            fast as frames come
+        schedule_origin (float): ``time.monotonic()`` the recording ticks are
+            aligned to, shared by recorders that should capture together
+        trigger (utils.trigger.CameraTrigger): Capture on the ticks of a
+            software trigger shared with other cameras instead of
+            ``record_fps``
+        num_writers (int): Number of writer processes
+        num_slots (int): Number of shared-memory frame slots
+        storage_format (str): "files" or "container"
+        compression (str): Chunk compression for the container format
+        drop_policy (str): What to do when all frame slots are waiting to be
+            written, one of ``utils.writer_pool.DROP_POLICIES``
+        droppable_streams (list): Streams the ``decimate`` policy skips while
+            the writers are behind
+        preview (utils.preview.CameraPreview): Publish thumbnails to a
+            compositor shared with other cameras
+        metrics (utils.metrics.CameraMetrics): Export capture health metrics
+        trace_dir (Path): Trace the stages of this recorder and its writers
+            into this directory, see ``utils.tracing``
+    """
+
+    def __init__(
+        self,
+        camera_name,
+        camera_dir,
+        source,
+        save_data,
+        vis=False,
+        record_fps=5,
+        num_writers=2,
+        num_slots=8,
+        storage_format="files",
+        compression=None,
+        schedule_origin=None,
+        trigger=None,
+        drop_policy="block",
+        droppable_streams=(),
+        preview=None,
+        metrics=None,
+        trace_dir=None,
+    ):
+        self.camera_name = camera_name
+        self.camera_dir = Path(camera_dir)
+        self.source = source
+        self.preview = preview
+        self.compositor = None
+        if vis and preview is None:
+            board = PreviewBoard([camera_name])
+            self.preview = board.camera(0)
+            self.compositor = Process(target=run_compositor, args=(board,), daemon=True)
+        self.record_fps = record_fps
+        self.schedule_origin = schedule_origin
+        self.scheduler = None
+        self.trigger = trigger
+        self.num_slots = num_slots
+
+        self.writer_pool = WriterPool(
+            save_data,
+            num_workers=num_writers,
+            policy=drop_policy,
+            droppable_streams=droppable_streams,
+            metrics=metrics,
+            trace=None if trace_dir is None else (trace_dir, camera_name),
+        )
+        self.metrics = metrics
+        if trace_dir is not None:
+            tracing.start(trace_dir, camera_name)
+        self.store = open_store(self.camera_dir, storage_format, compression)
+        self.manifest = CaptureManifest(self.camera_dir)
+        self.drop_log = DropLog(self.camera_dir)
+        self.drops = Counter()
+        self.frame_count = 0
+
+    def initialize_camera(self):
+        print(f"Initializing device: {self.camera_name}")
+        streams = self.source.open()
+        if streams is not None:
+            self._start_writers(SharedFrameRing(streams, num_slots=self.num_slots))
+
+    def _start_writers(self, ring):
+        self.writer_pool.ring = ring
+        self.writer_pool.start()
+
+    def record_frames(self):
+        start_time = time.time()
+        last_report = (start_time, 0)
+        print(f"CAM {self.camera_name}: Starting recording...")
+        if self.compositor is not None:
+            self.compositor.start()
+        if self.trigger is not None:
+            self.trigger.set_ready()
+        elif self.record_fps:
+            self.scheduler = CaptureScheduler(self.record_fps, self.schedule_origin)
+        if tracing.tracer:
+            tracing.tracer.lap("initialize")
+
+        try:
+            while True:
+                if self.trigger is not None:
+                    tick = self.trigger.wait()
+                    if tracing.tracer:
+                        tracing.tracer.lap("wait")
+                    if tick is None:
+                        break
+                    grab_start_ns = time.monotonic_ns()
+                    frame = self.source.grab_latest()
+                    if frame is not None:
+                        self.trigger.done(tick, self.frame_count, time.monotonic_ns())
+                elif self.scheduler is not None:
+                    # Take the freshest frame at each tick instead of sleeping
+                    # after a blocking grab, so frames are neither stale nor
+                    # paced by the device queue
+                    self.scheduler.wait()
+                    if tracing.tracer:
+                        tracing.tracer.lap("wait")
+                    grab_start_ns = time.monotonic_ns()
+                    frame = self.source.grab_latest()
+                else:
+                    grab_start_ns = time.monotonic_ns()
+                    frame = self.source.grab()
+                if tracing.tracer:
+                    tracing.tracer.lap("grab")
+                if frame is None:
+                    break
+                streams, device_us = frame
+                self.manifest.record(self.frame_count, grab_start_ns, device_us)
+                if self.metrics is not None:
+                    self._update_metrics(grab_start_ns)
+
+                if self.frame_count == 0 and self.source.intrinsics is not None:
+                    # Lets readers derive point clouds and normals from depth
+                    write_intrinsics(self.camera_dir, self.source.intrinsics)
+                if self.frame_count == 0 and self.source.calibration is not None:
+                    # Lets utils.align_depth align the depth offline
+                    write_calibration(self.camera_dir, self.source.calibration)
+                if tracing.tracer:
+                    tracing.tracer.lap("manifest")
+
+                if self.writer_pool.ring is None:
+                    # Frame sizes depend on the camera, size the ring from the
+                    # first frame
+                    self._start_writers(
+                        SharedFrameRing.from_arrays(streams, num_slots=self.num_slots)
+                    )
+
+                # Copy frames into shared memory and save them asynchronously
+                dropped = self.writer_pool.push(
+                    self.frame_count, streams, self.store, self.frame_count
+                )
+                for frame_number, stream in dropped:
+                    self.drop_log.record(frame_number, stream)
+                    self.drops[stream or "frames"] += 1
+                if self.metrics is not None:
+                    self.metrics.set("queue_depth", self.writer_pool.pending)
+                    for _, stream in dropped:
+                        self.metrics.count(
+                            "dropped_frames" if stream is None else "dropped_streams"
+                        )
+                if tracing.tracer:
+                    tracing.tracer.lap("push")
+
+                if self.preview is not None:
+                    self.preview.update(streams)
+                    if tracing.tracer:
+                        tracing.tracer.lap("preview")
+
+                self.frame_count += 1
+
+                # Display progress
+                if self.frame_count % 30 == 0:
+                    now = time.time()
+                    written_bytes = self.writer_pool.written_bytes
+                    rate = (written_bytes - last_report[1]) / (now - last_report[0])
+                    last_report = (now, written_bytes)
+                    progress = f"CAM {self.camera_name}: Recorded... {int(now - start_time)} seconds, {self.frame_count} frames, {self.writer_pool.pending} pending writes, {rate / 1e6:.1f} MB/s written"
+                    if self.drops:
+                        progress += f", dropped {self._drop_counts()}"
+                    print(progress)
+
+        except KeyboardInterrupt:
+            print(f"CAM {self.camera_name}: Stopping recording...")
+
+        except Exception as e:
+            print(f"CAM {self.camera_name}: Error - {e}")
+
+        finally:
+            self.stop_recording()
+
+    def _update_metrics(self, grab_start_ns):
+        now_ns = time.monotonic_ns()
+        self.metrics.count("frames")
+        self.metrics.set("last_frame_ns", now_ns)
+        self.metrics.observe("grab_latency", (now_ns - grab_start_ns) // 1000)
+        if self.source.align_us is not None:
+            self.metrics.observe("align", self.source.align_us)
+        if self.scheduler is not None:
+            self.metrics.set("missed_ticks", self.scheduler.missed)
+
+    def _drop_counts(self):
+        return ", ".join(f"{name} {count}" for name, count in self.drops.items())
+
+    def stop_recording(self):
+        if self.trigger is not None:
+            self.trigger.set_ready(False)
+        if self.scheduler is not None:
+            print(f"CAM {self.camera_name}: Schedule {self.scheduler.summary()}")
+        self.writer_pool.close()
+        if self.drops:
+            print(f"CAM {self.camera_name}: Dropped {self._drop_counts()}")
+        self.manifest.close()
+        self.drop_log.close()
+        tracing.stop()
+        if self.compositor is not None and self.compositor.is_alive():
+            self.preview.board.stop()
+            self.compositor.join()
+        self.source.close()
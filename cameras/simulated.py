@@ -0,0 +1,482 @@
+"""Simulated camera sources for recording without devices.
+
+``SyntheticSource`` generates frames with the shapes and dtypes of a real
+camera at a fixed rate, ``ReplaySource`` plays back a recorded camera
+directory. Both plug into any recorder through its ``source`` argument, so the
+capture and write path runs unchanged, e.g.
+
+    recorder = RealSenseRecorder(
+        "sim-d455", False, source=SyntheticSource(realsense.stream_spec("d455"))
+    )
+
+Usage:
+    python -m cameras.simulated --camera d455 --count 4 --fps 30 --num_frames 300
+    python -m cameras.simulated --camera zed --replay recorded_data/<timestamp>/camera_zed2i_quality
+"""
+
+from datetime import datetime
+from multiprocessing import Process
+from pathlib import Path
+import argparse
+import time
+
+import numpy as np
+
+from cameras import kinect, mechmind, realsense, zed
+from cameras.recorder import CameraSource, join_processes, select_streams
+from utils.frame_store import STORAGE_FORMATS
+from utils.manifest import MANIFEST_FILE, read_manifest
+from utils.metrics import MetricsBoard, serve_metrics
+from utils.pointcloud import read_intrinsics
+from utils.preview import PreviewBoard, run_compositor
+from utils.session_reader import CameraReader
+from utils.tracing import TRACE_FILE, merge_traces
+from utils.trigger import FRAME_SETS_FILE, SoftwareTrigger, run_trigger
+from utils.writer_pool import DROP_POLICIES
+
+CAMERAS = list(realsense.color_resolution_dict) + ["zed", "kinect", "mechmind"]
+
+
+def camera_stream_spec(camera):
+    """Stream spec of a camera type, see ``CAMERAS``."""
+    if camera in realsense.color_resolution_dict:
+        return realsense.stream_spec(camera)
+    if camera == "zed":
+        return zed.stream_spec()
+    if camera == "kinect":
+        return kinect.stream_spec()
+    if camera == "mechmind":
+        return mechmind.stream_spec()
+    raise ValueError(f"Unknown camera {camera}")
+
+
+def make_recorder(camera, source, index=0, vis=False, **recorder_kwargs):
+    """Recorder of a camera type reading from ``source``.
+
+    Simulated cameras are named ``sim<index>_<camera>`` so several of the same
+    type can record into one session.
+    """
+    name = f"sim{index}_{camera}"
+    if camera in realsense.color_resolution_dict:
+        return realsense.RealSenseRecorder(name, vis, source=source, **recorder_kwargs)
+    if camera == "zed":
+        return zed.ZedRecorder(vis, source=source, camera_name=name, **recorder_kwargs)
+    if camera == "kinect":
+        return kinect.KinectRecorder(
+            vis, source=source, camera_name=name, **recorder_kwargs
+        )
+    if camera == "mechmind":
+        # MecheyeRecorder takes a capture interval instead of a recording rate
+        record_fps = recorder_kwargs.pop("record_fps", None)
+        return mechmind.MecheyeRecorder(
+            name,
+            interval=1 / record_fps if record_fps else 0,
+            vis=vis,
+            source=source,
+            camera_name=name,
+            **recorder_kwargs,
+        )
+    raise ValueError(f"Unknown camera {camera}")
+
+
+class SyntheticSource(CameraSource):
+    """Random frames matching a stream spec, delivered at ``fps``.
+
+    A few frames are generated up front and cycled, so producing a frame costs
+    nothing and the recorder and writers are the only load.
+
+    Args:
+        streams (dict): Stream name -> (shape, dtype), e.g. from a camera
+            module's ``stream_spec``
+        fps (float): Device frame rate, None to deliver frames immediately
+        num_frames (int): Stop after the device produced this many frames,
+            None to run until interrupted
+        num_variants (int): Number of distinct frames to cycle through
+        seed (int): Seed of the random frames
+        intrinsics (dict): Intrinsics reported for the frames, default a
+            centered pinhole with focal length equal to the image width
+    """
+
+    def __init__(
+        self,
+        streams,
+        fps=30,
+        num_frames=None,
+        num_variants=4,
+        seed=0,
+        intrinsics=None,
+    ):
+        self.streams = streams
+        self.intrinsics = intrinsics
+        self.fps = fps
+        self.num_frames = num_frames
+        self.num_variants = num_variants
+        self.seed = seed
+        self.frames = None
+
+    def open(self):
+        rng = np.random.default_rng(self.seed)
+        self.frames = [
+            {
+                name: random_array(rng, shape, dtype)
+                for name, (shape, dtype) in self.streams.items()
+            }
+            for _ in range(self.num_variants)
+        ]
+        if self.intrinsics is None:
+            (height, width, *_), _ = next(iter(self.streams.values()))
+            self.intrinsics = dict(
+                fx=width,
+                fy=width,
+                cx=width / 2,
+                cy=height / 2,
+                width=width,
+                height=height,
+            )
+        self.count = 0
+        self.next_frame_time = time.monotonic()
+        return self.streams
+
+    def grab(self):
+        if self.fps:
+            # Frames arrive on the device's clock whether or not they are read;
+            # frames not grabbed before the next one arrives are dropped
+            period = 1 / self.fps
+            now = time.monotonic()
+            if now >= self.next_frame_time + period:
+                missed = int((now - self.next_frame_time) / period)
+                self.next_frame_time += missed * period
+                self.count += missed
+            elif self.next_frame_time > now:
+                time.sleep(self.next_frame_time - now)
+            frame_time = self.next_frame_time
+            self.next_frame_time += period
+        else:
+            frame_time = time.monotonic()
+        if self.num_frames is not None and self.count >= self.num_frames:
+            return None
+
+        frame = self.frames[self.count % len(self.frames)]
+        self.count += 1
+        # Device timestamps are on the frame grid, so drops show up as gaps
+        return frame, int(frame_time * 1e6)
+
+
+def random_array(rng, shape, dtype):
+    dtype = np.dtype(dtype)
+    if dtype.kind in "ui":
+        return rng.integers(0, np.iinfo(dtype).max, size=shape, dtype=dtype)
+    # Float streams are depth and geometry in meters
+    return rng.uniform(0.3, 3.0, size=shape).astype(dtype)
+
+
+class ReplaySource(CameraSource):
+    """Frames of a recorded camera directory, in frame-number order.
+
+    Only frames present in every stream are replayed. Device timestamps come
+    from the capture manifest when there is one.
+
+    Args:
+        camera_dir (str): Recorded camera directory
+        streams (list): Names of the streams to replay
+        fps (float): Replay rate, None to replay as fast as possible
+        loop (bool): Start over at the end instead of stopping
+    """
+
+    def __init__(self, camera_dir, streams, fps=None, loop=False):
+        self.camera_dir = camera_dir
+        self.streams = list(streams)
+        self.fps = fps
+        self.loop = loop
+
+    def open(self):
+        camera = CameraReader(self.camera_dir)
+        missing = [stream for stream in self.streams if stream not in camera]
+        if missing:
+            raise ValueError(f"{self.camera_dir} has no {', '.join(missing)} frames")
+        self.readers = [camera[stream] for stream in self.streams]
+
+        self.frame_numbers = self.readers[0].frame_numbers
+        for reader in self.readers[1:]:
+            self.frame_numbers = np.intersect1d(
+                self.frame_numbers, reader.frame_numbers
+            )
+        if not len(self.frame_numbers):
+            raise ValueError(f"{self.camera_dir} has no complete frames")
+
+        self.device_us = np.full(len(self.frame_numbers), -1, dtype=np.int64)
+        if (camera.camera_dir / MANIFEST_FILE).exists():
+            records = read_manifest(camera.camera_dir)
+            i = np.searchsorted(records["frame"], self.frame_numbers)
+            i = np.minimum(i, max(len(records) - 1, 0))
+            if len(records):
+                found = records["frame"][i] == self.frame_numbers
+                self.device_us[found] = records["device_us"][i[found]]
+
+        self.intrinsics = read_intrinsics(camera.camera_dir)
+        self.position = 0
+        self.next_frame_time = time.monotonic()
+        # Frame sizes are those of the recording, known from the first frame
+        return None
+
+    def grab(self):
+        if self.position == len(self.frame_numbers):
+            if not self.loop:
+                return None
+            self.position = 0
+        if self.fps:
+            now = time.monotonic()
+            if self.next_frame_time > now:
+                time.sleep(self.next_frame_time - now)
+            self.next_frame_time = max(self.next_frame_time, now) + 1 / self.fps
+
+        frame_number = self.frame_numbers[self.position]
+        frame = {
+            stream: reader.get(frame_number)
+            for stream, reader in zip(self.streams, self.readers)
+        }
+        device_us = int(self.device_us[self.position])
+        self.position += 1
+        return frame, device_us
+
+
+class SimulatedRecordProcess(Process):
+    def __init__(self, camera, index, source, vis=False, **recorder_kwargs):
+        super(SimulatedRecordProcess, self).__init__()
+        self.camera = camera
+        self.index = index
+        self.source = source
+        self.vis = vis
+        self.recorder_kwargs = recorder_kwargs
+
+    def run(self):
+        recorder = make_recorder(
+            self.camera, self.source, self.index, self.vis, **self.recorder_kwargs
+        )
+        recorder.initialize_camera()
+        recorder.record_frames()
+
+
+def main(args):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    recorder_kwargs = dict(
+        timestamp=timestamp,
+        output_path=args.output_path,
+        record_fps=args.record_fps,
+        num_writers=args.num_writers,
+        num_slots=args.num_slots,
+        drop_policy=args.drop_policy,
+        storage_format=args.format,
+        compression=args.compression,
+    )
+    session_dir = Path(args.output_path) / timestamp
+    if args.trace:
+        recorder_kwargs["trace_dir"] = session_dir / "trace"
+    if args.phase_align:
+        # All cameras capture on the same tick boundaries
+        recorder_kwargs["schedule_origin"] = time.monotonic()
+
+    streams = select_streams(
+        camera_stream_spec(args.camera),
+        args.streams.split(",") if args.streams is not None else None,
+    )
+
+    trigger = None
+    if args.sync_fps:
+        trigger = SoftwareTrigger(
+            [f"sim{index}_{args.camera}" for index in range(args.count)]
+        )
+
+    board = None
+    if args.vis:
+        # One compositor tiles the previews of all cameras
+        board = PreviewBoard(
+            [f"sim{index}_{args.camera}" for index in range(args.count)],
+            fps=args.preview_fps,
+        )
+        compositor = Process(
+            target=run_compositor,
+            args=(board, args.preview_output, args.preview_port),
+        )
+        compositor.start()
+
+    metrics = None
+    if args.metrics_port is not None:
+        metrics = MetricsBoard(
+            [f"sim{index}_{args.camera}" for index in range(args.count)],
+            args.num_writers,
+        )
+        metrics_server = serve_metrics(metrics, args.metrics_port)
+
+    processes = []
+    for index in range(args.count):
+        if trigger is not None:
+            recorder_kwargs["trigger"] = trigger.camera(index)
+        if metrics is not None:
+            recorder_kwargs["metrics"] = metrics.camera(index)
+        if board is not None:
+            recorder_kwargs["preview"] = board.camera(index)
+        if args.replay is not None:
+            source = ReplaySource(
+                args.replay,
+                streams,
+                fps=args.fps,
+                loop=args.loop,
+            )
+        else:
+            source = SyntheticSource(
+                streams,
+                fps=args.fps,
+                num_frames=args.num_frames,
+                seed=index,
+            )
+        p = SimulatedRecordProcess(
+            args.camera, index, source, vis=args.vis, **recorder_kwargs
+        )
+        p.start()
+        processes.append(p)
+
+    try:
+        if trigger is not None:
+            run_trigger(
+                trigger,
+                args.sync_fps,
+                processes,
+                session_dir / FRAME_SETS_FILE,
+            )
+
+        # Wait for all processes to complete, Ctrl-C stops the recorders
+        join_processes(processes)
+    finally:
+        if board is not None:
+            board.stop()
+            compositor.join()
+        if metrics is not None:
+            metrics_server.shutdown()
+        if args.trace:
+            merge_traces(session_dir / "trace", session_dir / TRACE_FILE)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Record from simulated cameras")
+    parser.add_argument(
+        "--camera", type=str, choices=CAMERAS, help="Camera to simulate", default="d455"
+    )
+    parser.add_argument(
+        "--count", type=int, help="Number of simulated cameras", default=1
+    )
+    parser.add_argument(
+        "--replay",
+        type=str,
+        help="Replay this recorded camera directory instead of synthetic frames",
+        default=None,
+    )
+    parser.add_argument(
+        "--loop", action="store_true", help="Loop the replayed recording"
+    )
+    parser.add_argument(
+        "--fps",
+        type=float,
+        help="Simulated device frame rate, 0 for unpaced",
+        default=30,
+    )
+    parser.add_argument(
+        "--record_fps", type=float, help="Recording rate, 0 for unpaced", default=5
+    )
+    parser.add_argument(
+        "--num_frames",
+        type=int,
+        help="Number of synthetic frames per camera, default until Ctrl-C",
+        default=None,
+    )
+    parser.add_argument(
+        "--output_path", type=str, help="Output directory", default="./recorded_data"
+    )
+    parser.add_argument(
+        "--streams",
+        type=str,
+        help="Comma-separated streams to record, default all",
+        default=None,
+    )
+    parser.add_argument(
+        "--vis", action="store_true", help="Preview the color and depth streams"
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Trace the capture and write stages into a Chrome trace, trace.json",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        help="Serve per-camera capture metrics in Prometheus format on this localhost port",
+        default=None,
+    )
+    parser.add_argument(
+        "--preview_fps",
+        type=float,
+        help="Rate of the live preview mosaic",
+        default=10,
+    )
+    parser.add_argument(
+        "--preview_output",
+        type=str,
+        help="Write the preview mosaic to this MJPEG video (.avi) instead of a window",
+        default=None,
+    )
+    parser.add_argument(
+        "--preview_port",
+        type=int,
+        help="Serve the preview mosaic as MJPEG on this localhost port instead of a window",
+        default=None,
+    )
+    parser.add_argument(
+        "--num_writers",
+        type=int,
+        help="Number of writer processes per camera",
+        default=2,
+    )
+    parser.add_argument(
+        "--num_slots",
+        type=int,
+        help="Number of shared-memory frame slots per camera",
+        default=8,
+    )
+    parser.add_argument(
+        "--drop_policy",
+        type=str,
+        choices=DROP_POLICIES,
+        help="What to do when all frame slots are waiting to be written",
+        default="block",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=STORAGE_FORMATS,
+        help="Save loose PNG/NPY files or one chunked container per stream",
+        default="files",
+    )
+    parser.add_argument(
+        "--sync_fps",
+        type=float,
+        help="Trigger all cameras together at this rate and save the frame sets",
+        default=None,
+    )
+    parser.add_argument(
+        "--phase_align",
+        action="store_true",
+        help="Capture all cameras on the same tick boundaries",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=["zlib"],
+        help="Chunk compression for the container format",
+        default=None,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
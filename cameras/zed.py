@@ -1,38 +1,63 @@
-import pyzed.sl as sl
+try:
+    import pyzed.sl as sl
+
+    mode_dict = {
+        "PERFORMANCE": sl.DEPTH_MODE.PERFORMANCE,
+        "QUALITY": sl.DEPTH_MODE.QUALITY,
+        "ULTRA": sl.DEPTH_MODE.ULTRA,
+        "NEURAL": sl.DEPTH_MODE.NEURAL,
+    }
+except ImportError:
+    sl = None  # Only simulated sources are available
 import numpy as np
-import time
 from pathlib import Path
 from datetime import datetime
-from multiprocessing import Process
-import cv2
+from functools import partial
 import argparse
+import queue
+import threading
 
-mode_dict = {
-    "PERFORMANCE": sl.DEPTH_MODE.PERFORMANCE,
-    "QUALITY": sl.DEPTH_MODE.QUALITY,
-    "ULTRA": sl.DEPTH_MODE.ULTRA,
-    "NEURAL": sl.DEPTH_MODE.NEURAL,
-}
+from cameras.recorder import CameraSource, Recorder, make_camera_dir, select_streams
+from utils import tracing
+from utils.depth_encoding import write_depth, write_depth_info
 
 ZED_FPS = 30
 RECORD_FPS = 5
 
 
-def save_data(image, image_R, depth, normal_map, pcd, camera_dir, frame_count):
-    np.save(
-        str(camera_dir / f"raw_depth_{frame_count}.npy"), depth
-    )  # 32-bit float array
-    cv2.imwrite(str(camera_dir / f"color_{frame_count}.png"), image)
-    cv2.imwrite(str(camera_dir / f"R_color_{frame_count}.png"), image_R)
-    depth_img = depth * 1000
-    depth_img = np.nan_to_num(depth_img, 0)
-    depth_img[depth_img > 65535] = 65535
-    depth_img[depth_img < 1e-5] = 0
-    cv2.imwrite(
-        str(camera_dir / f"depth_{frame_count}.png"), depth_img.astype(np.uint16)
-    )  # 16-bit uint array
-    np.save(str(camera_dir / f"normal_{frame_count}.npy"), normal_map)
-    np.save(str(camera_dir / f"pcd_{frame_count}.npy"), pcd)  # 32-bit float array
+# Depth streams stored for each depth_encoding, see utils.depth_encoding
+depth_encodings = {
+    "both": [("raw_depth", "float32"), ("depth", "uint16")],
+    "float32": [("raw_depth", "float32")],
+    "float16": [("raw_depth", "float16")],
+    "uint16": [("depth", "uint16")],
+}
+
+
+def save_data(
+    store,
+    frame_count,
+    color=None,
+    R_color=None,
+    raw_depth=None,
+    normal=None,
+    pcd=None,
+    depth_encoding="both",
+    depth_scale=1000.0,
+):
+    if color is not None:
+        store.write_image("color", frame_count, color)
+    if R_color is not None:
+        store.write_image("R_color", frame_count, R_color)
+    if raw_depth is not None:
+        # Depth in meters, as 32-bit float array and/or 16-bit uint millimeters
+        for stream, encoding in depth_encodings[depth_encoding]:
+            write_depth(store, stream, frame_count, raw_depth, encoding, depth_scale)
+    if normal is not None:
+        store.write_array("normal", frame_count, normal)
+    if pcd is not None:
+        store.write_array("pcd", frame_count, pcd)  # 32-bit float array
+    store.finish_frame(frame_count)
 
 
 def init_zed(depth_mode, svo_file=None, async_mode=False, svo_real_time=False):
@@ -68,46 +93,54 @@ def init_zed(depth_mode, svo_file=None, async_mode=False, svo_real_time=False):
     return zed, runtime_params
 
 
-class ZedRecorder:
+def stream_spec(image_resolution=(1280, 720), measure_resolution=None):
+    """Shapes and dtypes of the recorded frames.
+
+    Images are retrieved at display resolution, measures at camera resolution.
+    """
+    width, height = image_resolution
+    measure_width, measure_height = measure_resolution or image_resolution
+    image_shape = (height, width, 4)
+    measure_shape = (measure_height, measure_width)
+    return {
+        "color": (image_shape, np.uint8),
+        "R_color": (image_shape, np.uint8),
+        "raw_depth": (measure_shape, np.float32),
+        "normal": ((*measure_shape, 4), np.float32),
+        "pcd": ((*measure_shape, 4), np.float32),
+    }
+
+
+class ZedSource(CameraSource):
+    """Frames of a ZED camera or SVO file.
+
+    With ``num_buffers`` >= 2, frames are captured by a background thread
+    into a pool of preallocated ``sl.Mat`` sets: the SDK grabs and computes
+    depth for the next frame while the recorder copies the previous one into
+    shared memory. A set returns to the pool on the next ``grab``, once the
+    recorder is done with it. Live cameras drop the oldest captured frame when
+    the recorder falls behind; SVO files without real-time mode never drop.
+    """
+
     def __init__(
         self,
-        vis,
-        depth_mode="quality",
+        depth_mode,
         svo_file=None,
         async_mode=True,
         svo_real_time=False,
-        output_path="./recorded_data",
+        streams=None,
+        num_buffers=0,
     ):
-        self.vis = vis
+        self.depth_mode = depth_mode
+        self.streams = streams
         self.svo_file = svo_file
         self.async_mode = async_mode
         self.svo_real_time = svo_real_time
+        self.num_buffers = num_buffers
+        self.drop_stale = svo_file is None or svo_real_time
+        self.zed = None
 
-        self.camera_name = "zed2i"
-        self.depth_mode = depth_mode
-
-        # Create output directory
-        output_path = Path(output_path)
-        output_path.mkdir(exist_ok=True)
-
-        # Create timestamp-based directory
-        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-        if svo_file is not None:
-            self.timestamp = (
-                svo_file.split("/")[-1]
-                .replace(".svo2", "")
-                .replace(".svo", "")
-                .replace("zed_", "")
-            )
-        session_dir = output_path / self.timestamp
-
-        # Create camera directory
-        self.camera_dir = session_dir / f"camera_{self.camera_name}_{self.depth_mode}"
-        self.camera_dir.mkdir(parents=True, exist_ok=True)
-
-    def initialize_camera(self):
-        print(f"Initializing device: {self.camera_name}")
-
+    def open(self):
         # Setup pipeline and config for each camera
         self.zed, self.runtime_param = init_zed(
             depth_mode=str.upper(self.depth_mode),
@@ -130,126 +163,304 @@ class ZedRecorder:
             / camera_info.camera_configuration.resolution.height,
         ]
         # cv_viewer.render_2D(image_left_ocv,image_scale, bodies.body_list, body_param.enable_tracking, body_param.body_format)
-        self.image = sl.Mat()
-        self.image_R = sl.Mat()
-        self.ptcloud = sl.Mat()
-        self.depth_img = sl.Mat()
-        self.depth = sl.Mat()
-        self.normal_map = sl.Mat()
-
-        self.frame_count = 0
 
-    def replay_frames(self):
-        self.record_frames("", replay=True)
-
-    def record_frames(self, record_path, replay=False):
-        start_time = time.time()
-        print(f"CAM {self.camera_name}: Starting recording...")
+        # Measures are retrieved at camera resolution, same as the calibration
+        left_cam = camera_info.camera_configuration.calibration_parameters.left_cam
+        self.intrinsics = dict(
+            fx=left_cam.fx,
+            fy=left_cam.fy,
+            cx=left_cam.cx,
+            cy=left_cam.cy,
+            width=camera_info.camera_configuration.resolution.width,
+            height=camera_info.camera_configuration.resolution.height,
+        )
 
-        if not replay:
-            svo_filename = record_path + f"/zed_{self.timestamp}" + ".svo"
-            recording_param = sl.RecordingParameters(
-                svo_filename, sl.SVO_COMPRESSION_MODE.H264
-            )
-            err = self.zed.enable_recording(recording_param)
-
-            if err != sl.ERROR_CODE.SUCCESS:
-                print("Recording ZED : ", err)
-                exit(1)
-
-        print(
-            "SVO is Recording, use Ctrl-C to stop."
-        )  # Start recording SVO, stop with Ctrl-C command
-        while True:
-            record_time_start = time.time()
-            if (
-                self.zed.grab(self.runtime_param) == sl.ERROR_CODE.SUCCESS
-            ):  # Check that a new image is successfully acquired
+        self.spec = select_streams(
+            stream_spec(
+                (display_resolution.width, display_resolution.height),
+                (
+                    camera_info.camera_configuration.resolution.width,
+                    camera_info.camera_configuration.resolution.height,
+                ),
+            ),
+            self.streams,
+        )
+        if not {"raw_depth", "normal", "pcd"} & set(self.spec):
+            # No measures are retrieved, skip the depth computation
+            self.runtime_param.enable_depth = False
+
+        # One sl.Mat per selected stream and buffer, allocated by the SDK on
+        # the first retrieve and reused afterwards
+        self.mat_sets = [
+            {name: sl.Mat() for name in self.spec}
+            for _ in range(max(self.num_buffers, 1))
+        ]
+        self.free_sets = queue.Queue()
+        for mats in self.mat_sets:
+            self.free_sets.put(mats)
+        self.filled_sets = queue.Queue()
+        self.held_set = None
+        self.capture_thread = None
+        self.stop_event = threading.Event()
+        self.dropped = 0
+        return self.spec
+
+    def enable_recording(self, svo_filename):
+        recording_param = sl.RecordingParameters(
+            svo_filename, sl.SVO_COMPRESSION_MODE.H264
+        )
+        err = self.zed.enable_recording(recording_param)
+
+        if err != sl.ERROR_CODE.SUCCESS:
+            print("Recording ZED : ", err)
+            exit(1)
+
+    def _grab(self):
+        """Grab the next frame, return its device time or None if there is none."""
+        if (
+            self.zed.grab(self.runtime_param) != sl.ERROR_CODE.SUCCESS
+        ):  # Check that a new image is successfully acquired
+            return None
+        image_timestamp = self.zed.get_timestamp(sl.TIME_REFERENCE.IMAGE)
+        if tracing.tracer:
+            tracing.tracer.lap("grab")
+        return image_timestamp.get_microseconds()
+
+    def _retrieve(self, mats):
+        """Retrieve the selected streams of the grabbed frame into ``mats``."""
+        streams = {}
+        for name, mat in mats.items():
+            if name == "color":
                 # Retrieve left image
                 self.zed.retrieve_image(
-                    self.image, sl.VIEW.LEFT, sl.MEM.CPU, self.display_resolution
+                    mat, sl.VIEW.LEFT, sl.MEM.CPU, self.display_resolution
                 )
+            elif name == "R_color":
                 self.zed.retrieve_image(
-                    self.image_R, sl.VIEW.RIGHT, sl.MEM.CPU, self.display_resolution
-                )
-
-                # self.zed.retrieve_image(self.depth_img, sl.VIEW.DEPTH, ) # uint8
-                # depth_img_np = np.array(self.depth_img.get_data())
-                self.zed.retrieve_measure(
-                    self.depth,
-                    sl.MEASURE.DEPTH,
-                )  # uint32, aligned to the left image
-                self.zed.retrieve_measure(
-                    self.ptcloud,
-                    sl.MEASURE.XYZ,
+                    mat, sl.VIEW.RIGHT, sl.MEM.CPU, self.display_resolution
                 )
-                self.zed.retrieve_measure(self.normal_map, sl.MEASURE.NORMALS)
-
-                image_np = np.array(self.image.get_data())
-                image_R_np = np.array(self.image_R.get_data())
-                ptcloud_np = np.array(self.ptcloud.get_data())
-                depth_np = np.array(self.depth.get_data())
-                normal_map_np = np.array(self.normal_map.get_data())
-
-                if self.vis:
-                    cv2.imshow(f"{self.camera_name} Visualization", image_np)
-                    cv2.waitKey(1)
-
-                # Save frames
-                # Create a process to save data asynchronously
-                save_process = Process(
-                    target=save_data,
-                    args=(
-                        image_np.copy(),
-                        image_R_np.copy(),
-                        depth_np.copy(),
-                        normal_map_np.copy(),
-                        ptcloud_np.copy(),
-                        self.camera_dir,
-                        self.frame_count,
-                    ),
-                )
-                save_process.start()
-
-                self.frame_count += 1
-                # Display progress
-                if self.frame_count % 30 == 0:
-                    print(
-                        f"CAM {self.camera_name}: Recorded... {int(time.time() - start_time)} seconds, {self.frame_count} frames"
-                    )
-
-                if not replay:
-                    time.sleep(
-                        max(0, 1 / RECORD_FPS - (time.time() - record_time_start))
-                    )  # fps = RECORD_FPS
-
-            else:
-                self.stop_record()
+            elif name == "raw_depth":
+                # Float depth in meters, aligned to the left image
+                self.zed.retrieve_measure(mat, sl.MEASURE.DEPTH)
+            elif name == "normal":
+                self.zed.retrieve_measure(mat, sl.MEASURE.NORMALS)
+            elif name == "pcd":
+                self.zed.retrieve_measure(mat, sl.MEASURE.XYZ)
+            streams[name] = mat.get_data()
+            if tracing.tracer:
+                tracing.tracer.lap(f"retrieve {name}")
+        return streams
+
+    def grab_into(self, mats):
+        """Grab a frame and retrieve the selected streams into ``mats``.
+
+        Returns:
+            tuple: (streams, device_us) with views on the ``sl.Mat`` buffers,
+                or None if no frame could be grabbed
+        """
+        device_us = self._grab()
+        if device_us is None:
+            return None
+        return self._retrieve(mats), device_us
+
+    def _next_free_set(self):
+        while not self.stop_event.is_set():
+            if self.drop_stale:
+                # Reuse the oldest frame the recorder has not taken yet
+                try:
+                    return self.free_sets.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    mats, *_ = self.filled_sets.get_nowait()
+                    self.dropped += 1
+                    return mats
+                except queue.Empty:
+                    pass
+            try:
+                return self.free_sets.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _capture_loop(self):
+        try:
+            while True:
+                # A set is only taken, or a stale frame dropped, once there is
+                # a newer frame to retrieve into it
+                device_us = self._grab()
+                if device_us is None:
+                    break
+                mats = self._next_free_set()
+                if mats is None:
+                    break
+                self.filled_sets.put((mats, self._retrieve(mats), device_us))
+        except Exception as e:
+            print(f"ZED capture error - {e}")
+        finally:
+            self.filled_sets.put(None)
+
+    def grab(self):
+        if self.num_buffers < 2:
+            # Views on the sl.Mat buffers are copied once into shared memory
+            # before the next grab
+            return self.grab_into(self.mat_sets[0])
+
+        if self.capture_thread is None:
+            # Started on the first grab so SVO recording is enabled first
+            self.capture_thread = threading.Thread(
+                target=self._capture_loop, daemon=True
+            )
+            self.capture_thread.start()
+        if self.held_set is not None:
+            # The recorder copied the previous frame, recycle its buffers
+            self.free_sets.put(self.held_set)
+            self.held_set = None
+
+        frame = self.filled_sets.get()
+        if tracing.tracer:
+            tracing.tracer.lap("wait_capture_thread")
+        if frame is None:
+            return None
+        self.held_set, streams, device_us = frame
+        return streams, device_us
+
+    def grab_latest(self):
+        if self.num_buffers < 2 or not self.drop_stale:
+            # A live grab waits for the next frame of the camera
+            return self.grab()
+        frame = self.grab()
+        while frame is not None:
+            # Skip to the newest captured frame, recycling the older ones
+            try:
+                newer = self.filled_sets.get_nowait()
+            except queue.Empty:
                 break
-
-    def stop_record(self):
+            if newer is None:
+                # The source ended after this frame, the next grab sees it
+                self.filled_sets.put(None)
+                break
+            self.free_sets.put(self.held_set)
+            self.dropped += 1
+            self.held_set, streams, device_us = newer
+            frame = streams, device_us
+        return frame
+
+    def close(self):
+        if self.zed is None:
+            return
+        if self.capture_thread is not None:
+            self.stop_event.set()
+            self.capture_thread.join()
+            self.capture_thread = None
+            if self.dropped:
+                print(f"ZED: dropped {self.dropped} frames the recorder fell behind on")
         self.zed.disable_recording()
 
-    def __del__(self):
-        self.image.free(sl.MEM.CPU)
-        self.image_R.free(sl.MEM.CPU)
-        self.ptcloud.free(sl.MEM.CPU)
-        # self.depth_img.free(sl.MEM.CPU)
-        self.depth.free(sl.MEM.CPU)
-        self.normal_map.free(sl.MEM.CPU)
+        for mats in self.mat_sets:
+            for mat in mats.values():
+                mat.free(sl.MEM.CPU)
 
         self.zed.disable_body_tracking()
         self.zed.disable_positional_tracking()
         self.zed.close()
+        self.zed = None
+
+
+class ZedRecorder(Recorder):
+    """Record images and measures from a ZED camera or an SVO file.
+
+    ``streams`` selects the recorded streams of ``stream_spec``, default all.
+    ``depth_encoding`` selects how depth is stored (see ``depth_encodings``),
+    ``depth_scale`` is the uint16 depth units per meter. ``num_buffers`` >= 2
+    captures frames on a background thread, see ``ZedSource``. Pass ``source``
+    (see ``cameras.simulated``) to record without a device.
+    """
+
+    def __init__(
+        self,
+        vis,
+        depth_mode="quality",
+        svo_file=None,
+        async_mode=True,
+        svo_real_time=False,
+        output_path="./recorded_data",
+        source=None,
+        camera_name="zed2i",
+        streams=None,
+        depth_encoding="both",
+        depth_scale=1000.0,
+        num_buffers=0,
+        timestamp=None,
+        **recorder_kwargs,
+    ):
+        self.depth_mode = depth_mode
+        if source is None:
+            source = ZedSource(
+                depth_mode, svo_file, async_mode, svo_real_time, streams, num_buffers
+            )
+
+        # Create timestamp-based directory
+        self.timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M")
+        if svo_file is not None:
+            self.timestamp = (
+                svo_file.split("/")[-1]
+                .replace(".svo2", "")
+                .replace(".svo", "")
+                .replace("zed_", "")
+            )
+
+        recorder_kwargs.setdefault("record_fps", RECORD_FPS)
+        recorder_kwargs.setdefault("droppable_streams", ("R_color", "normal", "pcd"))
+        super().__init__(
+            camera_name,
+            make_camera_dir(
+                output_path, f"camera_{camera_name}_{depth_mode}", self.timestamp
+            ),
+            source,
+            partial(save_data, depth_encoding=depth_encoding, depth_scale=depth_scale),
+            vis,
+            **recorder_kwargs,
+        )
+        write_depth_info(
+            self.camera_dir, depth_encodings[depth_encoding], "m", depth_scale
+        )
+
+    def replay_frames(self):
+        self.record_frames(replay=True)
+
+    def record_frames(self, record_path=None, replay=False):
+        if replay:
+            # Read the SVO file as fast as frames can be retrieved
+            self.record_fps = None
+        elif record_path is not None:
+            self.source.enable_recording(
+                record_path + f"/zed_{self.timestamp}" + ".svo"
+            )
+            print(
+                "SVO is Recording, use Ctrl-C to stop."
+            )  # Start recording SVO, stop with Ctrl-C command
+        super().record_frames()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Record from ZED camera")
     parser.add_argument("--depth_mode", type=str, help="Depth mode", default="quality")
     parser.add_argument("--svo", type=str, help="SVO file to record", default=None)
+    parser.add_argument(
+        "--num_buffers",
+        type=int,
+        help="Frame buffers of the capture thread, 0 to capture on the recording thread",
+        default=0,
+    )
     args = parser.parse_args()
 
-    recorder = ZedRecorder(depth_mode=args.depth_mode, vis=True, svo_file=args.svo)
+    recorder = ZedRecorder(
+        depth_mode=args.depth_mode,
+        vis=True,
+        svo_file=args.svo,
+        num_buffers=args.num_buffers,
+    )
     recorder.initialize_camera()
     svo_dir = Path("./tmp/")
     svo_dir.mkdir(exist_ok=True)
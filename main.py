@@ -1,8 +1,19 @@
+from datetime import datetime
 from multiprocessing import Process
 from pathlib import Path
 import argparse
 import time
 
+from cameras.recorder import join_processes, load_stream_config
+from utils.depth_encoding import ENCODINGS
+from utils.frame_store import STORAGE_FORMATS
+from utils.metrics import MetricsBoard, serve_metrics
+from utils.monitor_usb import BANDWIDTH_FILE, TEXT_SOURCE, run_monitor
+from utils.preview import PreviewBoard, run_compositor
+from utils.tracing import TRACE_FILE, merge_traces
+from utils.trigger import FRAME_SETS_FILE, SoftwareTrigger, run_trigger
+from utils.writer_pool import DROP_POLICIES
+
 try:
     from cameras.realsense import RealSenseRecorder, serial_number_dict
 except ImportError:
@@ -20,35 +31,38 @@ except ImportError:
 
 
 class KinectRecordProcess(Process):
-    def __init__(self, vis=False):
+    def __init__(self, vis=False, **recorder_kwargs):
         super(KinectRecordProcess, self).__init__()
         self.vis = vis
+        self.recorder_kwargs = recorder_kwargs
 
     def run(self):
-        recorder = KinectRecorder(self.vis)
+        recorder = KinectRecorder(self.vis, **self.recorder_kwargs)
         recorder.initialize_camera()
         recorder.record_frames()
 
 
 class RealsenseRecordProcess(Process):
-    def __init__(self, device, vis=False):
+    def __init__(self, device, vis=False, **recorder_kwargs):
         super(RealsenseRecordProcess, self).__init__()
         self.device = device
         self.vis = vis
+        self.recorder_kwargs = recorder_kwargs
 
     def run(self):
-        recorder = RealSenseRecorder(self.device, self.vis)
+        recorder = RealSenseRecorder(self.device, self.vis, **self.recorder_kwargs)
         recorder.initialize_camera()
         recorder.record_frames()
 
 
 class ZedRecordProcess(Process):
-    def __init__(self, vis=False):
+    def __init__(self, vis=False, **recorder_kwargs):
         super(ZedRecordProcess, self).__init__()
         self.vis = vis
+        self.recorder_kwargs = recorder_kwargs
 
     def run(self):
-        recorder = ZedRecorder(self.vis)
+        recorder = ZedRecorder(self.vis, **self.recorder_kwargs)
         recorder.initialize_camera()
         svo_dir = Path("./tmp/")
         svo_dir.mkdir(exist_ok=True)
@@ -57,6 +71,26 @@ class ZedRecordProcess(Process):
 
 def main(args):
     processes = []
+    # All cameras record into the same session directory
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    recorder_kwargs = dict(
+        num_writers=args.num_writers,
+        num_slots=args.num_slots,
+        drop_policy=args.drop_policy,
+        storage_format=args.format,
+        compression=args.compression,
+        timestamp=timestamp,
+    )
+    session_dir = Path("./recorded_data") / timestamp
+    if args.trace:
+        recorder_kwargs["trace_dir"] = session_dir / "trace"
+    if args.phase_align:
+        # All cameras capture on the same tick boundaries
+        recorder_kwargs["schedule_origin"] = time.monotonic()
+    stream_config = load_stream_config(args.stream_config, args.streams)
+
+    # (name, process class, process arguments) of every camera
+    cameras = []
     if args.rs:
         try:
             import pyrealsense2.pyrealsense2 as rs
@@ -68,28 +102,115 @@ def main(args):
 
         for device in devices:
             serial_number = device.get_info(rs.camera_info.serial_number)
-            p = RealsenseRecordProcess(
-                serial_number,
-                vis=str.lower(args.vis) in serial_number_dict[serial_number],
+            # Unknown cameras are named by serial number, like RealSenseRecorder
+            name = serial_number_dict.get(serial_number, serial_number)
+            cameras.append(
+                (
+                    name,
+                    RealsenseRecordProcess,
+                    dict(
+                        device=serial_number,
+                        vis=args.vis == "all" or str.lower(args.vis) in name,
+                        streams=stream_config.get(name),
+                        align=not args.defer_alignment,
+                    ),
+                )
             )
-            p.start()
-            processes.append(p)
-            # time.sleep(1)
 
     if args.zed:
-        p = ZedRecordProcess(str.lower(args.vis) in "zed")
-        p.start()
-        processes.append(p)
-        # time.sleep(0.8)
+        cameras.append(
+            (
+                "zed2i",
+                ZedRecordProcess,
+                dict(
+                    vis=args.vis == "all" or str.lower(args.vis) in "zed",
+                    depth_encoding=args.zed_depth_encoding,
+                    num_buffers=args.zed_buffers,
+                    streams=stream_config.get("zed2i"),
+                ),
+            )
+        )
 
     if args.kn:
-        p = KinectRecordProcess(str.lower(args.vis) in "kn")
+        cameras.append(
+            (
+                "kinect",
+                KinectRecordProcess,
+                dict(
+                    vis=args.vis == "all" or str.lower(args.vis) in "kn",
+                    streams=stream_config.get("kinect"),
+                    align=not args.defer_alignment,
+                ),
+            )
+        )
+
+    trigger = None
+    if args.sync_fps:
+        # Cameras grab on the ticks of one software trigger
+        trigger = SoftwareTrigger([name for name, *_ in cameras])
+
+    usb_monitor = None
+    if args.usb_monitor is not None:
+        # Controller load over the whole recording, saved next to the cameras
+        usb_monitor = Process(
+            target=run_monitor,
+            args=(
+                args.usb_monitor,
+                session_dir / BANDWIDTH_FILE,
+            ),
+            daemon=True,
+        )
+        usb_monitor.start()
+
+    board = None
+    previewed = [name for name, _, kwargs in cameras if kwargs["vis"]]
+    if previewed:
+        # One compositor tiles the previews of all cameras, off their capture loops
+        board = PreviewBoard(previewed, fps=args.preview_fps)
+        compositor = Process(
+            target=run_compositor,
+            args=(board, args.preview_output, args.preview_port),
+        )
+        compositor.start()
+
+    metrics = None
+    if args.metrics_port is not None:
+        metrics = MetricsBoard([name for name, *_ in cameras], args.num_writers)
+        metrics_server = serve_metrics(metrics, args.metrics_port)
+
+    for i, (name, process_class, process_kwargs) in enumerate(cameras):
+        if trigger is not None:
+            process_kwargs["trigger"] = trigger.camera(i)
+        if metrics is not None:
+            process_kwargs["metrics"] = metrics.camera(i)
+        if name in previewed:
+            process_kwargs["preview"] = board.camera(previewed.index(name))
+        p = process_class(**process_kwargs, **recorder_kwargs)
         p.start()
         processes.append(p)
 
-    # Wait for all processes to complete
-    for p in processes:
-        p.join()
+    try:
+        if trigger is not None:
+            run_trigger(
+                trigger,
+                args.sync_fps,
+                processes,
+                session_dir / FRAME_SETS_FILE,
+            )
+
+        # Wait for all processes to complete, Ctrl-C stops the recorders
+        join_processes(processes)
+    finally:
+        if board is not None:
+            board.stop()
+            compositor.join()
+        if usb_monitor is not None:
+            usb_monitor.terminate()
+            usb_monitor.join()
+        if metrics is not None:
+            metrics_server.shutdown()
+        if args.trace:
+            merge_traces(session_dir / "trace", session_dir / TRACE_FILE)
 
 
 def parse_args():
@@ -104,7 +225,122 @@ def parse_args():
         "--kn", action="store_true", help="Record from Azure Kinect camera"
     )
     parser.add_argument(
-        "--vis", type=str, help="Visualization, default using 455", default="none"
+        "--vis",
+        type=str,
+        help="Cameras to preview, e.g. 455, zed, kn or all",
+        default="none",
+    )
+    parser.add_argument(
+        "--preview_fps",
+        type=float,
+        help="Rate of the live preview mosaic",
+        default=10,
+    )
+    parser.add_argument(
+        "--preview_output",
+        type=str,
+        help="Write the preview mosaic to this MJPEG video (.avi) instead of a window",
+        default=None,
+    )
+    parser.add_argument(
+        "--preview_port",
+        type=int,
+        help="Serve the preview mosaic as MJPEG on this localhost port instead of a window",
+        default=None,
+    )
+    parser.add_argument(
+        "--num_writers",
+        type=int,
+        help="Number of writer processes per camera",
+        default=2,
+    )
+    parser.add_argument(
+        "--num_slots",
+        type=int,
+        help="Number of shared-memory frame slots per camera",
+        default=8,
+    )
+    parser.add_argument(
+        "--drop_policy",
+        type=str,
+        choices=DROP_POLICIES,
+        help="What to do when all frame slots are waiting to be written",
+        default="block",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=STORAGE_FORMATS,
+        help="Save loose PNG/NPY files or one chunked container per stream",
+        default="files",
+    )
+    parser.add_argument(
+        "--sync_fps",
+        type=float,
+        help="Trigger all cameras together at this rate and save the frame sets",
+        default=None,
+    )
+    parser.add_argument(
+        "--phase_align",
+        action="store_true",
+        help="Capture all cameras on the same tick boundaries",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=["zlib"],
+        help="Chunk compression for the container format",
+        default=None,
+    )
+    parser.add_argument(
+        "--zed_depth_encoding",
+        type=str,
+        choices=["both"] + ENCODINGS,
+        help="Store ZED depth as float32 and uint16 millimeters (both), or only one of them",
+        default="both",
+    )
+    parser.add_argument(
+        "--defer_alignment",
+        action="store_true",
+        help="Record native RealSense and Kinect depth, align later with utils.align_depth",
+    )
+    parser.add_argument(
+        "--zed_buffers",
+        type=int,
+        help="Frame buffers of the ZED capture thread, 0 to capture on the recording thread",
+        default=0,
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Trace the capture and write stages into a Chrome trace, trace.json",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        help="Serve per-camera capture metrics in Prometheus format on this localhost port",
+        default=None,
+    )
+    parser.add_argument(
+        "--usb_monitor",
+        type=str,
+        nargs="?",
+        const=TEXT_SOURCE,
+        help=f"Save the USB bandwidth of each camera from usbmon, default {TEXT_SOURCE}",
+        default=None,
+    )
+    parser.add_argument(
+        "--streams",
+        type=str,
+        action="append",
+        help="Streams to record as <camera>=<stream>,..., e.g. zed2i=color,raw_depth",
+        default=[],
+    )
+    parser.add_argument(
+        "--stream_config",
+        type=str,
+        help="JSON file mapping camera names to the streams to record",
+        default=None,
     )
     return parser.parse_args()
 
@@ -1,4 +1,2 @@
-python utils/delete.py $1/camera_zed2i_neural --min_idx $2 --max_idx $3
-python utils/delete.py $1/camera_zed2i_performance --min_idx $2 --max_idx $3
-python utils/delete.py $1/camera_zed2i_quality --min_idx $2 --max_idx $3
-python utils/delete.py $1/camera_zed2i_ultra --min_idx $2 --max_idx $3
\ No newline at end of file
+# Delete frames $2 to $3 of every ZED depth mode of session $1
+python -m utils.trim $1 $2 $3 --cameras "camera_zed2i_*" --delete
@@ -1,4 +1,4 @@
-python cameras/zed.py --svo $1 --depth_mode neural
-python cameras/zed.py --svo $1 --depth_mode performance
-python cameras/zed.py --svo $1 --depth_mode ultra
-python cameras/zed.py --svo $1 --depth_mode quality
\ No newline at end of file
+python -m cameras.zed --svo $1 --depth_mode neural
+python -m cameras.zed --svo $1 --depth_mode performance
+python -m cameras.zed --svo $1 --depth_mode ultra
+python -m cameras.zed --svo $1 --depth_mode quality
\ No newline at end of file
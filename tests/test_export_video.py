@@ -0,0 +1,77 @@
+import numpy as np
+
+from utils.depth_encoding import stored_depth_range, write_depth_info
+from utils.frame_store import LooseFileStore
+from utils.session_reader import CameraReader
+from visualization.export_video import stream_name, video_frame
+
+
+def record(camera_dir, streams):
+    camera_dir.mkdir()
+    store = LooseFileStore(str(camera_dir))
+    for stream, image in streams.items():
+        if image.dtype.kind == "f":
+            store.write_array(stream, 0, image)
+        else:
+            store.write_image(stream, 0, image)
+    store.finish_frame(0)
+    store.close()
+    return CameraReader(str(camera_dir))
+
+
+def test_colorized_depth_is_not_exported_as_depth(tmp_path):
+    # Mech-Eye stores raw depth and a preview colorized when recording
+    raw_depth = np.full((6, 8), 1000.0, dtype=np.float32)
+    preview = np.zeros((6, 8, 3), dtype=np.uint8)
+    preview[..., 2] = 255
+    camera = record(
+        tmp_path / "camera_mecheye", {"raw_depth": raw_depth, "depth": preview}
+    )
+    write_depth_info(camera.camera_dir, [("raw_depth", "float32")], "mm")
+    camera = CameraReader(camera.camera_dir)
+    assert stream_name(camera, "depth") == "raw_depth"
+
+    # The preview itself is shown as is rather than colorized again
+    assert (video_frame(preview) == preview).all()
+    assert video_frame(raw_depth).shape == (6, 8, 3)
+
+
+def test_depth_preferred_over_unaligned_depth(tmp_path):
+    depth = np.full((6, 8), 1000, dtype=np.uint16)
+    camera = record(
+        tmp_path / "camera_d455", {"depth": depth, "unaligned_depth": depth}
+    )
+    write_depth_info(
+        camera.camera_dir, [("depth", "uint16"), ("unaligned_depth", "uint16")]
+    )
+    assert stream_name(camera, "depth") == "depth"
+
+    # Without depth.json the first stored depth stream is used
+    camera = record(tmp_path / "camera_old", {"unaligned_depth": depth})
+    assert stream_name(camera, "depth") == "unaligned_depth"
+    assert stream_name(camera, "color") is None
+
+
+def test_depth_range_is_in_millimeters(tmp_path):
+    # ZED float depth is stored in meters, colorized as millimeters would be
+    depth_m = np.linspace(0, 2.5, 48, dtype=np.float32).reshape(6, 8)
+    zed = record(tmp_path / "camera_zed2i", {"raw_depth": depth_m})
+    write_depth_info(zed.camera_dir, [("raw_depth", "float32")], "m")
+    depth_mm = (depth_m * 1000).astype(np.uint16)
+    legacy = record(tmp_path / "camera_d455", {"depth": depth_mm})
+
+    zed_range = stored_depth_range(zed.camera_dir, "raw_depth", (0, 2000))
+    assert zed_range == (0, 2)
+    assert stored_depth_range(legacy.camera_dir, "depth", (0, 2000)) == (0, 2000)
+    frame = video_frame(zed["raw_depth"][0], zed_range)
+    assert len(np.unique(frame.reshape(-1, 3), axis=0)) > 10
+    assert (frame == video_frame(legacy["depth"][0], (0, 2000))).mean() > 0.9
+
+
+def test_uint16_depth_range_follows_the_scale(tmp_path):
+    # L515 depth is stored in quarter millimeters
+    camera = record(
+        tmp_path / "camera_l515", {"depth": np.zeros((6, 8), dtype=np.uint16)}
+    )
+    write_depth_info(camera.camera_dir, [("depth", "uint16")], "m", 4000.0)
+    assert stored_depth_range(camera.camera_dir, "depth", (0, 2000)) == (0, 8000)
@@ -0,0 +1,79 @@
+import csv
+from pathlib import Path
+
+from utils.monitor_usb import (
+    TEXT_WRAP_US,
+    BandwidthMeter,
+    open_events,
+    read_text_events,
+)
+
+FIXTURES = Path(__file__).parent / "fixtures"
+NAMES = {(2, 3): "d455", (1, 5): "kinect_1-5"}
+
+
+def measure(events, output_file=None):
+    meter = BandwidthMeter(NAMES, {1: 5000.0, 2: 5000.0}, 1.0, output_file)
+    for event in events:
+        meter.add(*event)
+    meter.close()
+    return meter
+
+
+def interval_bytes(output_file):
+    """(interval start, bus, device) -> bytes of a CSV time series."""
+    with open(output_file) as f:
+        return {
+            (int(row["time_us"]), int(row["bus"]), int(row["device"])): int(
+                row["bytes"]
+            )
+            for row in csv.DictReader(f)
+        }
+
+
+def test_text_capture(tmp_path):
+    # Bulk, control, interrupt and isochronous completions with their
+    # descriptors; submissions carry no transferred bytes
+    output_file = tmp_path / "usb_bandwidth.csv"
+    meter = measure(open_events(str(FIXTURES / "usbmon_text.txt")), output_file)
+    assert meter.totals == {
+        (2, 3): 16384 + 16384 + 8192 + 31 + 4,
+        (1, 5): 24576 + 0 + 30720,
+        (1, 1): 4,
+        (2, 4): 0,
+    }
+
+    # The timestamps wrap from 4095.95 s to 0.15 s of the next 4096 s
+    intervals = interval_bytes(output_file)
+    assert intervals[4095_000000, 2, 3] == 16384 + 16384
+    assert intervals[4096_000000, 2, 3] == 8192 + 31
+    assert intervals[4097_000000, 2, 3] == 4
+    assert intervals[4095_000000, 1, 5] == 24576
+    assert intervals[4096_000000, 1, 5] == 30720
+
+
+def test_text_capture_anchored_to_monotonic_time():
+    with open(FIXTURES / "usbmon_text.txt") as f:
+        unwrapped = [event[0] for event in read_text_events(f)]
+    assert unwrapped == sorted(unwrapped)
+    assert unwrapped[-1] == TEXT_WRAP_US + 1_300000
+
+    # A live capture started 0.1 s before the first completion
+    anchor_us = 3 * TEXT_WRAP_US + 4095_300000
+    with open(FIXTURES / "usbmon_text.txt") as f:
+        anchored = [event[0] for event in read_text_events(f, anchor_us)]
+    assert anchored == [t + 3 * TEXT_WRAP_US for t in unwrapped]
+
+
+def test_binary_capture(tmp_path):
+    # 48-byte headers followed by the captured data, submissions skipped
+    output_file = tmp_path / "usb_bandwidth.csv"
+    meter = measure(open_events(str(FIXTURES / "usbmon_binary.bin")), output_file)
+    assert meter.totals == {(2, 3): 16384 + 8192, (1, 5): 24576, (1, 1): 4}
+
+    second_us = 1735689600 * 1000000
+    intervals = interval_bytes(output_file)
+    assert intervals[second_us, 2, 3] == 16384
+    assert intervals[second_us + 1000000, 1, 5] == 24576
+    assert intervals[second_us + 1000000, 1, 1] == 4
+    assert intervals[second_us + 2000000, 2, 3] == 8192
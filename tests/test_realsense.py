@@ -0,0 +1,36 @@
+from cameras import realsense
+from cameras.simulated import SyntheticSource
+from utils.session_reader import CameraReader
+
+UNKNOWN_SERIAL = "123456789012"
+
+
+def test_unknown_camera_gets_default_streams():
+    source = realsense.RealSenseSource(UNKNOWN_SERIAL, UNKNOWN_SERIAL)
+    width, height = realsense.DEFAULT_COLOR_RESOLUTION
+    assert source.spec["color"][0] == (height, width, 3)
+    assert source.spec["depth"][0] == (height, width)
+
+    source = realsense.RealSenseSource(UNKNOWN_SERIAL, UNKNOWN_SERIAL, align=False)
+    width, height = realsense.DEFAULT_DEPTH_RESOLUTION
+    assert source.spec["unaligned_depth"][0] == (height, width)
+
+
+def test_record_unknown_camera(tmp_path):
+    streams = realsense.stream_spec(UNKNOWN_SERIAL)
+    recorder = realsense.RealSenseRecorder(
+        UNKNOWN_SERIAL,
+        False,
+        output_path=str(tmp_path),
+        source=SyntheticSource(streams, fps=None, num_frames=5),
+        timestamp="20250101_1200",
+        record_fps=0,
+        num_writers=1,
+    )
+    recorder.initialize_camera()
+    recorder.record_frames()
+
+    # Named by serial number
+    camera = CameraReader(tmp_path / "20250101_1200" / f"camera_{UNKNOWN_SERIAL}")
+    assert len(camera["depth"]) == 5
+    assert len(camera["color"]) == 5
@@ -0,0 +1,220 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils.calibration import (
+    camera_calibration,
+    depth_to_color_reprojector,
+    make_calibration,
+)
+from utils.reprojection import DepthReprojector, monotonic_radius2
+
+HEIGHT, WIDTH = 48, 64
+DEPTH_MATRIX = np.array([[60.0, 0, 31.5], [0, 60.0, 23.5], [0, 0, 1]])
+ROTATION = np.array(
+    [
+        [np.cos(0.03), 0, np.sin(0.03)],
+        [0, 1, 0],
+        [-np.sin(0.03), 0, np.cos(0.03)],
+    ]
+)
+TRANSLATION = np.array([25.0, -4.0, 2.0])
+# Rational model coefficients like the Azure Kinect's
+DISTORTION = [0.5, -0.1, 0.001, -0.002, -0.01, 0.8, 0.05, -0.03]
+
+
+def align_depth_to_color(
+    depth, depth_matrix, texture_matrix, rotation, translation, color_shape
+):
+    """The per-pixel loop DepthReprojector replaced, nearest depth winning."""
+    height, width = depth.shape
+    height_color, width_color = color_shape
+    mapped_image = np.zeros((height_color, width_color), dtype=depth.dtype)
+    nearest = np.full((height_color, width_color), np.inf)
+    for y in range(height):
+        for x in range(width):
+            if depth[y, x] > 0:
+                depth_point = (
+                    np.array(
+                        [
+                            (x - depth_matrix[0, 2]) / depth_matrix[0, 0],
+                            (y - depth_matrix[1, 2]) / depth_matrix[1, 1],
+                            1.0,
+                        ]
+                    )
+                    * depth[y, x]
+                )
+                texture_point = np.dot(rotation, depth_point) + translation
+                texture_image_point = np.dot(texture_matrix, texture_point)
+                if texture_image_point[2] > 0:
+                    texture_x = int(texture_image_point[0] / texture_image_point[2])
+                    texture_y = int(texture_image_point[1] / texture_image_point[2])
+                    if (
+                        0 <= texture_x < width_color
+                        and 0 <= texture_y < height_color
+                        and texture_image_point[2] < nearest[texture_y, texture_x]
+                    ):
+                        nearest[texture_y, texture_x] = texture_image_point[2]
+                        mapped_image[texture_y, texture_x] = depth[y, x]
+    return mapped_image
+
+
+def random_depth(dtype, seed=0):
+    rng = np.random.default_rng(seed)
+    depth = (800 + 400 * rng.random((HEIGHT, WIDTH))).astype(dtype)
+    depth[rng.random((HEIGHT, WIDTH)) < 0.1] = 0
+    return depth
+
+
+@pytest.mark.parametrize("dtype", [np.uint16, np.float32])
+def test_matches_per_pixel_loop(dtype):
+    # Slightly longer focal length than the depth camera: no two depth pixels
+    # land on the same color pixel
+    texture_matrix = np.array([[75.0, 0, 41.0], [0, 75.0, 28.0], [0, 0, 1]])
+    depth = random_depth(dtype)
+    reprojector = DepthReprojector(
+        DEPTH_MATRIX, texture_matrix, ROTATION, TRANSLATION, depth.shape, (60, 80)
+    )
+    expected = align_depth_to_color(
+        depth, DEPTH_MATRIX, texture_matrix, ROTATION, TRANSLATION, (60, 80)
+    )
+    aligned = reprojector(depth)
+    assert aligned.dtype == depth.dtype
+    assert np.count_nonzero(expected) > 0.8 * np.count_nonzero(depth)
+    np.testing.assert_array_equal(aligned, expected)
+
+
+def test_nearest_depth_wins():
+    # Half the focal length: every color pixel is hit by about four depth
+    # pixels
+    texture_matrix = np.array([[30.0, 0, 16.0], [0, 30.0, 12.0], [0, 0, 1]])
+    depth = random_depth(np.uint16, seed=1)
+    reprojector = DepthReprojector(
+        DEPTH_MATRIX, texture_matrix, ROTATION, TRANSLATION, depth.shape, (24, 32)
+    )
+    expected = align_depth_to_color(
+        depth, DEPTH_MATRIX, texture_matrix, ROTATION, TRANSLATION, (24, 32)
+    )
+    np.testing.assert_array_equal(reprojector(depth), expected)
+
+    # Without rotation and translation every 2x2 block maps to one pixel, and
+    # its smallest valid depth is the nearest
+    reprojector = DepthReprojector(
+        DEPTH_MATRIX, texture_matrix, np.eye(3), np.zeros(3), depth.shape, (24, 32)
+    )
+    blocks = depth.reshape(24, 2, 32, 2).swapaxes(1, 2).reshape(24, 32, 4)
+    nearest = np.where(blocks > 0, blocks, np.iinfo(np.uint16).max).min(axis=2)
+    nearest[nearest == np.iinfo(np.uint16).max] = 0
+    np.testing.assert_array_equal(reprojector(depth), nearest)
+
+
+def test_output_buffer_is_reused():
+    depth = random_depth(np.float32)
+    reprojector = DepthReprojector(
+        DEPTH_MATRIX, DEPTH_MATRIX, ROTATION, TRANSLATION, depth.shape, depth.shape
+    )
+    out = np.full(depth.shape, 7, dtype=np.float32)
+    assert reprojector(depth, out) is out
+    np.testing.assert_array_equal(out, reprojector(depth))
+    # Pixels nothing maps to are cleared, also when the next frame is empty
+    reprojector(np.zeros_like(depth), out)
+    assert not out.any()
+
+
+def test_rejects_wrong_shape_and_dtype():
+    reprojector = DepthReprojector(
+        DEPTH_MATRIX, DEPTH_MATRIX, np.eye(3), np.zeros(3), (HEIGHT, WIDTH), (24, 32)
+    )
+    with pytest.raises(ValueError):
+        reprojector(np.zeros((HEIGHT, WIDTH + 1), dtype=np.uint16))
+    with pytest.raises(ValueError):
+        reprojector(np.zeros((HEIGHT, WIDTH), dtype=np.float64))
+
+
+def test_distorted_round_trip():
+    # A depth camera reprojected to itself, half a pixel to the right and
+    # bottom so truncation is stable: rays are undistorted and distorted
+    # again, landing on the pixel they came from
+    target_matrix = DEPTH_MATRIX + [[0, 0, 0.5], [0, 0, 0.5], [0, 0, 0]]
+    depth = random_depth(np.uint16)
+    reprojector = DepthReprojector(
+        DEPTH_MATRIX,
+        target_matrix,
+        np.eye(3),
+        np.zeros(3),
+        depth.shape,
+        depth.shape,
+        DISTORTION,
+        DISTORTION,
+    )
+    np.testing.assert_array_equal(reprojector(depth), depth)
+
+
+def test_distortion_matches_opencv():
+    texture_matrix = np.array([[75.0, 0, 41.0], [0, 75.0, 28.0], [0, 0, 1]])
+    depth = random_depth(np.float32)
+    reprojector = DepthReprojector(
+        DEPTH_MATRIX,
+        texture_matrix,
+        ROTATION,
+        TRANSLATION,
+        depth.shape,
+        (60, 80),
+        DISTORTION,
+        DISTORTION[:5],
+    )
+    _, _, u, v, keep = reprojector._project(depth)
+
+    ys, xs = np.mgrid[0:HEIGHT, 0:WIDTH]
+    pixels = np.stack([xs.ravel(), ys.ravel()], axis=-1).astype(np.float64)
+    rays = cv2.undistortPoints(
+        pixels.reshape(-1, 1, 2), DEPTH_MATRIX, np.array(DISTORTION)
+    ).reshape(-1, 2)
+    points = np.hstack([rays, np.ones((len(rays), 1))]) * depth.reshape(-1, 1)
+    projected, _ = cv2.projectPoints(
+        points,
+        cv2.Rodrigues(ROTATION)[0],
+        TRANSLATION,
+        texture_matrix,
+        np.array(DISTORTION[:5]),
+    )
+    projected = projected.reshape(-1, 2)
+    assert keep.sum() > 0.5 * np.count_nonzero(depth)
+    np.testing.assert_allclose(u[keep], projected[keep, 0], atol=1e-2)
+    np.testing.assert_allclose(v[keep], projected[keep, 1], atol=1e-2)
+
+
+def test_rejects_unsupported_distortion():
+    with pytest.raises(ValueError):
+        DepthReprojector(
+            DEPTH_MATRIX,
+            DEPTH_MATRIX,
+            np.eye(3),
+            np.zeros(3),
+            (HEIGHT, WIDTH),
+            (HEIGHT, WIDTH),
+            target_distortion=DISTORTION + [0, 0, 0.01, 0],
+        )
+
+
+def test_calibration_distortion_model():
+    depth = camera_calibration(DEPTH_MATRIX, WIDTH, HEIGHT, DISTORTION)
+    color = camera_calibration(DEPTH_MATRIX, WIDTH, HEIGHT, [0, 0, 0, 0, 0])
+    calibration = make_calibration(depth, color, ROTATION, TRANSLATION, 0.001)
+    assert depth_to_color_reprojector(calibration).target_distortion is None
+
+    # Coefficients of another or an unrecorded model are not applied
+    # with the wrong model
+    depth["distortion_model"] = "inverse_brown_conrady"
+    with pytest.raises(ValueError):
+        depth_to_color_reprojector(calibration)
+    del depth["distortion_model"]
+    with pytest.raises(ValueError):
+        depth_to_color_reprojector(calibration)
+
+
+def test_folding_distortion_is_bounded():
+    # r * (1 - 0.5 r^2) grows up to r^2 = 2 / 3 and folds back after it
+    assert monotonic_radius2([-0.5, 0, 0, 0, 0, 0, 0, 0]) == pytest.approx(
+        2 / 3, abs=1e-3
+    )
@@ -0,0 +1,46 @@
+import numpy as np
+
+from utils.scheduler import CaptureScheduler, SampleWindow
+
+
+def test_stats_match_the_full_history():
+    rng = np.random.default_rng(0)
+    wake_times = 100.0 + np.cumsum(rng.uniform(0.030, 0.040, 500))
+    lateness = rng.exponential(0.002, 500)
+    scheduler = CaptureScheduler(30, origin=100.0)
+    for woke, late in zip(wake_times, lateness):
+        scheduler._add_wake(woke)
+        scheduler.lateness.add(late)
+
+    stats = scheduler.stats()
+    assert stats["ticks"] == 500
+    assert np.isclose(
+        stats["achieved_rate"], 499 / (wake_times[-1] - wake_times[0]), atol=1e-3
+    )
+    p50, p99 = np.percentile(lateness * 1e3, [50, 99])
+    assert stats["lateness_ms"] == dict(
+        p50=round(p50, 3), p99=round(p99, 3), max=round(lateness.max() * 1e3, 3)
+    )
+    assert np.isclose(
+        stats["interval_std_ms"], np.diff(wake_times * 1e3).std(), atol=1e-3
+    )
+
+
+def test_sample_window_is_bounded():
+    window = SampleWindow(window=100)
+    for value in range(1000, 0, -1):
+        window.add(value)
+    assert len(window) == 1000
+    assert len(window.recent) == 100
+    # The maximum is over every sample, percentiles over the latest ones
+    assert window.max == 1000
+    assert window.percentiles(100) == 100
+
+
+def test_wait_keeps_the_grid():
+    scheduler = CaptureScheduler(200)
+    ticks = [scheduler.wait() for _ in range(5)]
+    assert ticks == sorted(set(ticks))
+    assert scheduler.ticks == 5
+    assert scheduler.stats()["missed"] == ticks[-1] - ticks[0] - 4
+    assert "lateness p50" in scheduler.summary()
@@ -0,0 +1,15 @@
+from utils.session_reader import SessionReader, session_cameras
+
+
+def test_only_camera_directories_are_cameras(tmp_path):
+    for name in ["camera_zed2i", "trace", "videos", "camera_d455"]:
+        (tmp_path / name).mkdir()
+    (tmp_path / "frame_sets.csv").touch()
+
+    assert session_cameras(tmp_path) == [
+        str(tmp_path / "camera_d455"),
+        str(tmp_path / "camera_zed2i"),
+    ]
+    reader = SessionReader(tmp_path)
+    assert reader.cameras == ["camera_d455", "camera_zed2i"]
+    assert len(reader) == 2
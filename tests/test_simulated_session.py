@@ -0,0 +1,43 @@
+"""Simulated recording sessions run end to end as a subprocess."""
+
+from pathlib import Path
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from utils.manifest import MANIFEST_FILE
+from utils.tracing import TRACE_FILE
+
+REPO = Path(__file__).parent.parent
+
+
+def test_ctrl_c_merges_the_trace(tmp_path):
+    # Recording until Ctrl-C, which the terminal sends to the whole group
+    process = subprocess.Popen(
+        [sys.executable, "-m", "cameras.simulated", "--count", "2", "--trace"]
+        + ["--fps", "30", "--record_fps", "10", "--output_path", str(tmp_path)],
+        cwd=REPO,
+        start_new_session=True,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while not any(
+            manifest.stat().st_size
+            for manifest in tmp_path.glob(f"*/camera_*/{MANIFEST_FILE}")
+        ):
+            assert process.poll() is None
+            assert time.monotonic() < deadline
+            time.sleep(0.1)
+        os.killpg(process.pid, signal.SIGINT)
+        assert process.wait(timeout=30) == 0
+    finally:
+        if process.poll() is None:
+            os.killpg(process.pid, signal.SIGKILL)
+
+    (session_dir,) = tmp_path.iterdir()
+    assert (session_dir / TRACE_FILE).exists()
+    # The per-process shards were merged and removed
+    assert not (session_dir / "trace").exists()
+    assert len(list(session_dir.glob(f"camera_*/{MANIFEST_FILE}"))) == 2
@@ -0,0 +1,52 @@
+from pathlib import Path
+
+import numpy as np
+
+from utils.frame_store import LooseFileStore
+from utils.manifest import MANIFEST_FILE, manifest_dtype
+from utils.session_reader import CameraReader
+from utils.sync import match_frames, playback_rows
+
+
+def record_camera(camera_dir, host_ms):
+    """Camera whose frame i was captured at ``host_ms[i]``."""
+    camera_dir.mkdir()
+    store = LooseFileStore(str(camera_dir))
+    for frame in range(len(host_ms)):
+        store.write_image("color", frame, np.zeros((4, 4, 3), dtype=np.uint8))
+    store.close()
+    records = np.zeros(len(host_ms), dtype=manifest_dtype)
+    records["frame"] = np.arange(len(host_ms))
+    records["host_ns"] = np.asarray(host_ms, dtype=np.int64) * 1_000_000
+    records.tofile(camera_dir / MANIFEST_FILE)
+    return CameraReader(str(camera_dir))
+
+
+def test_match_frames_uses_each_frame_once():
+    matches, unmatched = match_frames([[0, 100, 200], [5, 10, 400]], tolerance=50)
+    assert matches.tolist() == [[0, 0], [1, -1], [2, -1]]
+    assert [u.tolist() for u in unmatched] == [[], [1, 2]]
+
+
+def test_unmatched_frames_get_rows_of_their_own(tmp_path, capsys):
+    # The second camera has a gap, then frames far off the first camera's
+    first = record_camera(tmp_path / "camera_a", [0, 100, 200, 300, 400])
+    second = record_camera(tmp_path / "camera_b", [2, 101, 350, 398])
+    rows = playback_rows(
+        [Path(first.camera_dir), Path(second.camera_dir)],
+        [first["color"], second["color"]],
+        tolerance_ms=20,
+    )
+    # Every frame is shown once, in capture time order
+    assert rows.tolist() == [
+        [0, 0],
+        [1, 1],
+        [2, -1],
+        [3, -1],
+        [-1, 2],
+        [4, 3],
+    ]
+    output = capsys.readouterr().out
+    assert "camera_a: 2 frames without a match within 20 ms" in output
+    assert "camera_a: no frame in 1 of 6 rows" in output
+    assert "camera_b: no frame in 2 of 6 rows" in output
@@ -0,0 +1,60 @@
+import numpy as np
+
+from utils.frame_store import LooseFileStore
+from utils.session_reader import CameraReader
+from utils.trigger import FRAME_SETS_FILE
+from utils.trim import trim_session, undo_trim
+
+FRAME_SETS = """tick,trigger_ns,skew_us,d455,zed2i
+10,1000,120,0,0
+11,2000,80,1,-1
+12,3000,95,2,1
+13,4000,-1,-1,2
+14,5000,110,3,3
+"""
+
+
+def record_session(session_dir):
+    for name in ["camera_d455", "camera_zed2i"]:
+        store = LooseFileStore(str(session_dir / name))
+        for frame in range(4):
+            store.write_image("color", frame, np.zeros((4, 4, 3), dtype=np.uint8))
+            store.finish_frame(frame)
+        store.close()
+    (session_dir / FRAME_SETS_FILE).write_text(FRAME_SETS)
+
+
+def test_trim_rewrites_frame_sets_and_undo_restores_them(tmp_path):
+    session_dir = tmp_path / "recorded_data" / "20250101_1200"
+    (session_dir / "camera_d455").mkdir(parents=True)
+    (session_dir / "camera_zed2i").mkdir()
+    record_session(session_dir)
+
+    trim_session(session_dir, 1, 2)
+    for name in ["camera_d455", "camera_zed2i"]:
+        assert list(CameraReader(session_dir / name)["color"].frame_numbers) == [0, 3]
+    # Trimmed frames are missing from their frame sets, empty sets are gone
+    assert (session_dir / FRAME_SETS_FILE).read_text() == (
+        "tick,trigger_ns,skew_us,d455,zed2i\n" "10,1000,120,0,0\n" "14,5000,110,3,3\n"
+    )
+
+    undo_trim(session_dir)
+    assert (session_dir / FRAME_SETS_FILE).read_text() == FRAME_SETS
+    for name in ["camera_d455", "camera_zed2i"]:
+        assert len(CameraReader(session_dir / name)["color"]) == 4
+
+
+def test_trim_one_camera_keeps_the_others_frames(tmp_path):
+    session_dir = tmp_path / "20250101_1200"
+    (session_dir / "camera_d455").mkdir(parents=True)
+    (session_dir / "camera_zed2i").mkdir()
+    record_session(session_dir)
+
+    trim_session(session_dir, 1, 2, cameras=["camera_zed2i"], delete=True)
+    assert (session_dir / FRAME_SETS_FILE).read_text() == (
+        "tick,trigger_ns,skew_us,d455,zed2i\n"
+        "10,1000,120,0,0\n"
+        "11,2000,80,1,-1\n"
+        "12,3000,95,2,-1\n"
+        "14,5000,110,3,3\n"
+    )
@@ -0,0 +1,237 @@
+"""ZedSource capture thread against a stub of the ZED SDK."""
+
+from types import SimpleNamespace
+import time
+
+import numpy as np
+import pytest
+
+from cameras import zed
+from utils.session_reader import CameraReader
+
+WIDTH, HEIGHT = 8, 6
+SUCCESS, END_OF_SVOFILE_REACHED = "SUCCESS", "END_OF_SVOFILE_REACHED"
+
+
+class Mat:
+    """sl.Mat whose buffer is allocated on the first retrieve and reused."""
+
+    def __init__(self):
+        self.data = None
+        self.frames = []
+        self.freed = False
+
+    def write(self, shape, dtype, frame):
+        if self.data is None:
+            self.data = np.empty(shape, dtype=dtype)
+        self.data[...] = frame
+        self.frames.append(frame)
+
+    def get_data(self):
+        return self.data
+
+    def free(self, memory):
+        self.freed = True
+
+
+class Camera:
+    """sl.Camera producing ``num_frames`` numbered frames, one per ``period``."""
+
+    def __init__(self, num_frames, period=0.0):
+        self.num_frames = num_frames
+        self.period = period
+        self.frame = -1
+        self.closed = False
+
+    def get_camera_information(self):
+        resolution = SimpleNamespace(width=WIDTH, height=HEIGHT)
+        left_cam = SimpleNamespace(fx=5.0, fy=5.0, cx=WIDTH / 2, cy=HEIGHT / 2)
+        return SimpleNamespace(
+            camera_configuration=SimpleNamespace(
+                resolution=resolution,
+                calibration_parameters=SimpleNamespace(left_cam=left_cam),
+            )
+        )
+
+    def grab(self, runtime_param):
+        if self.frame + 1 >= self.num_frames:
+            return END_OF_SVOFILE_REACHED
+        time.sleep(self.period)
+        self.frame += 1
+        return SUCCESS
+
+    def get_timestamp(self, reference):
+        return SimpleNamespace(get_microseconds=lambda: self.frame * 33_333)
+
+    def retrieve_image(self, mat, view, memory, resolution):
+        mat.write((HEIGHT, WIDTH, 4), np.uint8, self.frame % 256)
+
+    def retrieve_measure(self, mat, measure):
+        mat.write((HEIGHT, WIDTH), np.float32, self.frame)
+
+    def disable_recording(self):
+        pass
+
+    def disable_body_tracking(self):
+        pass
+
+    def disable_positional_tracking(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stub_sdk(monkeypatch):
+    """Replace pyzed with the stub, return a function making a ZedSource."""
+    monkeypatch.setattr(
+        zed,
+        "sl",
+        SimpleNamespace(
+            Mat=Mat,
+            Resolution=lambda width, height: SimpleNamespace(
+                width=width, height=height
+            ),
+            ERROR_CODE=SimpleNamespace(SUCCESS=SUCCESS),
+            TIME_REFERENCE=SimpleNamespace(IMAGE="IMAGE"),
+            VIEW=SimpleNamespace(LEFT="LEFT", RIGHT="RIGHT"),
+            MEM=SimpleNamespace(CPU="CPU"),
+            MEASURE=SimpleNamespace(DEPTH="DEPTH", NORMALS="NORMALS", XYZ="XYZ"),
+        ),
+    )
+
+    def make_source(camera, num_buffers=3, svo_file=None):
+        monkeypatch.setattr(
+            zed,
+            "init_zed",
+            lambda **kwargs: (camera, SimpleNamespace(enable_depth=True)),
+        )
+        return zed.ZedSource(
+            "quality",
+            svo_file=svo_file,
+            streams=["color", "raw_depth"],
+            num_buffers=num_buffers,
+        )
+
+    return make_source
+
+
+def consume(source, grab, delay=0.0):
+    """Frame numbers of every grab, checking the held frame stays intact."""
+    frames = []
+    while True:
+        frame = grab()
+        if frame is None:
+            return frames
+        streams, device_us = frame
+        number = int(streams["raw_depth"][0, 0])
+        # The recorder copies the frame now: the capture thread must not
+        # write into the buffers it holds
+        time.sleep(delay)
+        assert (streams["raw_depth"] == number).all()
+        assert (streams["color"] == number % 256).all()
+        assert device_us == number * 33_333
+        frames.append(number)
+
+
+def assert_recycled(source, num_frames):
+    assert source.capture_thread is None
+    # Every set is back in the pool, the last one handed back by the grab
+    # that saw the end of the source
+    assert source.held_set is None
+    assert source.free_sets.qsize() == len(source.mat_sets)
+    written = []
+    for mats in source.mat_sets:
+        # Both streams of a set always hold the same frame
+        assert mats["raw_depth"].frames == mats["color"].frames
+        assert mats["raw_depth"].frames
+        assert all(mat.freed for mat in mats.values())
+        written += mats["raw_depth"].frames
+    # Every frame was retrieved exactly once, into a recycled set
+    assert sorted(written) == list(range(num_frames))
+
+
+def test_replay_delivers_every_frame_in_order(stub_sdk):
+    camera = Camera(num_frames=40)
+    source = stub_sdk(camera, num_buffers=3, svo_file="session.svo")
+    source.open()
+    assert not source.drop_stale
+
+    # A recorder slower than the SVO file never loses a frame
+    frames = consume(source, source.grab, delay=0.002)
+    source.close()
+
+    assert frames == list(range(40))
+    assert source.dropped == 0
+    assert_recycled(source, 40)
+    assert camera.closed
+
+
+def test_live_delivers_every_frame_in_order(stub_sdk):
+    camera = Camera(num_frames=40, period=0.002)
+    source = stub_sdk(camera, num_buffers=3)
+    source.open()
+    assert source.drop_stale
+
+    frames = consume(source, source.grab)
+    source.close()
+
+    # A recorder keeping up gets every frame; when it falls behind the oldest
+    # frames are dropped and counted, never reordered
+    assert frames == sorted(set(frames))
+    assert len(frames) + source.dropped == 40
+    assert frames[-1] == 39
+    assert_recycled(source, 40)
+
+
+def test_live_drops_the_oldest_frames(stub_sdk):
+    camera = Camera(num_frames=40)
+    source = stub_sdk(camera, num_buffers=2)
+    source.open()
+
+    frames = consume(source, source.grab_latest, delay=0.005)
+    source.close()
+
+    assert frames == sorted(set(frames))
+    assert source.dropped > 0
+    assert len(frames) + source.dropped == 40
+    assert frames[-1] == 39
+    assert_recycled(source, 40)
+
+
+def test_close_stops_a_waiting_capture_thread(stub_sdk):
+    # The recorder stops early, with the capture thread waiting for a free set
+    camera = Camera(num_frames=1000, period=0.001)
+    source = stub_sdk(camera, num_buffers=2, svo_file="session.svo")
+    source.open()
+    assert source.grab() is not None
+    time.sleep(0.05)
+    thread = source.capture_thread
+    source.close()
+
+    assert not thread.is_alive()
+    assert camera.closed
+    assert camera.frame < 10
+
+
+def test_recorder_replays_every_frame(stub_sdk, tmp_path):
+    camera = Camera(num_frames=25)
+    source = stub_sdk(camera, num_buffers=2, svo_file="zed_20250101_1200.svo")
+    recorder = zed.ZedRecorder(
+        False,
+        svo_file="zed_20250101_1200.svo",
+        output_path=str(tmp_path),
+        source=source,
+        depth_encoding="float32",
+        num_writers=1,
+    )
+    recorder.initialize_camera()
+    recorder.replay_frames()
+
+    reader = CameraReader(recorder.camera_dir)
+    depth = reader["raw_depth"]
+    assert list(depth.frame_numbers) == list(range(25))
+    for i, frame_number in enumerate(depth.frame_numbers):
+        assert (depth[i] == frame_number).all()
+    assert camera.closed
@@ -0,0 +1,205 @@
+"""Offline depth-to-color alignment of recorded sessions.
+
+Cameras recorded with alignment deferred (``--defer_alignment``) store native
+``unaligned_depth`` and a ``calibration.json``. This registers them for whole
+sessions, spreading frames over a process pool:
+
+- ``--target color``: depth reprojected to the color image as ``depth``, the
+  stream an aligned recording would have saved. ``depth.json`` and
+  ``intrinsics.json`` are updated to describe it.
+- ``--target depth``: color sampled at every depth pixel as ``aligned_color``,
+  leaving depth in its own frame.
+
+Outputs of a previous run with the same target are replaced, so alignment can
+be re-run at any time. Frames are written in the storage format of the
+unaligned depth.
+
+Usage:
+    python -m utils.align_depth recorded_data/<timestamp> [--target color] [--num_workers 4]
+"""
+
+from multiprocessing import Pool
+from pathlib import Path
+import argparse
+import os
+import time
+
+import numpy as np
+
+from utils.calibration import (
+    camera_intrinsics,
+    depth_to_color_reprojector,
+    lens_distortion,
+    read_calibration,
+)
+from utils.container import SUFFIX, loose_file_pattern
+from utils.depth_encoding import read_depth_info, write_depth_info
+from utils.frame_store import ContainerStore, LooseFileStore
+from utils.pointcloud import write_intrinsics
+from utils.session_reader import CameraReader
+
+# Stream written for each alignment target
+output_streams = {"color": "depth", "depth": "aligned_color"}
+
+# Cameras and reprojectors of this worker process, by camera directory
+_cameras = {}
+_reprojectors = {}
+
+
+def remove_stream(camera_dir, stream):
+    """Delete all loose files and container shards of ``stream``."""
+    with os.scandir(camera_dir) as entries:
+        for entry in entries:
+            match = loose_file_pattern.match(entry.name)
+            if (match and match["stream"] == stream) or (
+                entry.name.startswith(f"{stream}.") and entry.name.endswith(SUFFIX)
+            ):
+                os.remove(entry.path)
+
+
+def align_frames(camera_dir, target, frame_numbers, storage_format, shard, compression):
+    """Align a block of frames of one camera, return the number aligned."""
+    if camera_dir not in _cameras:
+        _cameras[camera_dir] = CameraReader(camera_dir)
+        _reprojectors[camera_dir] = depth_to_color_reprojector(
+            read_calibration(camera_dir)
+        )
+    camera = _cameras[camera_dir]
+    reprojector = _reprojectors[camera_dir]
+
+    if storage_format == "container":
+        # Every block gets its own shard, blocks may share a worker process
+        store = ContainerStore(camera_dir, compression, shard=shard)
+    else:
+        store = LooseFileStore(camera_dir)
+    try:
+        for frame_number in frame_numbers:
+            depth = camera["unaligned_depth"].get(frame_number)
+            if target == "color":
+                aligned = reprojector(depth)
+            else:
+                aligned = reprojector.sample(depth, camera["color"].get(frame_number))
+            store.write_image(output_streams[target], frame_number, aligned)
+    finally:
+        store.close()
+    return len(frame_numbers)
+
+
+def _align_task(task):
+    return align_frames(*task)
+
+
+def align_session(
+    session_dir, target="color", num_workers=None, block_frames=32, compression=None
+):
+    """Align every deferred-alignment camera of a session.
+
+    Args:
+        session_dir (str): recorded_data/<timestamp>
+        target (str): "color" to align depth to color, "depth" to align color
+            to depth
+        num_workers (int): Worker processes, default one per CPU
+        block_frames (int): Frames per task
+        compression (str): Chunk compression of container outputs
+    """
+    tasks = []
+    cameras = []
+    for entry in sorted(os.scandir(session_dir), key=lambda e: e.name):
+        if not entry.is_dir():
+            continue
+        calibration = read_calibration(entry.path)
+        camera = CameraReader(entry.path)
+        if calibration is None or "unaligned_depth" not in camera:
+            continue
+        try:
+            for lens in ("depth", "color"):
+                lens_distortion(calibration, lens)
+        except ValueError as e:
+            # Aligning with the wrong lens model would silently misplace depth
+            print(f"Cannot align {entry.name}: {e}")
+            continue
+        depth = camera["unaligned_depth"]
+        frame_numbers = depth.frame_numbers
+        if target == "depth":
+            frame_numbers = np.intersect1d(frame_numbers, camera["color"].frame_numbers)
+        storage_format = "container" if depth.container is not None else "files"
+
+        remove_stream(entry.path, output_streams[target])
+        for i, start in enumerate(range(0, len(frame_numbers), block_frames)):
+            block = frame_numbers[start : start + block_frames].tolist()
+            tasks.append(
+                (entry.path, target, block, storage_format, f"align{i}", compression)
+            )
+        cameras.append((entry.path, calibration, len(frame_numbers)))
+
+    if not cameras:
+        print(f"No cameras with {output_streams[target]} to align in {session_dir}")
+        return
+
+    start_time = time.time()
+    aligned = 0
+    with Pool(num_workers) as pool:
+        for count in pool.imap_unordered(_align_task, tasks):
+            aligned += count
+    elapsed = time.time() - start_time
+
+    if target == "color":
+        for camera_dir, calibration, _ in cameras:
+            # Aligned depth comes first for load_depth and PointCloudReader
+            info = read_depth_info(camera_dir)
+            scale = info["streams"]["unaligned_depth"]["scale"]
+            write_depth_info(
+                camera_dir,
+                [("depth", "uint16"), ("unaligned_depth", "uint16")],
+                info["units"],
+                scale,
+            )
+            write_intrinsics(camera_dir, camera_intrinsics(calibration, "color"))
+
+    for camera_dir, _, count in cameras:
+        print(f"Aligned {count} frames of {Path(camera_dir).name} to {target}")
+    print(
+        f"{aligned} frames in {elapsed:.1f} s ({aligned / max(elapsed, 1e-9):.1f} fps)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Align the depth of a session recorded with deferred alignment"
+    )
+    parser.add_argument("session_dir", type=str, help="recorded_data/<timestamp>")
+    parser.add_argument(
+        "--target",
+        type=str,
+        choices=list(output_streams),
+        help="Align depth to the color image, or color to the depth image",
+        default="color",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help="Number of worker processes, default one per CPU",
+        default=None,
+    )
+    parser.add_argument(
+        "--block_frames", type=int, help="Frames per worker task", default=32
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=["zlib"],
+        help="Chunk compression for container outputs",
+        default=None,
+    )
+    args = parser.parse_args()
+    align_session(
+        args.session_dir,
+        args.target,
+        args.num_workers,
+        args.block_frames,
+        args.compression,
+    )
+
+
+if __name__ == "__main__":
+    main()
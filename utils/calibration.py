@@ -0,0 +1,126 @@
+"""Depth-to-color calibration of a camera, saved for offline alignment.
+
+Recorders that store native, unaligned depth write ``calibration.json`` to the
+camera directory once per recording, so ``utils.align_depth`` can register
+depth and color later:
+
+    {
+        "depth": {"matrix": 3x3, "width": ..., "height": ..., "distortion": [...],
+                  "distortion_model": "opencv"},
+        "color": {"matrix": 3x3, "width": ..., "height": ..., "distortion": [...],
+                  "distortion_model": "opencv"},
+        "depth_to_color": {"rotation": 3x3, "translation": [x, y, z]},
+        "depth_scale": meters per depth unit
+    }
+
+The translation is in meters. Alignment corrects lens distortion of the
+``opencv`` model (coefficients in OpenCV order); calibrations with non-zero
+coefficients of another or an unrecorded model are refused rather than aligned
+with the wrong model.
+"""
+
+from pathlib import Path
+import json
+
+import numpy as np
+
+from utils.pointcloud import intrinsics_from_matrix
+from utils.reprojection import DepthReprojector, distortion_coefficients
+
+CALIBRATION_FILE = "calibration.json"
+
+
+def camera_calibration(
+    matrix, width, height, distortion=None, distortion_model="opencv"
+):
+    """Calibration entry of one camera of the rig.
+
+    ``distortion_model`` names the model of the ``distortion`` coefficients,
+    ``opencv`` for OpenCV's radial-tangential model in its coefficient order.
+    """
+    calibration = dict(
+        matrix=np.asarray(matrix, dtype=np.float64).reshape(3, 3).tolist(),
+        width=int(width),
+        height=int(height),
+    )
+    if distortion is not None:
+        calibration["distortion"] = np.asarray(distortion, dtype=np.float64).tolist()
+        calibration["distortion_model"] = distortion_model
+    return calibration
+
+
+def make_calibration(depth, color, rotation, translation, depth_scale):
+    """Calibration of a depth and color camera pair.
+
+    Args:
+        depth (dict): ``camera_calibration`` of the depth camera
+        color (dict): ``camera_calibration`` of the color camera
+        rotation (np.ndarray): 3x3 depth-to-color rotation
+        translation (np.ndarray): Depth-to-color translation in meters
+        depth_scale (float): Meters per depth unit
+    """
+    return dict(
+        depth=depth,
+        color=color,
+        depth_to_color=dict(
+            rotation=np.asarray(rotation, dtype=np.float64).reshape(3, 3).tolist(),
+            translation=np.asarray(translation, dtype=np.float64).reshape(3).tolist(),
+        ),
+        depth_scale=float(depth_scale),
+    )
+
+
+def write_calibration(camera_dir, calibration):
+    with open(Path(camera_dir) / CALIBRATION_FILE, "w") as f:
+        json.dump(calibration, f, indent=2)
+
+
+def read_calibration(camera_dir):
+    """Load the calibration of a camera directory, None if there is none."""
+    path = Path(camera_dir) / CALIBRATION_FILE
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def camera_intrinsics(calibration, camera):
+    """Intrinsics of ``camera`` ("depth" or "color") for ``utils.pointcloud``."""
+    camera = calibration[camera]
+    return intrinsics_from_matrix(camera["matrix"], camera["width"], camera["height"])
+
+
+def lens_distortion(calibration, camera):
+    """OpenCV distortion coefficients of ``camera``, None without distortion.
+
+    Raises:
+        ValueError: The coefficients are non-zero and not of the OpenCV model,
+            or of its thin prism or tilted sensor terms
+    """
+    camera = calibration[camera]
+    distortion = camera.get("distortion")
+    if distortion is None or not np.any(distortion):
+        return None
+    model = camera.get("distortion_model")
+    if model != "opencv":
+        raise ValueError(
+            f"Unsupported lens distortion model {model}, only opencv is supported"
+        )
+    return distortion_coefficients(distortion)
+
+
+def depth_to_color_reprojector(calibration):
+    """DepthReprojector from native depth to the color image grid."""
+    depth, color = calibration["depth"], calibration["color"]
+    extrinsics = calibration["depth_to_color"]
+    return DepthReprojector(
+        depth["matrix"],
+        color["matrix"],
+        extrinsics["rotation"],
+        # The reprojector works in depth units
+        np.asarray(extrinsics["translation"]) / calibration["depth_scale"],
+        (depth["height"], depth["width"]),
+        (color["height"], color["width"]),
+        lens_distortion(calibration, "depth"),
+        lens_distortion(calibration, "color"),
+    )
@@ -0,0 +1,135 @@
+"""Depth colorization through cached lookup tables.
+
+A colormap is expanded once into a 65536-entry BGR table per (colormap, range,
+invalid color), so ``uint16`` depth is colorized with a single indexing
+operation. Float depth, and depth colorized over its own valid range, is first
+quantized to 16 bits over the range and indexes one range-independent table.
+Depth of 0 or less and NaN is invalid and shown in ``invalid`` when it is
+given.
+
+Colormaps are ``spectral`` (matplotlib's ``Spectral``, from its control points)
+and every OpenCV colormap by name, e.g. ``jet`` or ``turbo``.
+
+Usage:
+    from utils.colorize import colorize
+    image = colorize(depth, 0, 2000)  # uint8 BGR
+    image = colorize(depth, cmap="jet", invalid=(0, 0, 0))  # valid range
+"""
+
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+LUT_SIZE = 1 << 16
+
+# ColorBrewer control points of matplotlib's Spectral, RGB from low to high
+SPECTRAL = [
+    (158, 1, 66),
+    (213, 62, 79),
+    (244, 109, 67),
+    (253, 174, 97),
+    (254, 224, 139),
+    (255, 255, 191),
+    (230, 245, 152),
+    (171, 221, 164),
+    (102, 194, 165),
+    (50, 136, 189),
+    (94, 79, 162),
+]
+
+
+@lru_cache(maxsize=None)
+def palette(cmap):
+    """256 BGR colors of ``cmap`` from low to high."""
+    cmap = cmap.lower()
+    if cmap == "spectral":
+        points = np.array(SPECTRAL, dtype=np.float64)[:, ::-1]
+        x = np.linspace(0, 1, 256)
+        stops = np.linspace(0, 1, len(points))
+        colors = [np.interp(x, stops, points[:, channel]) for channel in range(3)]
+        return np.round(np.stack(colors, axis=1)).astype(np.uint8)
+    code = getattr(cv2, f"COLORMAP_{cmap.upper()}", None)
+    if code is None:
+        raise ValueError(f"Unknown colormap {cmap}")
+    levels = np.arange(256, dtype=np.uint8).reshape(256, 1)
+    return cv2.applyColorMap(levels, code).reshape(256, 3)
+
+
+@lru_cache(maxsize=32)
+def depth_lut(cmap, min_value, max_value, invalid=None):
+    """BGR color of every 16-bit depth value.
+
+    Args:
+        cmap (str): Colormap name
+        min_value (float): Depth shown in the lowest color
+        max_value (float): Depth shown in the highest color
+        invalid (tuple): BGR color of depth 0, default the lowest color
+
+    Returns:
+        np.ndarray: Read-only (65536, 3) uint8 table
+    """
+    values = np.arange(LUT_SIZE, dtype=np.float64)
+    scaled = (values - min_value) / max(max_value - min_value, 1e-6)
+    # Same binning as a 256-color matplotlib colormap
+    index = np.clip((scaled * 256).astype(np.int64), 0, 255)
+    lut = palette(cmap)[index]
+    if invalid is not None:
+        lut[0] = invalid
+    lut.setflags(write=False)
+    return lut
+
+
+def valid_range(depth):
+    """(min, max) of the valid depth, None if there is none."""
+    valid = np.isfinite(depth) & (depth > 0) if depth.dtype.kind == "f" else depth > 0
+    if not valid.any():
+        return None
+    return depth.min(where=valid, initial=np.inf), depth.max(
+        where=valid, initial=-np.inf
+    )
+
+
+def quantize(depth, min_value, max_value):
+    """Depth as uint16 over [min, max]: 1 to 65535 when valid, 0 when invalid."""
+    scale = (LUT_SIZE - 2) / max(float(max_value) - float(min_value), 1e-6)
+    scaled = depth.astype(np.float32)
+    scaled -= min_value
+    scaled *= scale
+    scaled += 1
+    np.clip(scaled, 1, LUT_SIZE - 1, out=scaled)
+    # NaN compares False, so it is invalid as well
+    scaled[~(depth > 0)] = 0
+    return scaled.astype(np.uint16)
+
+
+def colorize(depth, min_value=None, max_value=None, cmap="spectral", invalid=None):
+    """Colorize a depth image.
+
+    Args:
+        depth (np.ndarray): (H, W) depth of any dtype
+        min_value (float): Depth shown in the lowest color, default the
+            lowest valid depth of the image
+        max_value (float): Depth shown in the highest color, default the
+            highest valid depth of the image
+        cmap (str): Colormap name
+        invalid (tuple): BGR color of invalid depth, default the lowest color
+
+    Returns:
+        np.ndarray: (H, W, 3) uint8 BGR image
+    """
+    if min_value is None or max_value is None:
+        found = valid_range(depth)
+        if found is None:
+            low = invalid if invalid is not None else palette(cmap)[0]
+            return np.full((*depth.shape, 3), low, dtype=np.uint8)
+        min_value = found[0] if min_value is None else min_value
+        max_value = found[1] if max_value is None else max_value
+    if invalid is not None:
+        invalid = tuple(int(channel) for channel in invalid)
+
+    if depth.dtype in (np.uint8, np.uint16):
+        lut = depth_lut(cmap, float(min_value), float(max_value), invalid)
+        return np.take(lut, depth, axis=0)
+    lut = depth_lut(cmap, 1.0, float(LUT_SIZE - 1), invalid)
+    return np.take(lut, quantize(depth, min_value, max_value), axis=0)
@@ -0,0 +1,346 @@
+"""Append-only chunked frame container.
+
+One container file holds a single stream (e.g. ``depth`` or ``color``) of one
+camera. Frames are stored as ``.npy`` records grouped into fixed-size chunks,
+each optionally zlib-compressed, and an index footer maps frame numbers to
+their chunk and offset for random access::
+
+    MAGIC version
+    chunk*    CHUNK_HEADER (compression, stored_size, raw_size) + payload
+    footer    frame table + chunk table + TRAILER (n_frames, n_chunks) + MAGIC
+
+A chunk payload is a sequence of RECORD_HEADER (frame_number, size) + npy
+bytes. Chunk headers make a container without footer (e.g. after a crash)
+readable by scanning.
+
+Usage:
+    python -m utils.container <session_dir> [--compression zlib] [--delete]
+"""
+
+from collections import defaultdict
+from pathlib import Path
+import argparse
+import io
+import os
+import re
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+MAGIC = b"DRFRAMES"
+VERSION = 1
+SUFFIX = ".frames"
+
+CHUNK_HEADER = struct.Struct("<4sIQQ")
+CHUNK_MAGIC = b"CHNK"
+RECORD_HEADER = struct.Struct("<qQ")
+TRAILER = struct.Struct("<QQ8s")
+
+COMPRESSIONS = {None: 0, "zlib": 1}
+
+frame_table_dtype = np.dtype(
+    [("frame", "<i8"), ("chunk", "<u4"), ("offset", "<u8"), ("size", "<u8")]
+)
+chunk_table_dtype = np.dtype(
+    [
+        ("offset", "<u8"),
+        ("stored_size", "<u8"),
+        ("raw_size", "<u8"),
+        ("compression", "<u4"),
+    ]
+)
+
+loose_file_pattern = re.compile(r"^(?P<stream>.+)_(?P<frame>\d+)\.(png|npy)$")
+
+
+class ContainerWriter:
+    """Write frames of one stream into a chunked container file.
+
+    Args:
+        path (str or Path): Container file to create
+        chunk_frames (int): Number of frames per chunk
+        compression (str): None or "zlib"
+    """
+
+    def __init__(self, path, chunk_frames=32, compression=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}")
+        self.path = Path(path)
+        self.chunk_frames = chunk_frames
+        self.compression = compression
+
+        self.file = open(self.path, "wb")
+        self.file.write(MAGIC + struct.pack("<I", VERSION))
+        self.frames = []
+        self.chunks = []
+        self.pending = []
+        self.pending_frames = []
+
+    def append(self, frame_number, array):
+        buffer = io.BytesIO()
+        np.lib.format.write_array(buffer, np.asanyarray(array), allow_pickle=False)
+        self.pending.append(buffer.getvalue())
+        self.pending_frames.append(frame_number)
+        if len(self.pending) >= self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        """Write all pending frames as one chunk."""
+        if not self.pending:
+            return
+        chunk_id = len(self.chunks)
+        parts = []
+        offset = 0
+        for frame_number, payload in zip(self.pending_frames, self.pending):
+            parts.append(RECORD_HEADER.pack(frame_number, len(payload)))
+            parts.append(payload)
+            offset += RECORD_HEADER.size
+            self.frames.append((frame_number, chunk_id, offset, len(payload)))
+            offset += len(payload)
+        raw = b"".join(parts)
+        stored = zlib.compress(raw, 1) if self.compression == "zlib" else raw
+
+        compression = COMPRESSIONS[self.compression]
+        chunk_offset = self.file.tell()
+        self.file.write(
+            CHUNK_HEADER.pack(CHUNK_MAGIC, compression, len(stored), len(raw))
+        )
+        self.file.write(stored)
+        self.chunks.append((chunk_offset, len(stored), len(raw), compression))
+        self.pending = []
+        self.pending_frames = []
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.write(np.array(self.frames, dtype=frame_table_dtype).tobytes())
+        self.file.write(np.array(self.chunks, dtype=chunk_table_dtype).tobytes())
+        self.file.write(TRAILER.pack(len(self.frames), len(self.chunks), MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ContainerReader:
+    """Random access to the frames of one container file.
+
+    Uncompressed frames are read directly from their offset; for compressed
+    containers the most recently decompressed chunk is cached, so sequential
+    reads decompress every chunk once.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = open(self.path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path} is not a frame container")
+        (self.version,) = struct.unpack("<I", self.file.read(4))
+        self._cached_chunk = (None, None)
+
+        frames, chunks = self._read_footer()
+        if frames is None:
+            frames, chunks = self._scan_chunks()
+        order = np.argsort(frames["frame"], kind="stable")
+        self.frames = frames[order]
+        self.chunks = chunks
+        self.frame_numbers = self.frames["frame"]
+
+    def _read_footer(self):
+        size = self.file.seek(0, os.SEEK_END)
+        if size < TRAILER.size:
+            return None, None
+        self.file.seek(size - TRAILER.size)
+        n_frames, n_chunks, magic = TRAILER.unpack(self.file.read(TRAILER.size))
+        if magic != MAGIC:
+            return None, None
+        tables_size = (
+            n_frames * frame_table_dtype.itemsize
+            + n_chunks * chunk_table_dtype.itemsize
+        )
+        self.file.seek(size - TRAILER.size - tables_size)
+        frames = np.frombuffer(
+            self.file.read(n_frames * frame_table_dtype.itemsize),
+            dtype=frame_table_dtype,
+        )
+        chunks = np.frombuffer(
+            self.file.read(n_chunks * chunk_table_dtype.itemsize),
+            dtype=chunk_table_dtype,
+        )
+        return frames, chunks
+
+    def _scan_chunks(self):
+        # No footer: the writer did not close the file, recover complete chunks
+        frames, chunks = [], []
+        offset = len(MAGIC) + 4
+        while True:
+            self.file.seek(offset)
+            header = self.file.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                break
+            magic, compression, stored_size, raw_size = CHUNK_HEADER.unpack(header)
+            if magic != CHUNK_MAGIC:
+                break
+            chunk_id = len(chunks)
+            chunks.append((offset, stored_size, raw_size, compression))
+            raw = self._read_chunk(chunk_id, chunks[-1])
+            if raw is None:
+                chunks.pop()
+                break
+            record_offset = 0
+            while record_offset < len(raw):
+                frame_number, size = RECORD_HEADER.unpack_from(raw, record_offset)
+                record_offset += RECORD_HEADER.size
+                frames.append((frame_number, chunk_id, record_offset, size))
+                record_offset += size
+            offset += CHUNK_HEADER.size + stored_size
+        return (
+            np.array(frames, dtype=frame_table_dtype),
+            np.array(chunks, dtype=chunk_table_dtype),
+        )
+
+    def _read_chunk(self, chunk_id, chunk=None):
+        if self._cached_chunk[0] == chunk_id:
+            return self._cached_chunk[1]
+        offset, stored_size, raw_size, compression = (
+            chunk if chunk else self.chunks[chunk_id]
+        )
+        self.file.seek(int(offset) + CHUNK_HEADER.size)
+        stored = self.file.read(int(stored_size))
+        if len(stored) < stored_size:
+            return None
+        raw = zlib.decompress(stored) if compression else stored
+        if len(raw) != raw_size:
+            return None
+        self._cached_chunk = (chunk_id, raw)
+        return raw
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, frame_number):
+        i = np.searchsorted(self.frame_numbers, frame_number)
+        return i < len(self.frame_numbers) and self.frame_numbers[i] == frame_number
+
+    def __getitem__(self, frame_number):
+        i = np.searchsorted(self.frame_numbers, frame_number)
+        if i >= len(self.frame_numbers) or self.frame_numbers[i] != frame_number:
+            raise KeyError(f"Frame {frame_number} not in {self.path}")
+        _, chunk_id, offset, size = (int(value) for value in self.frames[i])
+        chunk = self.chunks[chunk_id]
+
+        if chunk["compression"] == 0:
+            self.file.seek(int(chunk["offset"]) + CHUNK_HEADER.size + offset)
+            payload = self.file.read(size)
+        else:
+            raw = self._read_chunk(chunk_id)
+            payload = raw[offset : offset + size]
+        return np.lib.format.read_array(io.BytesIO(payload), allow_pickle=False)
+
+    def close(self):
+        self.file.close()
+
+
+class ContainerStream:
+    """All container shards of one stream in a camera directory.
+
+    Every writer process appends to its own shard ``<stream>.<shard>.frames``;
+    this merges their indexes so frames can be looked up by frame number.
+    """
+
+    def __init__(self, camera_dir, stream):
+        self.readers = [
+            ContainerReader(path)
+            for path in sorted(Path(camera_dir).glob(f"{stream}.*{SUFFIX}"))
+        ]
+        frame_numbers = [reader.frame_numbers for reader in self.readers]
+        shard_ids = [
+            np.full(len(numbers), i, dtype=np.int32)
+            for i, numbers in enumerate(frame_numbers)
+        ]
+        frame_numbers = np.concatenate(frame_numbers or [np.zeros(0, np.int64)])
+        shard_ids = np.concatenate(shard_ids or [np.zeros(0, np.int32)])
+        order = np.argsort(frame_numbers, kind="stable")
+        self.frame_numbers = frame_numbers[order]
+        self.shard_ids = shard_ids[order]
+
+    def __len__(self):
+        return len(self.frame_numbers)
+
+    def __getitem__(self, frame_number):
+        i = np.searchsorted(self.frame_numbers, frame_number)
+        if i >= len(self.frame_numbers) or self.frame_numbers[i] != frame_number:
+            raise KeyError(f"Frame {frame_number} not found")
+        return self.readers[self.shard_ids[i]][frame_number]
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+
+def list_container_streams(camera_dir):
+    """Names of all streams stored as containers in ``camera_dir``."""
+    return sorted(
+        {
+            entry.name.split(".")[0]
+            for entry in os.scandir(camera_dir)
+            if entry.name.endswith(SUFFIX)
+        }
+    )
+
+
+def convert_camera_dir(camera_dir, compression=None, chunk_frames=32, delete=False):
+    """Pack the loose PNG/NPY files of one camera directory into containers."""
+    camera_dir = Path(camera_dir)
+    files = defaultdict(list)
+    for entry in os.scandir(camera_dir):
+        match = loose_file_pattern.match(entry.name)
+        if match:
+            files[match["stream"]].append((int(match["frame"]), entry.path))
+
+    for stream, stream_files in files.items():
+        stream_files.sort()
+        path = camera_dir / f"{stream}.0{SUFFIX}"
+        with ContainerWriter(path, chunk_frames, compression) as writer:
+            for frame_number, file_path in stream_files:
+                if file_path.endswith(".npy"):
+                    array = np.load(file_path)
+                else:
+                    array = cv2.imread(file_path, cv2.IMREAD_UNCHANGED)
+                writer.append(frame_number, array)
+        print(f"Packed {len(stream_files)} {stream} frames into {path}")
+
+        if delete:
+            for _, file_path in stream_files:
+                os.remove(file_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a recorded session from loose files to containers"
+    )
+    parser.add_argument("session_dir", type=str, help="recorded_data/<timestamp>")
+    parser.add_argument(
+        "--compression", type=str, choices=["zlib"], help="Chunk compression"
+    )
+    parser.add_argument("--chunk_frames", type=int, help="Frames per chunk", default=32)
+    parser.add_argument(
+        "--delete", action="store_true", help="Delete loose files after packing"
+    )
+    args = parser.parse_args()
+
+    for entry in sorted(os.scandir(args.session_dir), key=lambda e: e.name):
+        if entry.is_dir():
+            convert_camera_dir(
+                entry.path, args.compression, args.chunk_frames, args.delete
+            )
+
+
+if __name__ == "__main__":
+    main()
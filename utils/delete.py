@@ -17,7 +17,10 @@ def delete_files(directory, idx=None, min_idx=None, max_idx=None):
             # Extract the idx from the filename (depth_idx.png or color_idx.png)
             try:
                 file_name_split = filename.split("_")
-                prefix, file_idx_str = "_".join(file_name_split[0]), file_name_split[-1]
+                prefix, file_idx_str = (
+                    "_".join(file_name_split[:-1]),
+                    file_name_split[-1],
+                )
                 file_idx = int(file_idx_str.split(".")[0])
             except ValueError:
                 continue  # Skip files that don't match the expected pattern
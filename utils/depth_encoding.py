@@ -0,0 +1,153 @@
+"""Depth map encoding for storage.
+
+Depth is stored as one or more of:
+
+- ``float32``: the camera's float depth, unchanged, as NPY
+- ``float16``: the same at half precision, as NPY
+- ``uint16``: ``depth * scale`` truncated to integers, as 16-bit PNG. Invalid
+  depth (NaN, -inf, <= 0) becomes 0, depth beyond the range (+inf included)
+  saturates at 65535.
+
+Recorders that encode depth write ``depth.json`` to the camera directory with
+the units of the camera's depth and the encoding and scale of every depth
+stream, so any of them can be decoded back to depth with ``load_depth``.
+"""
+
+from pathlib import Path
+import json
+
+import numpy as np
+
+ENCODINGS = ["float32", "float16", "uint16"]
+DEPTH_INFO_FILE = "depth.json"
+
+# Meters per unit of depth.json "units"
+unit_scales = {"m": 1.0, "mm": 1e-3}
+
+# Encoders of this process, see ``depth_encoder``
+_encoders = {}
+
+
+class DepthEncoder:
+    """Encode float depth into an output buffer reused across frames.
+
+    Conversion runs as in-place ufuncs on preallocated buffers, so encoding a
+    frame allocates nothing once the first frame set the buffer sizes.
+    """
+
+    def __init__(self, encoding="uint16", scale=1000.0):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown depth encoding {encoding}")
+        self.encoding = encoding
+        self.scale = scale
+        self.out = None
+        self.scratch = None
+
+    def __call__(self, depth):
+        if self.encoding == "float32":
+            return depth
+
+        if self.out is None or self.out.shape != depth.shape:
+            self.out = np.empty(depth.shape, dtype=self.encoding)
+            if self.encoding == "uint16":
+                self.scratch = np.empty(depth.shape, dtype=np.float32)
+
+        if self.encoding == "float16":
+            self.out[...] = depth
+            return self.out
+
+        np.multiply(depth, self.scale, out=self.scratch)
+        np.fmax(self.scratch, 0, out=self.scratch)  # NaN, -inf -> 0
+        np.fmin(self.scratch, 65535, out=self.scratch)  # +inf -> 65535
+        self.out[...] = self.scratch
+        return self.out
+
+
+def depth_encoder(encoding, scale=1000.0):
+    """Return the cached DepthEncoder of this process for ``encoding``."""
+    key = (encoding, scale)
+    if key not in _encoders:
+        _encoders[key] = DepthEncoder(encoding, scale)
+    return _encoders[key]
+
+
+def write_depth(store, stream, frame_count, depth, encoding, scale=1000.0):
+    """Encode ``depth`` and write it to ``store`` as ``stream``."""
+    encoded = depth_encoder(encoding, scale)(depth)
+    if encoding == "uint16":
+        store.write_image(stream, frame_count, encoded)
+    else:
+        store.write_array(stream, frame_count, encoded)
+
+
+def decode_depth(encoded, scale=1.0):
+    """Decode a stored depth frame to float32 in the camera's units."""
+    depth = np.asarray(encoded, dtype=np.float32)
+    if scale != 1:
+        depth = depth / np.float32(scale)
+    return depth
+
+
+def write_depth_info(camera_dir, streams, units="m", scale=1000.0):
+    """Describe the depth streams of a camera directory.
+
+    Args:
+        camera_dir (Path): Camera directory
+        streams (list): (stream, encoding) of every stored depth stream, in
+            order of preference for decoding
+        units (str): Units of the camera's float depth
+        scale (float): Scale of the uint16 streams
+    """
+    info = dict(
+        units=units,
+        streams={
+            stream: dict(
+                encoding=encoding, scale=scale if encoding == "uint16" else 1.0
+            )
+            for stream, encoding in streams
+        },
+    )
+    with open(Path(camera_dir) / DEPTH_INFO_FILE, "w") as f:
+        json.dump(info, f, indent=2)
+
+
+def read_depth_info(camera_dir):
+    """Load ``depth.json`` of a camera directory, None if there is none."""
+    path = Path(camera_dir) / DEPTH_INFO_FILE
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def stored_depth_range(camera_dir, stream, depth_range_mm):
+    """``depth_range_mm`` in the stored values of a depth stream.
+
+    Streams missing from ``depth.json``, as in sessions recorded before it,
+    are taken to be stored in millimeters.
+    """
+    info = read_depth_info(camera_dir)
+    if info is None or stream not in info["streams"]:
+        return tuple(depth_range_mm)
+    scale = info["streams"][stream]["scale"] / (unit_scales[info["units"]] * 1000)
+    return tuple(value * scale for value in depth_range_mm)
+
+
+def load_depth(camera, i):
+    """Depth of the i-th frame of a camera as float32 in the camera's units.
+
+    Args:
+        camera (utils.session_reader.CameraReader): Recorded camera
+        i (int): Frame position
+
+    Returns:
+        np.ndarray: Depth decoded from the first available stream of
+            ``depth.json``
+    """
+    info = read_depth_info(camera.camera_dir)
+    if info is None:
+        raise KeyError(f"{camera.camera_dir} has no {DEPTH_INFO_FILE}")
+    for stream, encoding in info["streams"].items():
+        if stream in camera:
+            return decode_depth(camera[stream][i], encoding["scale"])
+    raise KeyError(f"{camera.camera_dir} has none of {list(info['streams'])}")
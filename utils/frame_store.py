@@ -0,0 +1,129 @@
+from pathlib import Path
+import os
+import time
+
+import cv2
+import numpy as np
+
+from utils import tracing
+from utils.container import ContainerWriter, SUFFIX
+from utils.manifest import ManifestWriter, WRITE_LOG_PREFIX, write_log_dtype
+
+STORAGE_FORMATS = ["files", "container"]
+
+# Stores opened in this process, see ``open_store``
+_stores = {}
+
+
+class FrameStore:
+    """Base class of the frame stores, logs when each frame is written."""
+
+    def __init__(self, camera_dir):
+        self.camera_dir = Path(camera_dir)
+        self.write_log = None
+
+    def finish_frame(self, frame_count):
+        """Record that all streams of ``frame_count`` are saved."""
+        if self.write_log is None:
+            self.write_log = ManifestWriter(
+                self.camera_dir / f"{WRITE_LOG_PREFIX}{os.getpid()}.bin",
+                dtype=write_log_dtype,
+            )
+        self.write_log.append(frame_count, time.monotonic_ns())
+        if tracing.tracer:
+            tracing.tracer.lap("finish_frame")
+
+    def close(self):
+        if self.write_log is not None:
+            self.write_log.close()
+            self.write_log = None
+
+
+class LooseFileStore(FrameStore):
+    """Save every frame of every stream as its own PNG/NPY file."""
+
+    def __reduce__(self):
+        return open_store, (self.camera_dir, "files")
+
+    def write_image(self, stream, frame_count, image):
+        cv2.imwrite(str(self.camera_dir / f"{stream}_{frame_count}.png"), image)
+        if tracing.tracer:
+            tracing.tracer.lap(f"write {stream}")
+
+    def write_array(self, stream, frame_count, array):
+        np.save(str(self.camera_dir / f"{stream}_{frame_count}.npy"), array)
+        if tracing.tracer:
+            tracing.tracer.lap(f"write {stream}")
+
+
+class ContainerStore(FrameStore):
+    """Append frames to one chunked container per stream.
+
+    Each writer process gets its own shard ``<stream>.<pid>.frames`` so writers
+    never share a file; ``utils.container.ContainerStream`` merges the shards.
+    ``shard`` names the shards explicitly instead, for writers that are not
+    one per process.
+    """
+
+    def __init__(self, camera_dir, compression=None, chunk_frames=32, shard=None):
+        super().__init__(camera_dir)
+        self.compression = compression
+        self.chunk_frames = chunk_frames
+        self.shard = shard
+        self.writers = {}
+
+    def __reduce__(self):
+        return open_store, (
+            self.camera_dir,
+            "container",
+            self.compression,
+            self.chunk_frames,
+        )
+
+    def _writer(self, stream):
+        if stream not in self.writers:
+            self.writers[stream] = ContainerWriter(
+                self.camera_dir / f"{stream}.{self.shard or os.getpid()}{SUFFIX}",
+                chunk_frames=self.chunk_frames,
+                compression=self.compression,
+            )
+        return self.writers[stream]
+
+    def write_image(self, stream, frame_count, image):
+        self.write_array(stream, frame_count, image)
+
+    def write_array(self, stream, frame_count, array):
+        self._writer(stream).append(frame_count, array)
+        if tracing.tracer:
+            tracing.tracer.lap(f"write {stream}")
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+        super().close()
+
+
+def open_store(camera_dir, storage_format="files", compression=None, chunk_frames=32):
+    """Return the frame store of ``camera_dir`` for this process.
+
+    Stores are cached per process and unpickle through this function, so a
+    store passed to writer processes with every frame resolves to one
+    long-lived instance in each of them.
+    """
+    key = (str(camera_dir), storage_format)
+    if key not in _stores:
+        if storage_format == "files":
+            _stores[key] = LooseFileStore(camera_dir)
+        elif storage_format == "container":
+            _stores[key] = ContainerStore(camera_dir, compression, chunk_frames)
+        else:
+            raise ValueError(f"Unknown storage format {storage_format}")
+    return _stores[key]
+
+
+def close_stores():
+    """Flush and close every store opened in this process."""
+    for store in _stores.values():
+        store.close()
+    _stores.clear()
@@ -0,0 +1,156 @@
+"""Per-frame capture manifest.
+
+Recorders append one row per captured frame to ``manifest.bin`` in the camera
+directory and every writer process appends the completion time of each frame
+it saved to ``writes.<pid>.bin``. Frames or streams dropped under writer
+backpressure are logged to ``drops.bin``. All are raw arrays of fixed-size records,
+buffered and written in batches. Timestamps are ``time.monotonic_ns()``,
+which is shared by all processes of the host, so they can be compared across
+cameras; device timestamps are in the camera's own clock.
+
+Usage:
+    python -m utils.manifest <camera_dir>
+"""
+
+from pathlib import Path
+import argparse
+import sys
+import time
+
+import numpy as np
+
+MANIFEST_FILE = "manifest.bin"
+WRITE_LOG_PREFIX = "writes."
+DROP_LOG_FILE = "drops.bin"
+
+manifest_dtype = np.dtype(
+    [
+        ("frame", "<i8"),
+        ("host_ns", "<i8"),
+        ("device_us", "<i8"),
+        ("grab_latency_us", "<i8"),
+    ]
+)
+write_log_dtype = np.dtype([("frame", "<i8"), ("write_done_ns", "<i8")])
+# Stream "*" is a whole dropped frame
+drop_log_dtype = np.dtype([("frame", "<i8"), ("host_ns", "<i8"), ("stream", "S16")])
+frame_record_dtype = np.dtype(manifest_dtype.descr + [("write_done_ns", "<i8")])
+
+
+class ManifestWriter:
+    """Append fixed-size records to a file in batches.
+
+    Rows go into a preallocated structured array and are written with a single
+    ``write`` once ``batch_size`` rows are buffered.
+    """
+
+    def __init__(self, path, dtype=manifest_dtype, batch_size=64):
+        self.path = Path(path)
+        self.buffer = np.zeros(batch_size, dtype=dtype)
+        self.count = 0
+        self.file = None
+
+    def append(self, *row):
+        self.buffer[self.count] = row
+        self.count += 1
+        if self.count == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if not self.count:
+            return
+        if self.file is None:
+            self.file = open(self.path, "ab")
+        self.file.write(self.buffer[: self.count].tobytes())
+        self.file.flush()
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class CaptureManifest(ManifestWriter):
+    """Capture-side manifest of one camera directory."""
+
+    def __init__(self, camera_dir, batch_size=64):
+        super().__init__(Path(camera_dir) / MANIFEST_FILE, manifest_dtype, batch_size)
+
+    def record(self, frame, grab_start_ns, device_us=-1):
+        """Log a frame grabbed between ``grab_start_ns`` and now."""
+        host_ns = time.monotonic_ns()
+        self.append(frame, host_ns, device_us, (host_ns - grab_start_ns) // 1000)
+
+
+class DropLog(ManifestWriter):
+    """Frames and streams the recorder dropped instead of writing."""
+
+    def __init__(self, camera_dir, batch_size=64):
+        super().__init__(Path(camera_dir) / DROP_LOG_FILE, drop_log_dtype, batch_size)
+
+    def record(self, frame, stream=None):
+        self.append(frame, time.monotonic_ns(), "*" if stream is None else stream)
+
+
+def read_drops(camera_dir):
+    """Load the drop log of a camera directory, sorted by frame number."""
+    path = Path(camera_dir) / DROP_LOG_FILE
+    if not path.exists():
+        return np.zeros(0, dtype=drop_log_dtype)
+    drops = np.fromfile(path, dtype=drop_log_dtype)
+    return drops[np.argsort(drops["frame"], kind="stable")]
+
+
+def read_manifest(camera_dir):
+    """Load the manifest of a camera directory as a structured array.
+
+    Returns one record per captured frame, sorted by frame number, with the
+    write completion time joined in (-1 if the frame was never written).
+    """
+    camera_dir = Path(camera_dir)
+    path = camera_dir / MANIFEST_FILE
+    if path.exists():
+        rows = np.fromfile(path, dtype=manifest_dtype)
+    else:
+        rows = np.zeros(0, dtype=manifest_dtype)
+    rows = rows[np.argsort(rows["frame"], kind="stable")]
+
+    writes = [
+        np.fromfile(log, dtype=write_log_dtype)
+        for log in sorted(camera_dir.glob(f"{WRITE_LOG_PREFIX}*.bin"))
+    ]
+    writes = np.concatenate(writes) if writes else np.zeros(0, write_log_dtype)
+    writes = writes[np.argsort(writes["frame"], kind="stable")]
+
+    records = np.zeros(len(rows), dtype=frame_record_dtype)
+    for name in manifest_dtype.names:
+        records[name] = rows[name]
+    records["write_done_ns"] = -1
+    if len(writes):
+        i = np.searchsorted(writes["frame"], rows["frame"])
+        i = np.minimum(i, len(writes) - 1)
+        found = writes["frame"][i] == rows["frame"]
+        records["write_done_ns"][found] = writes["write_done_ns"][i[found]]
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a capture manifest as CSV")
+    parser.add_argument("camera_dir", type=str, help="Camera directory")
+    args = parser.parse_args()
+
+    records = read_manifest(args.camera_dir)
+    np.savetxt(
+        sys.stdout,
+        records,
+        fmt="%d",
+        delimiter=",",
+        header=",".join(records.dtype.names),
+        comments="",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Capture health metrics of every camera, served in Prometheus text format.
+
+Each recorder and each of its writer processes owns one row of counters,
+gauges and histograms in shared memory and is the only process writing it,
+so updates are plain stores without locks. ``serve_metrics`` runs in the main
+process, sums the rows of every camera when scraped and serves them on
+``http://localhost:<port>/metrics``:
+
+- ``depth_recording_frames_total``: frames captured
+- ``depth_recording_capture_fps``: capture rate over the last second
+- ``depth_recording_last_frame_age_seconds``: time since the last frame,
+  grows when a camera stalls
+- ``depth_recording_queue_depth``: frames waiting for the writers
+- ``depth_recording_dropped_frames_total``, ``..._dropped_streams_total``:
+  frames and streams dropped under writer backpressure
+- ``depth_recording_missed_ticks_total``: capture ticks the recorder was late for
+- ``depth_recording_written_frames_total``, ``..._failed_writes_total``,
+  ``..._written_bytes_total``: writer results
+- ``depth_recording_grab_latency_seconds``, ``..._align_seconds``,
+  ``..._write_latency_seconds``: histograms of the grab, depth alignment and
+  write (queued to saved) stages
+
+Usage:
+    python main.py --rs --zed --metrics_port 9100
+    curl localhost:9100/metrics
+"""
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import RawArray
+import threading
+import time
+
+import numpy as np
+
+PREFIX = "depth_recording"
+
+COUNTERS = {
+    "frames": "Frames captured",
+    "dropped_frames": "Frames dropped under writer backpressure",
+    "dropped_streams": "Streams of frames skipped under writer backpressure",
+    "missed_ticks": "Capture ticks the recorder was late for",
+    "written_frames": "Frames saved by the writers",
+    "failed_writes": "Frames the writers failed to save",
+    "written_bytes": "Bytes of frame data saved by the writers",
+}
+GAUGES = {
+    "queue_depth": "Frames waiting for the writers",
+    "last_frame_ns": None,
+}
+HISTOGRAMS = {
+    "grab_latency": "Time from grab start to frame in the recorder",
+    "align": "Time spent aligning depth to color",
+    "write_latency": "Time from queued to saved",
+}
+# Histogram bucket upper bounds, 0.5 ms to 1 s, in microseconds
+BUCKETS_US = [ms * 1000 for ms in (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)]
+
+# Offsets of every metric in a row; histograms hold one count per bucket plus
+# +Inf, then the sum in microseconds
+OFFSETS = {}
+_size = 0
+for _name in list(COUNTERS) + list(GAUGES):
+    OFFSETS[_name] = _size
+    _size += 1
+for _name in HISTOGRAMS:
+    OFFSETS[_name] = _size
+    _size += len(BUCKETS_US) + 2
+ROW_SIZE = _size
+
+
+class MetricsRow:
+    """Metrics written by one process, see ``MetricsBoard``."""
+
+    def __init__(self, board, camera, row):
+        self.board = board
+        self.camera = camera
+        self.row = row
+        self._values = None
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = self.board.rows[self.camera, self.row]
+        return self._values
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_values"] = None
+        return state
+
+    def count(self, name, n=1):
+        self.values[OFFSETS[name]] += n
+
+    def set(self, name, value):
+        self.values[OFFSETS[name]] = value
+
+    def observe(self, name, value_us):
+        offset = OFFSETS[name]
+        values = self.values
+        values[offset + bisect_left(BUCKETS_US, value_us)] += 1
+        values[offset + len(BUCKETS_US) + 1] += int(value_us)
+
+
+class CameraMetrics(MetricsRow):
+    """Metrics of one camera: the recorder's row and one row per writer."""
+
+    def __init__(self, board, camera):
+        super().__init__(board, camera, 0)
+
+    def writer(self, index):
+        return MetricsRow(self.board, self.camera, 1 + index)
+
+
+class MetricsBoard:
+    """Shared metrics of all cameras, created before the camera processes.
+
+    Args:
+        camera_names (list): Names of the cameras
+        num_writers (int): Writer processes per camera
+    """
+
+    def __init__(self, camera_names, num_writers=2):
+        self.camera_names = list(camera_names)
+        self.rows_per_camera = 1 + num_writers
+        self.buffer = RawArray(
+            "q", len(self.camera_names) * self.rows_per_camera * ROW_SIZE
+        )
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = np.frombuffer(self.buffer, dtype=np.int64).reshape(
+                len(self.camera_names), self.rows_per_camera, ROW_SIZE
+            )
+        return self._rows
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_rows"] = None
+        return state
+
+    def camera(self, index):
+        """Metrics of the ``index``-th camera, passed to its recorder."""
+        return CameraMetrics(self, index)
+
+    def snapshot(self):
+        """Per camera totals: the recorder's gauges, everything else summed."""
+        rows = self.rows.copy()
+        totals = rows.sum(axis=1)
+        for name in GAUGES:
+            totals[:, OFFSETS[name]] = rows[:, 0, OFFSETS[name]]
+        return totals
+
+
+def _format_prometheus(board, totals, fps):
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        """``samples`` are (suffix, labels, value) of every camera."""
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for suffix, labels, value in samples:
+            labels = ",".join(f'{key}="{value}"' for key, value in labels.items())
+            lines.append(f"{PREFIX}_{name}{suffix}{{{labels}}} {value}")
+
+    cameras = [{"camera": name} for name in board.camera_names]
+    for name, help_text in COUNTERS.items():
+        metric(
+            f"{name}_total",
+            "counter",
+            help_text,
+            [("", c, int(t[OFFSETS[name]])) for c, t in zip(cameras, totals)],
+        )
+    metric(
+        "queue_depth",
+        "gauge",
+        GAUGES["queue_depth"],
+        [("", c, int(t[OFFSETS["queue_depth"]])) for c, t in zip(cameras, totals)],
+    )
+    metric(
+        "capture_fps",
+        "gauge",
+        "Capture rate over the last second",
+        [("", c, round(f, 3)) for c, f in zip(cameras, fps)],
+    )
+    now_ns = time.monotonic_ns()
+    ages = []
+    for c, t in zip(cameras, totals):
+        last_ns = t[OFFSETS["last_frame_ns"]]
+        ages.append(("", c, round((now_ns - last_ns) / 1e9, 3) if last_ns else "NaN"))
+    metric(
+        "last_frame_age_seconds", "gauge", "Time since the last captured frame", ages
+    )
+
+    bounds = [f"{bound / 1e6:g}" for bound in BUCKETS_US] + ["+Inf"]
+    for name, help_text in HISTOGRAMS.items():
+        offset = OFFSETS[name]
+        samples = []
+        for c, t in zip(cameras, totals):
+            counts = np.cumsum(t[offset : offset + len(bounds)])
+            for bound, count in zip(bounds, counts):
+                samples.append(("_bucket", {**c, "le": bound}, int(count)))
+            samples.append(("_sum", c, t[offset + len(bounds)] / 1e6))
+            # The count is derived from the buckets to stay consistent with them
+            samples.append(("_count", c, int(counts[-1])))
+        metric(f"{name}_seconds", "histogram", help_text, samples)
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(board, port, interval_s=1.0):
+    """Serve ``board`` on ``http://localhost:<port>/metrics`` from daemon threads.
+
+    Returns:
+        ThreadingHTTPServer: Call ``shutdown()`` to stop serving
+    """
+    fps = [0.0] * len(board.camera_names)
+
+    def sample_fps():
+        # Frame rates are computed out of band from the frame counters
+        last = board.snapshot()[:, OFFSETS["frames"]]
+        while True:
+            time.sleep(interval_s)
+            frames = board.snapshot()[:, OFFSETS["frames"]]
+            fps[:] = ((frames - last) / interval_s).tolist()
+            last = frames
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = _format_prometheus(board, board.snapshot(), fps).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=sample_fps, daemon=True).start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics: serving at http://localhost:{port}/metrics")
+    return server
@@ -1,22 +1,301 @@
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+"""USB bandwidth of every camera, measured with usbmon.
+
+Reads URB completions from the usbmon text interface
+(``/sys/kernel/debug/usb/usbmon/0u``), the binary interface (``/dev/usbmon0``)
+or a file captured from either, sums the transferred bytes per bus and device
+over fixed intervals and maps devices to camera names through sysfs: RealSense
+cameras by ``serial_number_dict``, other cameras by vendor. Sysfs has no byte
+counters, but gives each bus's link speed, so the load of each controller is
+reported against it.
+
+The time series is written as CSV with one row per device and interval:
+``time_us,bus,device,name,bytes,mb_s``. Live text captures are timestamped in
+``time.monotonic_ns() // 1000``, the clock of the capture manifests; binary
+captures in wall-clock microseconds; replayed files in the clock they were
+captured in.
+
+usbmon needs root and ``sudo modprobe usbmon``.
+
+Usage:
+    python -m utils.monitor_usb --output usb_bandwidth.csv
+    python -m utils.monitor_usb --source capture.txt  # replay a captured file
+    python main.py --rs --kn --usb_monitor  # saved next to the session data
+"""
+
+from pathlib import Path
+import argparse
+import os
+import signal
+import struct
+import sys
 import time
-import random  # Replace with real USB data source
 
-fig, ax = plt.subplots()
-x_data, y_data = [], []
+from cameras.realsense import serial_number_dict
+
+TEXT_SOURCE = "/sys/kernel/debug/usb/usbmon/0u"
+BANDWIDTH_FILE = "usb_bandwidth.csv"
+SYSFS_DEVICES = "/sys/bus/usb/devices"
+
+VENDOR_NAMES = {"8086": "realsense", "045e": "kinect", "2b03": "zed"}
+
+# Text timestamps are microseconds modulo 4096 s of CLOCK_MONOTONIC
+TEXT_WRAP_US = 4096 * 1000000
+
+# struct mon_bin_hdr of the legacy read() interface
+binary_header = struct.Struct("<QBBBBHbbqiiII8s")
+
+
+def parse_text_line(line):
+    """(timestamp_us, bus, device, bytes) of a completion, None otherwise.
+
+    Args:
+        line (str): Line of the usbmon text interface,
+            ``<tag> <timestamp> C <type><dir>:<bus>:<dev>:<ep> <status> ... <length> ...``
+    """
+    words = line.split()
+    if len(words) < 6 or words[2] != "C":
+        return None
+    address = words[3].split(":")
+    if len(address) != 4:
+        # Old format without the bus number
+        return None
+    rest = words[5:]
+    if address[0][0] == "Z" and len(rest) > 1 and ":" in rest[1]:
+        # Isochronous descriptor count and status:offset:length descriptors
+        rest = rest[1:]
+        while rest and ":" in rest[0]:
+            rest = rest[1:]
+    if not rest or not rest[0].isdigit():
+        return None
+    return int(words[1]), int(address[1]), int(address[2]), int(rest[0])
+
+
+def read_text_events(f, anchor_us=None):
+    """Completions of a usbmon text capture.
+
+    Args:
+        f (file): Text interface or captured file
+        anchor_us (int): ``time.monotonic_ns() // 1000`` when a live capture
+            started, to restore the monotonic time of the wrapped timestamps.
+            Without it, timestamps are only unwrapped.
+    """
+    offset = 0
+    if anchor_us is not None:
+        offset = anchor_us - anchor_us % TEXT_WRAP_US
+    anchored = anchor_us is None
+    last_us = None
+    for line in f:
+        event = parse_text_line(line)
+        if event is None:
+            continue
+        timestamp_us, bus, device, nbytes = event
+        if not anchored:
+            # The capture may have started just before a wrap
+            if offset + timestamp_us > anchor_us + TEXT_WRAP_US // 2:
+                offset -= TEXT_WRAP_US
+            anchored = True
+        if last_us is not None and timestamp_us < last_us - TEXT_WRAP_US // 2:
+            offset += TEXT_WRAP_US
+        last_us = timestamp_us
+        yield offset + timestamp_us, bus, device, nbytes
+
+
+def read_binary_events(f):
+    """Completions of a usbmon binary capture, timestamps in wall-clock µs."""
+    while True:
+        header = f.read(binary_header.size)
+        if len(header) < binary_header.size:
+            return
+        _, kind, _, _, device, bus, _, _, sec, usec, _, length, captured, _ = (
+            binary_header.unpack(header)
+        )
+        if captured:
+            f.read(captured)
+        if kind == ord("C"):
+            yield sec * 1000000 + usec, bus, device, length
+
+
+def _read_attribute(path, name):
+    try:
+        with open(os.path.join(path, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def usb_devices(sysfs_root=SYSFS_DEVICES):
+    """Attached USB devices by (bus, device) number.
+
+    Returns:
+        dict: (bus, device) -> dict of serial, vendor, product and link
+            speed in Mbps
+    """
+    devices = {}
+    if not os.path.isdir(sysfs_root):
+        return devices
+    for entry in os.scandir(sysfs_root):
+        bus = _read_attribute(entry.path, "busnum")
+        device = _read_attribute(entry.path, "devnum")
+        if bus is None or device is None:
+            continue
+        speed = _read_attribute(entry.path, "speed")
+        devices[int(bus), int(device)] = dict(
+            serial=_read_attribute(entry.path, "serial"),
+            vendor=_read_attribute(entry.path, "idVendor"),
+            product=_read_attribute(entry.path, "product"),
+            speed=float(speed) if speed else None,
+        )
+    return devices
+
+
+def device_names(devices, serial_numbers=serial_number_dict):
+    """Camera names of the USB devices that are cameras."""
+    names = {}
+    for (bus, device), info in devices.items():
+        if info["serial"] in serial_numbers:
+            names[bus, device] = serial_numbers[info["serial"]]
+        elif info["vendor"] in VENDOR_NAMES:
+            names[bus, device] = f"{VENDOR_NAMES[info['vendor']]}_{bus}-{device}"
+    return names
+
+
+class BandwidthMeter:
+    """Bytes per device summed over intervals of ``interval_s``.
+
+    Args:
+        names (dict): (bus, device) -> camera name
+        link_speeds (dict): Bus -> link speed of its root hub in Mbps
+        interval_s (float): Interval length
+        output_file (Path): CSV time series, None to only print
+    """
+
+    def __init__(self, names, link_speeds=None, interval_s=1.0, output_file=None):
+        self.names = names
+        self.link_speeds = link_speeds or {}
+        self.interval_us = int(interval_s * 1000000)
+        self.start_us = None
+        self.counts = {}
+        self.totals = {}
+        self.csv = None
+        if output_file is not None:
+            Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+            self.csv = open(output_file, "w")
+            self.csv.write("time_us,bus,device,name,bytes,mb_s\n")
+
+    def add(self, timestamp_us, bus, device, nbytes):
+        if self.start_us is None:
+            self.start_us = timestamp_us - timestamp_us % self.interval_us
+        while timestamp_us >= self.start_us + self.interval_us:
+            self.flush()
+        key = (bus, device)
+        self.counts[key] = self.counts.get(key, 0) + nbytes
+
+    def name(self, bus, device):
+        return self.names.get((bus, device), f"{bus}-{device}")
+
+    def flush(self):
+        """Emit the current interval and start the next."""
+        seconds = self.interval_us / 1e6
+        bus_bytes = {}
+        cameras = []
+        for (bus, device), nbytes in sorted(self.counts.items()):
+            name = self.name(bus, device)
+            mb_s = nbytes / seconds / 1e6
+            bus_bytes[bus] = bus_bytes.get(bus, 0) + nbytes
+            self.totals[bus, device] = self.totals.get((bus, device), 0) + nbytes
+            if self.csv is not None:
+                self.csv.write(
+                    f"{self.start_us},{bus},{device},{name},{nbytes},{mb_s:.3f}\n"
+                )
+            if (bus, device) in self.names:
+                cameras.append(f"{name} {mb_s:.1f} MB/s")
+        if self.counts:
+            buses = []
+            for bus, nbytes in sorted(bus_bytes.items()):
+                load = f"bus {bus} {nbytes / seconds / 1e6:.1f} MB/s"
+                if self.link_speeds.get(bus):
+                    load += f" ({nbytes * 8 / seconds / 1e6 / self.link_speeds[bus]:.0%} of {self.link_speeds[bus]:g} Mbps)"
+                buses.append(load)
+            print(f"USB: {', '.join(cameras + buses)}")
+        if self.csv is not None:
+            self.csv.flush()
+        self.counts = {}
+        self.start_us += self.interval_us
+
+    def close(self):
+        if self.counts:
+            self.flush()
+        if self.csv is not None:
+            self.csv.close()
+            self.csv = None
+
+
+def open_events(source):
+    """Completions of a usbmon interface or captured file.
+
+    ``/dev/usbmon<N>`` and ``.bin`` files are read as binary, anything else
+    as text.
+    """
+    if source.startswith("/dev/usbmon") or source.endswith(".bin"):
+        return read_binary_events(open(source, "rb"))
+    live = source.startswith("/sys/kernel/debug/")
+    anchor_us = time.monotonic_ns() // 1000 if live else None
+    return read_text_events(open(source), anchor_us)
+
+
+def run_monitor(source=TEXT_SOURCE, output_file=None, interval_s=1.0):
+    """Measure USB bandwidth until the source ends, Ctrl-C or SIGTERM.
+
+    Args:
+        source (str): usbmon text or binary interface, or a captured file
+        output_file (Path): CSV time series
+        interval_s (float): Interval length
+    """
+    # Ends the monitor process with the CSV flushed when the recording stops
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    devices = usb_devices()
+    names = device_names(devices)
+    link_speeds = {
+        bus: info["speed"] for (bus, device), info in devices.items() if device == 1
+    }
+    for (bus, device), name in sorted(names.items()):
+        print(f"USB: {name} on bus {bus} device {device}")
+
+    try:
+        events = open_events(source)
+    except OSError as e:
+        print(f"USB: cannot read {source} - {e}, try sudo modprobe usbmon")
+        return
+    meter = BandwidthMeter(names, link_speeds, interval_s, output_file)
+    try:
+        for event in events:
+            meter.add(*event)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        meter.close()
+        for (bus, device), nbytes in sorted(meter.totals.items()):
+            if (bus, device) in names:
+                print(f"USB: {meter.name(bus, device)} {nbytes / 1e6:.1f} MB total")
 
 
-def update(frame):
-    # Simulate USB bandwidth data (replace with actual data)
-    x_data.append(time.time())
-    y_data.append(random.randint(0, 500))  # Replace with KB/s from usbtop or /sys
-    ax.clear()
-    ax.plot(x_data, y_data, label="USB Bandwidth (KB/s)")
-    ax.legend()
-    plt.xlabel("Time")
-    plt.ylabel("Bandwidth (KB/s)")
+def main():
+    parser = argparse.ArgumentParser(description="Monitor USB bandwidth per camera")
+    parser.add_argument(
+        "--source",
+        type=str,
+        help="usbmon text interface, /dev/usbmon<N>, or a captured file (.bin for binary)",
+        default=TEXT_SOURCE,
+    )
+    parser.add_argument(
+        "--output", type=str, help="CSV time series to write", default=None
+    )
+    parser.add_argument(
+        "--interval", type=float, help="Seconds per measurement", default=1.0
+    )
+    args = parser.parse_args()
+    run_monitor(args.source, args.output, args.interval)
 
 
-ani = animation.FuncAnimation(fig, update, interval=1000)  # Update every 1s
-plt.show()
+if __name__ == "__main__":
+    main()
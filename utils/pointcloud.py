@@ -0,0 +1,158 @@
+"""Point clouds and normals derived from stored depth.
+
+Recorders save the pinhole intrinsics of the depth stream to
+``intrinsics.json`` in the camera directory, so point clouds and normals need
+not be recorded: ``PointCloudReader`` regenerates them from depth on demand.
+
+Points are in meters in the camera's optical frame (x right, y down, z
+forward), which differs from the frame of point clouds recorded by the ZED
+SDK (right-handed, z up, x forward).
+"""
+
+from functools import lru_cache
+from pathlib import Path
+import json
+
+import numpy as np
+
+from utils.depth_encoding import load_depth, read_depth_info, unit_scales
+
+INTRINSICS_FILE = "intrinsics.json"
+
+
+def write_intrinsics(camera_dir, intrinsics):
+    """Save intrinsics {fx, fy, cx, cy, width, height} of a camera directory."""
+    intrinsics = {name: float(value) for name, value in intrinsics.items()}
+    with open(Path(camera_dir) / INTRINSICS_FILE, "w") as f:
+        json.dump(intrinsics, f, indent=2)
+
+
+def read_intrinsics(camera_dir):
+    """Load the intrinsics of a camera directory, None if there are none."""
+    path = Path(camera_dir) / INTRINSICS_FILE
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def intrinsics_from_matrix(matrix, width, height):
+    matrix = np.asarray(matrix)
+    return dict(
+        fx=matrix[0, 0],
+        fy=matrix[1, 1],
+        cx=matrix[0, 2],
+        cy=matrix[1, 2],
+        width=width,
+        height=height,
+    )
+
+
+class PointCloudGenerator:
+    """Back-project depth images with a cached ray grid.
+
+    The per-pixel rays ``((u - cx) / fx, (v - cy) / fy, 1)`` are computed once,
+    so each frame costs one multiply per coordinate.
+
+    Args:
+        intrinsics (dict): fx, fy, cx, cy of the depth image
+        shape (tuple): (height, width) of the depth image
+    """
+
+    def __init__(self, intrinsics, shape):
+        height, width = shape[:2]
+        # Intrinsics are given at their own resolution; scale them to the
+        # depth image when it differs
+        sx = width / intrinsics.get("width", width)
+        sy = height / intrinsics.get("height", height)
+        self.rays_x = (
+            (np.arange(width, dtype=np.float32) - intrinsics["cx"] * sx)
+            / (intrinsics["fx"] * sx)
+        )[None, :]
+        self.rays_y = (
+            (np.arange(height, dtype=np.float32) - intrinsics["cy"] * sy)
+            / (intrinsics["fy"] * sy)
+        )[:, None]
+        self.shape = (height, width)
+
+    def points(self, depth, out=None):
+        """Back-project ``depth`` to an (H, W, 3) float32 point map.
+
+        Pixels without depth (0, NaN or inf) give NaN points.
+        """
+        if out is None:
+            out = np.empty((*self.shape, 3), dtype=np.float32)
+        depth = np.where(np.isfinite(depth) & (depth > 0), depth, np.nan)
+        np.multiply(depth, self.rays_x, out=out[..., 0])
+        np.multiply(depth, self.rays_y, out=out[..., 1])
+        out[..., 2] = depth
+        return out
+
+
+def estimate_normals(points):
+    """Unit normals of an (H, W, 3) point map from neighbouring points.
+
+    Normals are the cross product of the horizontal and vertical central
+    differences, oriented towards the camera. Pixels with a missing neighbour
+    give NaN.
+    """
+    du = np.full(points.shape, np.nan, dtype=np.float32)
+    dv = np.full(points.shape, np.nan, dtype=np.float32)
+    du[:, 1:-1] = points[:, 2:] - points[:, :-2]
+    dv[1:-1] = points[2:] - points[:-2]
+    normals = np.cross(dv, du)
+    norm = np.linalg.norm(normals, axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        normals /= norm
+    # Face the camera, which looks along +z
+    flip = np.sum(normals * points, axis=-1) > 0
+    normals[flip] *= -1
+    return normals
+
+
+class PointCloudReader:
+    """Point clouds and normals of a recorded camera, computed from its depth.
+
+    Needs the ``intrinsics.json`` and ``depth.json`` the recorders save. The
+    ray grid is built once per camera and the points and normals of the last
+    frames are cached, so asking for both decodes a frame once.
+
+    Args:
+        camera (utils.session_reader.CameraReader): Recorded camera
+        cache_size (int): Number of frames whose points are kept
+    """
+
+    def __init__(self, camera, cache_size=4):
+        self.camera = camera
+        self.intrinsics = read_intrinsics(camera.camera_dir)
+        if self.intrinsics is None:
+            raise KeyError(f"{camera.camera_dir} has no {INTRINSICS_FILE}")
+        depth_info = read_depth_info(camera.camera_dir)
+        units = depth_info["units"] if depth_info is not None else "m"
+        self.meters_per_unit = unit_scales[units]
+        self.generator = None
+        self._points = lru_cache(maxsize=cache_size)(self._compute_points)
+        self._normals = lru_cache(maxsize=cache_size)(self._compute_normals)
+
+    def _compute_points(self, i):
+        depth = load_depth(self.camera, i)
+        if self.meters_per_unit != 1:
+            depth = depth * np.float32(self.meters_per_unit)
+        if self.generator is None or self.generator.shape != depth.shape[:2]:
+            self.generator = PointCloudGenerator(self.intrinsics, depth.shape)
+        points = self.generator.points(depth)
+        points.flags.writeable = False
+        return points
+
+    def _compute_normals(self, i):
+        normals = estimate_normals(self._points(i))
+        normals.flags.writeable = False
+        return normals
+
+    def points(self, i):
+        """(H, W, 3) points of the i-th frame in meters, NaN without depth."""
+        return self._points(i)
+
+    def normals(self, i):
+        """(H, W, 3) unit normals of the i-th frame, NaN where undefined."""
+        return self._normals(i)
@@ -0,0 +1,263 @@
+"""Live preview of all cameras in one compositor process.
+
+Recorders publish downscaled thumbnails of their color and colorized depth into
+shared memory at a capped rate; the compositor tiles the latest thumbnail of
+every camera into one mosaic and shows it in a window, writes it to an MJPEG
+video or serves it as an MJPEG stream over HTTP on localhost. Each thumbnail is
+guarded by a sequence counter, so recorders never wait for the compositor: a
+tile caught mid-update keeps showing the previous thumbnail.
+
+Usage:
+    python main.py --zed --rs --vis all
+    python main.py --zed --vis zed --preview_output preview.avi
+    python main.py --rs --vis all --preview_port 8080  # http://localhost:8080
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import RawArray, RawValue
+import math
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils.colorize import colorize
+from utils.scheduler import CaptureScheduler
+
+# Streams shown as depth, in order of preference
+DEPTH_STREAMS = ["depth", "unaligned_depth", "raw_depth"]
+
+
+def to_bgr(image):
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
+
+
+def fit(image, out, interpolation=cv2.INTER_AREA):
+    """Resize ``image`` into ``out`` keeping its aspect ratio, black borders."""
+    height, width = out.shape[:2]
+    scale = min(height / image.shape[0], width / image.shape[1])
+    size = (
+        max(1, round(image.shape[1] * scale)),
+        max(1, round(image.shape[0] * scale)),
+    )
+    top, left = (height - size[1]) // 2, (width - size[0]) // 2
+    out[...] = 0
+    out[top : top + size[1], left : left + size[0]] = cv2.resize(
+        image, size, interpolation=interpolation
+    )
+
+
+class PreviewBoard:
+    """Shared thumbnails of every previewed camera.
+
+    Every camera has a tile of ``thumb_size`` color next to the same size of
+    colorized depth.
+
+    Args:
+        camera_names (list): Names of the previewed cameras
+        thumb_size (tuple): (height, width) of each thumbnail
+        fps (float): Maximum rate cameras publish thumbnails at
+    """
+
+    def __init__(self, camera_names, thumb_size=(180, 320), fps=10):
+        self.camera_names = list(camera_names)
+        self.thumb_size = tuple(thumb_size)
+        self.fps = fps
+        height, width = self.thumb_size
+        self.tile_shape = (height, 2 * width, 3)
+        self.stopped = RawValue("b", 0)
+        # Odd while a camera is writing its tile
+        self.sequences = [RawValue("Q", 0) for _ in self.camera_names]
+        self.buffers = [
+            RawArray("B", int(np.prod(self.tile_shape))) for _ in self.camera_names
+        ]
+        self._tiles = None
+
+    @property
+    def tiles(self):
+        if self._tiles is None:
+            self._tiles = [
+                np.frombuffer(buffer, dtype=np.uint8).reshape(self.tile_shape)
+                for buffer in self.buffers
+            ]
+        return self._tiles
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tiles"] = None
+        return state
+
+    def camera(self, index):
+        """Preview of the ``index``-th camera, passed to its recorder."""
+        return CameraPreview(self, index)
+
+    def read(self, index, out):
+        """Copy the tile of a camera into ``out``, False if it was being written."""
+        sequence = self.sequences[index].value
+        if sequence % 2:
+            return False
+        out[...] = self.tiles[index]
+        return self.sequences[index].value == sequence
+
+    def stop(self):
+        self.stopped.value = 1
+
+
+class CameraPreview:
+    """One camera's end of a PreviewBoard."""
+
+    def __init__(self, board, index):
+        self.board = board
+        self.index = index
+        self.period_ns = int(1e9 / board.fps)
+        self.next_ns = 0
+        self.thumbnail = np.zeros(board.tile_shape, dtype=np.uint8)
+
+    def update(self, streams):
+        """Publish a thumbnail of ``streams`` unless the last one is too recent."""
+        now = time.monotonic_ns()
+        if now < self.next_ns:
+            return
+        self.next_ns = now + self.period_ns
+
+        width = self.board.thumb_size[1]
+        color, depth = self.thumbnail[:, :width], self.thumbnail[:, width:]
+        if "color" in streams:
+            fit(to_bgr(streams["color"]), color)
+        depth_stream = next((s for s in DEPTH_STREAMS if s in streams), None)
+        if depth_stream is not None:
+            # Depth must not be averaged across edges, downscale before colorizing
+            small = np.zeros(depth.shape[:2], dtype=streams[depth_stream].dtype)
+            fit(streams[depth_stream], small, cv2.INTER_NEAREST)
+            depth[...] = colorize(small, cmap="jet", invalid=(0, 0, 0))
+
+        sequence = self.board.sequences[self.index]
+        sequence.value += 1
+        self.board.tiles[self.index][...] = self.thumbnail
+        sequence.value += 1
+
+
+class MJPEGServer:
+    """Serves the latest mosaic as a multipart MJPEG stream on localhost."""
+
+    def __init__(self, port):
+        self.jpeg = None
+        self.condition = threading.Condition()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "multipart/x-mixed-replace; boundary=frame"
+                )
+                self.end_headers()
+                try:
+                    while True:
+                        jpeg = server.next_jpeg()
+                        self.wfile.write(
+                            b"--frame\r\nContent-Type: image/jpeg\r\n"
+                            + f"Content-Length: {len(jpeg)}\r\n\r\n".encode()
+                            + jpeg
+                            + b"\r\n"
+                        )
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def next_jpeg(self):
+        with self.condition:
+            self.condition.wait()
+            return self.jpeg
+
+    def publish(self, jpeg):
+        with self.condition:
+            self.jpeg = jpeg
+            self.condition.notify_all()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def run_compositor(board, output_file=None, port=None):
+    """Tile the thumbnails of ``board`` until it is stopped.
+
+    Shows a window unless ``output_file`` or ``port`` is given.
+
+    Args:
+        board (PreviewBoard): Thumbnails shared with the recorders
+        output_file (str): MJPEG video (.avi) to write the mosaic to
+        port (int): Serve the mosaic as an MJPEG stream on localhost
+    """
+    names = board.camera_names
+    tile_height, tile_width, _ = board.tile_shape
+    columns = math.ceil(math.sqrt(len(names)))
+    rows = math.ceil(len(names) / columns)
+    mosaic = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+    tiles = [
+        mosaic[
+            i // columns * tile_height : (i // columns + 1) * tile_height,
+            i % columns * tile_width : (i % columns + 1) * tile_width,
+        ]
+        for i in range(len(names))
+    ]
+    tile = np.zeros(board.tile_shape, dtype=np.uint8)
+
+    writer = None
+    if output_file is not None:
+        writer = cv2.VideoWriter(
+            str(output_file),
+            cv2.VideoWriter_fourcc(*"MJPG"),
+            board.fps,
+            (mosaic.shape[1], mosaic.shape[0]),
+        )
+    server = MJPEGServer(port) if port is not None else None
+    window = writer is None and server is None
+    if server is not None:
+        print(f"Preview: streaming at http://localhost:{port}")
+
+    scheduler = CaptureScheduler(board.fps)
+    try:
+        while not board.stopped.value:
+            scheduler.wait()
+            for i, name in enumerate(names):
+                if board.read(i, tile):
+                    tiles[i][...] = tile
+                    cv2.putText(
+                        tiles[i],
+                        name,
+                        (8, 20),
+                        cv2.FONT_HERSHEY_SIMPLEX,
+                        0.6,
+                        (255, 255, 255),
+                        1,
+                        cv2.LINE_AA,
+                    )
+            if window:
+                cv2.imshow("Preview", mosaic)
+                cv2.waitKey(1)
+            if writer is not None:
+                writer.write(mosaic)
+            if server is not None:
+                server.publish(cv2.imencode(".jpg", mosaic)[1].tobytes())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if writer is not None:
+            writer.release()
+        if server is not None:
+            server.close()
+        if window:
+            cv2.destroyAllWindows()
@@ -10,10 +10,6 @@ def read_depth_image(filepath):
     if depth_img is None:
         raise ValueError(f"Failed to load depth image from {filepath}")
 
-    import ipdb
-
-    ipdb.set_trace()
-
     # If the image is 16-bit, convert to float for better visualization
     if depth_img.dtype == np.uint16:
         # Convert to float and scale to meters (assuming depth is in millimeters)
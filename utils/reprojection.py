@@ -0,0 +1,270 @@
+import sys
+
+import cv2
+import numpy as np
+
+# Empty z-buffer entry: infinite z and the bits of depth 0
+EMPTY = np.uint64(0x7F800000 << 32)
+# Index of the low uint32 of every uint64
+LOW_WORD = 0 if sys.byteorder == "little" else 1
+# Rational distortion models need more than the default 5 iterations
+UNDISTORT_CRITERIA = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 50, 1e-10)
+
+
+def distortion_coefficients(distortion):
+    """OpenCV distortion coefficients as (k1, k2, p1, p2, k3, k4, k5, k6).
+
+    Args:
+        distortion (list): 4, 5, 8, 12 or 14 coefficients in OpenCV order
+
+    Returns:
+        np.ndarray: 8 coefficients, None when there is no distortion
+    """
+    if distortion is None:
+        return None
+    coefficients = np.asarray(distortion, dtype=np.float64).reshape(-1)
+    if len(coefficients) not in (4, 5, 8, 12, 14):
+        raise ValueError(f"Expected 4, 5, 8, 12 or 14 coefficients, got {distortion}")
+    if coefficients[8:].any():
+        raise ValueError("Thin prism and tilted sensor distortion are not supported")
+    if not coefficients.any():
+        return None
+    return np.pad(coefficients[:8], (0, 8 - len(coefficients[:8])))
+
+
+def distort(x, y, coefficients):
+    """Apply OpenCV's radial-tangential lens distortion.
+
+    Args:
+        x (np.ndarray): Undistorted normalized x (x / z)
+        y (np.ndarray): Undistorted normalized y (y / z)
+        coefficients (np.ndarray): ``distortion_coefficients``
+
+    Returns:
+        tuple: Distorted normalized x and y
+    """
+    k1, k2, p1, p2, k3, k4, k5, k6 = coefficients
+    xy = x * y
+    x2 = x * x
+    y2 = y * y
+    r2 = x2 + y2
+    radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+    radial /= 1 + r2 * (k4 + r2 * (k5 + r2 * k6))
+    x_distorted = x * radial + 2 * p1 * xy + p2 * (r2 + 2 * x2)
+    y_distorted = y * radial + p1 * (r2 + 2 * y2) + 2 * p2 * xy
+    return x_distorted, y_distorted
+
+
+def monotonic_radius2(coefficients, max_radius=10.0):
+    """Squared normalized radius up to which radial distortion keeps growing.
+
+    Beyond it the model folds points back towards the image center, so they
+    would land on pixels they do not belong to.
+    """
+    k1, k2, _, _, k3, k4, k5, k6 = coefficients
+    r = np.linspace(0, max_radius, 100001)
+    r2 = r * r
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distorted = r * (1 + r2 * (k1 + r2 * (k2 + r2 * k3)))
+        distorted /= 1 + r2 * (k4 + r2 * (k5 + r2 * k6))
+    falling = np.flatnonzero(~(np.diff(distorted) > 0))
+    limit = r[falling[0]] if len(falling) else max_radius
+    return float(limit * limit)
+
+
+class DepthReprojector:
+    """Vectorized depth-to-image registration with a cached ray grid.
+
+    Maps a depth image from one camera into the pixel grid of another camera
+    given both intrinsic matrices and the depth-to-target extrinsics. The
+    per-pixel rays are rotated and projected once at construction, so each
+    frame costs one multiply-add per point plus a z-buffer pass. Only points
+    in front of the target camera are kept, and when several depth points land
+    on the same target pixel the one nearest to the target camera wins. The
+    z-buffer is reused between frames, so share a reprojector between threads
+    only with a lock.
+
+    Lens distortion follows OpenCV's model: the depth rays are undistorted
+    once, and target coordinates are distorted per frame, which costs about
+    twice the pinhole projection. Points are only projected within the
+    radius where the target distortion is monotonic.
+
+    Args:
+        depth_matrix (np.ndarray): 3x3 intrinsic matrix of the depth camera
+        target_matrix (np.ndarray): 3x3 intrinsic matrix of the target camera
+        rotation (np.ndarray): 3x3 depth-to-target rotation
+        translation (np.ndarray): Depth-to-target translation, same unit as depth
+        depth_shape (tuple): (height, width) of the depth image
+        target_shape (tuple): (height, width) of the target image
+        depth_distortion (list): OpenCV distortion coefficients of the depth
+            camera, None for none
+        target_distortion (list): OpenCV distortion coefficients of the
+            target camera, None for none
+    """
+
+    def __init__(
+        self,
+        depth_matrix,
+        target_matrix,
+        rotation,
+        translation,
+        depth_shape,
+        target_shape,
+        depth_distortion=None,
+        target_distortion=None,
+    ):
+        depth_matrix = np.asarray(depth_matrix, dtype=np.float64)
+        target_matrix = np.asarray(target_matrix, dtype=np.float64)
+        rotation = np.asarray(rotation, dtype=np.float64).reshape(3, 3)
+        translation = np.asarray(translation, dtype=np.float64).reshape(3)
+
+        self.target_matrix = target_matrix
+        self.depth_shape = tuple(depth_shape[:2])
+        self.target_shape = tuple(target_shape[:2])
+
+        height, width = self.depth_shape
+        ys, xs = np.mgrid[0:height, 0:width]
+        depth_distortion = distortion_coefficients(depth_distortion)
+        if depth_distortion is None:
+            rays = np.stack(
+                [
+                    (xs.ravel() - depth_matrix[0, 2]) / depth_matrix[0, 0],
+                    (ys.ravel() - depth_matrix[1, 2]) / depth_matrix[1, 1],
+                    np.ones(height * width),
+                ]
+            )
+        else:
+            pixels = np.stack([xs.ravel(), ys.ravel()], axis=-1).astype(np.float64)
+            normalized = cv2.undistortPoints(
+                pixels.reshape(-1, 1, 2),
+                depth_matrix,
+                depth_distortion,
+                criteria=UNDISTORT_CRITERIA,
+            ).reshape(-1, 2)
+            rays = np.vstack([normalized.T, np.ones(height * width)])
+
+        self.target_distortion = distortion_coefficients(target_distortion)
+        if self.target_distortion is None:
+            # target pixel (homogeneous) = depth * ray_projection + offset
+            self.ray_projection = (target_matrix @ rotation @ rays).astype(np.float32)
+            self.offset = (target_matrix @ translation).astype(np.float32)
+        else:
+            # target camera point = depth * ray_projection + offset, distorted
+            # before the intrinsics are applied
+            self.ray_projection = (rotation @ rays).astype(np.float32)
+            self.offset = translation.astype(np.float32)
+            self.max_radius2 = monotonic_radius2(self.target_distortion)
+        self._zbuffer = None
+
+    def _project(self, depth):
+        """Target pixel of every depth pixel.
+
+        Returns:
+            tuple: Flat depth values, target depth ``z`` and target pixel
+                coordinates ``u``, ``v``, plus the mask of points that land
+                in front of the target camera and inside its image
+        """
+        if depth.shape[:2] != self.depth_shape:
+            raise ValueError(
+                f"Expected depth of shape {self.depth_shape}, got {depth.shape}"
+            )
+        target_height, target_width = self.target_shape
+
+        values = depth.reshape(-1)
+        d = values.astype(np.float32, copy=False)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = d * self.ray_projection[2]
+            z += self.offset[2]
+            u = d * self.ray_projection[0]
+            u += self.offset[0]
+            u /= z
+            v = d * self.ray_projection[1]
+            v += self.offset[1]
+            v /= z
+            if self.target_distortion is not None:
+                inside = u * u + v * v <= self.max_radius2
+                x, y = distort(u, v, self.target_distortion.astype(np.float32))
+                matrix = self.target_matrix.astype(np.float32)
+                u = matrix[0, 0] * x + matrix[0, 1] * y + matrix[0, 2]
+                v = matrix[1, 1] * y + matrix[1, 2]
+
+        # Coordinates are truncated towards zero like int(), so (-1, 0) maps to 0
+        keep = (d > 0) & (z > 0)
+        keep &= (u > -1) & (u < target_width) & (v > -1) & (v < target_height)
+        if self.target_distortion is not None:
+            keep &= inside
+        return values, z, u, v, keep
+
+    def __call__(self, depth, out=None):
+        """Register ``depth`` to the target image grid.
+
+        Args:
+            depth (np.ndarray): Depth image of shape ``depth_shape``, of up to
+                32 bits per value, e.g. uint16 or float32
+            out (np.ndarray): Optional contiguous output buffer of shape
+                ``target_shape`` and the dtype of ``depth``
+
+        Returns:
+            np.ndarray: Depth values at the target pixels, 0 where nothing maps
+        """
+        if depth.dtype.itemsize > 4:
+            raise ValueError(f"Expected depth of up to 32 bits, got {depth.dtype}")
+        target_height, target_width = self.target_shape
+        values, z, u, v, keep = self._project(depth)
+        if out is None:
+            out = np.empty(self.target_shape, dtype=depth.dtype)
+
+        source = np.flatnonzero(keep)
+        pixel = v.take(source).astype(np.int32)
+        pixel *= target_width
+        pixel += u.take(source).astype(np.int32)
+
+        # z-buffer: the bits of a positive float32 sort like its value, so
+        # packing (z, depth value bits) into one uint64 lets a single minimum
+        # pass leave the value of the nearest point at every target pixel
+        value_bits = np.dtype(f"u{values.dtype.itemsize}")
+        key = z.take(source).view(np.uint32).astype(np.uint64)
+        key <<= 32
+        key |= values.take(source).view(value_bits)
+        if self._zbuffer is None:
+            self._zbuffer = np.empty(target_height * target_width, dtype=np.uint64)
+        self._zbuffer.fill(EMPTY)
+        np.minimum.at(self._zbuffer, pixel, key)
+
+        # Empty pixels keep the bits of depth 0
+        nearest = self._zbuffer.view(np.uint32)[LOW_WORD::2]
+        out.reshape(-1).view(value_bits)[:] = nearest
+        return out
+
+    def sample(self, depth, image, out=None):
+        """Register a target image to the depth image grid.
+
+        The inverse direction of ``__call__``: every depth pixel takes the
+        value of the target pixel its point projects to.
+
+        Args:
+            depth (np.ndarray): Depth image of shape ``depth_shape``
+            image (np.ndarray): Image of shape ``target_shape`` (+ channels)
+            out (np.ndarray): Optional output buffer of shape ``depth_shape``
+                (+ channels)
+
+        Returns:
+            np.ndarray: Image values at the depth pixels, 0 where nothing maps
+        """
+        if image.shape[:2] != self.target_shape:
+            raise ValueError(
+                f"Expected image of shape {self.target_shape}, got {image.shape}"
+            )
+        _, _, u, v, keep = self._project(depth)
+        if out is None:
+            out = np.zeros(self.depth_shape + image.shape[2:], dtype=image.dtype)
+        else:
+            out.fill(0)
+
+        source = np.flatnonzero(keep)
+        pixel = v[source].astype(np.int64)
+        pixel *= self.target_shape[1]
+        pixel += u[source].astype(np.int64)
+        flat_shape = (-1,) + image.shape[2:]
+        out.reshape(flat_shape)[source] = image.reshape(flat_shape)[pixel]
+        return out
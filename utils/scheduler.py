@@ -0,0 +1,139 @@
+"""Capture scheduling on a fixed tick grid.
+
+Ticks are at ``origin + k / rate`` on ``time.monotonic()``, so the schedule
+does not drift however long each frame takes. A recorder that falls more than
+one period behind skips to the latest due tick instead of trying to catch up.
+``time.monotonic()`` is shared by all processes of the host, so recorders
+given the same ``origin`` capture on the same tick boundaries.
+
+Timing statistics are kept in constant memory, so a scheduler can run for
+days: percentiles are over the most recent ``window`` samples, counts, maxima
+and the interval jitter over the whole run.
+"""
+
+from collections import deque
+import math
+import time
+
+import numpy as np
+
+
+class SampleWindow:
+    """Count and maximum of all samples, percentiles of the latest ``window``."""
+
+    def __init__(self, window=10000):
+        self.recent = deque(maxlen=window)
+        self.count = 0
+        self.max = None
+
+    def add(self, value):
+        self.recent.append(value)
+        self.count += 1
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def __len__(self):
+        return self.count
+
+    def percentiles(self, q):
+        return np.percentile(np.fromiter(self.recent, float, len(self.recent)), q)
+
+
+class CaptureScheduler:
+    """Wait for the ticks of a ``rate`` Hz grid.
+
+    Args:
+        rate (float): Ticks per second
+        origin (float): ``time.monotonic()`` of tick 0, default now
+        window (int): Latest ticks the lateness percentiles are taken over
+    """
+
+    def __init__(self, rate, origin=None, window=10000):
+        self.rate = rate
+        self.period = 1 / rate
+        self.origin = time.monotonic() if origin is None else origin
+        self.next_tick = None
+        self.missed = 0
+        self.ticks = 0
+        self.first_wake = None
+        self.last_wake = None
+        self.lateness = SampleWindow(window)
+        # Running mean and sum of squared deviations of the tick intervals
+        self._interval_mean = 0.0
+        self._interval_m2 = 0.0
+
+    def deadline(self, tick):
+        return self.origin + tick * self.period
+
+    def wait(self):
+        """Sleep until the next tick and return its index."""
+        now = time.monotonic()
+        if self.next_tick is None:
+            # Start on the next boundary of the grid
+            self.next_tick = max(0, math.ceil((now - self.origin) * self.rate))
+        tick = self.next_tick
+        if now - self.deadline(tick) >= self.period:
+            # More than a period late, serve the latest due tick
+            tick = math.floor((now - self.origin) * self.rate)
+            self.missed += tick - self.next_tick
+
+        deadline = self.deadline(tick)
+        if deadline > now:
+            time.sleep(deadline - now)
+        woke = time.monotonic()
+        self._add_wake(woke)
+        self.lateness.add(woke - deadline)
+        self.next_tick = tick + 1
+        return tick
+
+    def _add_wake(self, woke):
+        self.ticks += 1
+        if self.first_wake is None:
+            self.first_wake = woke
+        else:
+            # Welford's update of the interval mean and variance
+            interval = woke - self.last_wake
+            delta = interval - self._interval_mean
+            self._interval_mean += delta / (self.ticks - 1)
+            self._interval_m2 += delta * (interval - self._interval_mean)
+        self.last_wake = woke
+
+    @property
+    def achieved_rate(self):
+        if self.ticks < 2 or self.last_wake == self.first_wake:
+            return 0.0
+        return (self.ticks - 1) / (self.last_wake - self.first_wake)
+
+    def stats(self):
+        """Achieved rate, missed ticks and timing jitter in milliseconds.
+
+        ``lateness_ms`` is how long after its deadline each tick was served,
+        ``interval_std_ms`` the standard deviation of the time between ticks.
+        """
+        stats = dict(
+            target_rate=self.rate,
+            achieved_rate=round(self.achieved_rate, 3),
+            ticks=self.ticks,
+            missed=self.missed,
+        )
+        if len(self.lateness):
+            p50, p99 = self.lateness.percentiles([50, 99]) * 1e3
+            stats["lateness_ms"] = dict(
+                p50=round(p50, 3),
+                p99=round(p99, 3),
+                max=round(self.lateness.max * 1e3, 3),
+            )
+        if self.ticks > 1:
+            std = math.sqrt(self._interval_m2 / (self.ticks - 1))
+            stats["interval_std_ms"] = round(std * 1e3, 3)
+        return stats
+
+    def summary(self):
+        stats = self.stats()
+        summary = f"{stats['achieved_rate']:.2f}/{self.rate:g} fps, {stats['missed']} ticks missed"
+        if "lateness_ms" in stats:
+            lateness = stats["lateness_ms"]
+            summary += f", lateness p50 {lateness['p50']:.2f} ms p99 {lateness['p99']:.2f} ms max {lateness['max']:.2f} ms"
+        if "interval_std_ms" in stats:
+            summary += f", interval jitter {stats['interval_std_ms']:.2f} ms"
+        return summary
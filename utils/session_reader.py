@@ -0,0 +1,164 @@
+from collections import defaultdict
+from pathlib import Path
+import os
+
+import cv2
+import numpy as np
+
+from utils.container import (
+    ContainerStream,
+    SUFFIX as CONTAINER_SUFFIX,
+    loose_file_pattern,
+)
+
+
+class StreamReader:
+    """Lazy, indexable access to one stream of one camera.
+
+    ``reader[i]`` loads the i-th frame in frame-number order, ``reader[a:b]``
+    returns another lazy reader over that range and ``reader.get(n)`` looks a
+    frame up by its frame number. ``.npy`` frames are memory-mapped.
+    """
+
+    def __init__(self, frame_numbers, paths=None, container=None):
+        self.frame_numbers = frame_numbers
+        self.paths = paths
+        self.container = container
+
+    @classmethod
+    def from_files(cls, files):
+        files = sorted(files)
+        frame_numbers = np.array([frame for frame, _ in files], dtype=np.int64)
+        return cls(frame_numbers, paths=[path for _, path in files])
+
+    @classmethod
+    def from_container(cls, container):
+        return cls(container.frame_numbers, container=container)
+
+    def __len__(self):
+        return len(self.frame_numbers)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return StreamReader(
+                self.frame_numbers[i],
+                paths=self.paths[i] if self.paths is not None else None,
+                container=self.container,
+            )
+        if self.container is not None:
+            return self.container[self.frame_numbers[i]]
+        return self._load(self.paths[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def index(self, frame_number):
+        """Position of ``frame_number`` in this stream, or -1 if missing."""
+        i = np.searchsorted(self.frame_numbers, frame_number)
+        if i < len(self.frame_numbers) and self.frame_numbers[i] == frame_number:
+            return int(i)
+        return -1
+
+    def get(self, frame_number):
+        i = self.index(frame_number)
+        if i < 0:
+            raise KeyError(f"Frame {frame_number} not found")
+        return self[i]
+
+    def path(self, i):
+        return self.paths[i] if self.paths is not None else None
+
+    @staticmethod
+    def _load(path):
+        if path.endswith(".npy"):
+            return np.load(path, mmap_mode="r")
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f"Failed to load image from {path}")
+        return image
+
+
+class CameraReader:
+    """All streams of one camera directory, indexed with a single scan."""
+
+    def __init__(self, camera_dir):
+        self.camera_dir = Path(camera_dir)
+        self.name = self.camera_dir.name
+
+        files = defaultdict(list)
+        container_streams = set()
+        with os.scandir(self.camera_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(CONTAINER_SUFFIX):
+                    container_streams.add(entry.name.split(".")[0])
+                    continue
+                match = loose_file_pattern.match(entry.name)
+                if match:
+                    files[match["stream"]].append((int(match["frame"]), entry.path))
+
+        self.streams = {
+            stream: StreamReader.from_files(stream_files)
+            for stream, stream_files in files.items()
+        }
+        for stream in container_streams:
+            self.streams[stream] = StreamReader.from_container(
+                ContainerStream(self.camera_dir, stream)
+            )
+
+    def __getitem__(self, stream):
+        return self.streams[stream]
+
+    def __contains__(self, stream):
+        return stream in self.streams
+
+    def keys(self):
+        return self.streams.keys()
+
+
+def session_cameras(session_dir):
+    """Camera directories of a session, in name order.
+
+    Only ``camera_*`` directories are cameras, a session also holds e.g.
+    ``trace`` and ``videos``.
+    """
+    return [
+        entry.path
+        for entry in sorted(os.scandir(session_dir), key=lambda e: e.name)
+        if entry.is_dir() and entry.name.startswith("camera_")
+    ]
+
+
+class SessionReader:
+    """Random access to a recorded session ``recorded_data/<timestamp>``.
+
+    Camera directories are indexed once, when first accessed, so frames can
+    then be read in O(1) with ``reader[camera][stream][i]``. Cameras can be
+    addressed by directory name (``camera_d455``) or without the ``camera_``
+    prefix (``d455``).
+    """
+
+    def __init__(self, session_dir):
+        self.session_dir = Path(session_dir)
+        self.camera_dirs = {
+            os.path.basename(camera_dir): camera_dir
+            for camera_dir in session_cameras(self.session_dir)
+        }
+        self._cameras = {}
+
+    @property
+    def cameras(self):
+        return list(self.camera_dirs)
+
+    def __getitem__(self, camera):
+        if camera not in self.camera_dirs:
+            camera = f"camera_{camera}"
+        if camera not in self._cameras:
+            self._cameras[camera] = CameraReader(self.camera_dirs[camera])
+        return self._cameras[camera]
+
+    def __iter__(self):
+        return iter(self.camera_dirs)
+
+    def __len__(self):
+        return len(self.camera_dirs)
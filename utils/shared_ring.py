@@ -0,0 +1,109 @@
+from multiprocessing import Queue
+import queue
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+SLOT_ALIGNMENT = 64
+
+
+class SharedFrameRing:
+    """Fixed-slot ring buffer in shared memory for passing frames to writers.
+
+    Every slot holds one array per stream, laid out back to back. The capture
+    loop copies each stream into a free slot once, writer processes read the
+    slot in place and release it afterwards. ``acquire`` blocks while all
+    slots are in use, ``try_acquire`` returns None instead.
+
+    Args:
+        streams (dict): Stream name -> (shape, dtype), the names being the
+            writer target's keyword arguments
+        num_slots (int): Number of frames that can be in flight
+    """
+
+    def __init__(self, streams, num_slots=8):
+        self.streams = {
+            name: (tuple(shape), np.dtype(dtype))
+            for name, (shape, dtype) in streams.items()
+        }
+        self.num_slots = num_slots
+
+        self.offsets = {}
+        slot_size = 0
+        for name, (shape, dtype) in self.streams.items():
+            self.offsets[name] = slot_size
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            slot_size += -(-nbytes // SLOT_ALIGNMENT) * SLOT_ALIGNMENT
+        self.slot_size = slot_size
+
+        self.shm = SharedMemory(create=True, size=slot_size * num_slots)
+        self.owner = True
+        self.free_slots = Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+        self._views = {}
+
+    @classmethod
+    def from_arrays(cls, arrays, num_slots=8):
+        return cls(
+            {name: (array.shape, array.dtype) for name, array in arrays.items()},
+            num_slots=num_slots,
+        )
+
+    def __getstate__(self):
+        return {
+            "streams": self.streams,
+            "num_slots": self.num_slots,
+            "offsets": self.offsets,
+            "slot_size": self.slot_size,
+            "name": self.shm.name,
+            "free_slots": self.free_slots,
+        }
+
+    def __setstate__(self, state):
+        name = state.pop("name")
+        self.__dict__.update(state)
+        self.shm = SharedMemory(name=name)
+        self.owner = False
+        self._views = {}
+
+    def views(self, slot):
+        """Arrays of one slot, backed directly by the shared memory."""
+        if slot not in self._views:
+            base = slot * self.slot_size
+            self._views[slot] = {
+                name: np.ndarray(
+                    shape,
+                    dtype=dtype,
+                    buffer=self.shm.buf,
+                    offset=base + self.offsets[name],
+                )
+                for name, (shape, dtype) in self.streams.items()
+            }
+        return self._views[slot]
+
+    def acquire(self):
+        return self.free_slots.get()
+
+    def try_acquire(self):
+        """Free slot, or None if all slots are in use."""
+        try:
+            return self.free_slots.get_nowait()
+        except queue.Empty:
+            return None
+
+    def release(self, slot):
+        self.free_slots.put(slot)
+
+    def put(self, **arrays):
+        """Copy one frame into a free slot and return the slot index."""
+        slot = self.acquire()
+        views = self.views(slot)
+        for name, array in arrays.items():
+            np.copyto(views[name], array)
+        return slot
+
+    def close(self):
+        self._views = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,129 @@
+import numpy as np
+
+from utils.manifest import MANIFEST_FILE, read_manifest
+
+
+def match_frames(timestamps, tolerance, reference=None):
+    """Match frames across cameras by nearest timestamp.
+
+    Every frame of the reference camera defines one row; for each other camera
+    the frame nearest in time is found with a sorted search and accepted if it
+    is within ``tolerance``. A frame is used at most once, by the row it is
+    closest to. Runs in O(N log N) per camera.
+
+    Args:
+        timestamps (list): One sorted 1-D array of timestamps per camera
+        tolerance (int or float): Maximum timestamp difference of a match
+        reference (int): Camera defining the rows, default the one with the
+            fewest frames
+
+    Returns:
+        tuple: (matches, unmatched) where matches is an (N, cameras) array of
+            frame indices, -1 where a camera has no frame for the row, and
+            unmatched lists the indices of the frames of each camera that
+            are not part of any row
+    """
+    timestamps = [np.asarray(ts) for ts in timestamps]
+    if reference is None:
+        reference = int(np.argmin([len(ts) for ts in timestamps]))
+    ref = timestamps[reference]
+
+    matches = np.full((len(ref), len(timestamps)), -1, dtype=np.int64)
+    unmatched = []
+    for camera, ts in enumerate(timestamps):
+        if camera == reference:
+            matches[:, camera] = np.arange(len(ref))
+            unmatched.append(np.zeros(0, dtype=np.int64))
+            continue
+        if len(ts) == 0 or len(ref) == 0:
+            unmatched.append(np.arange(len(ts)))
+            continue
+
+        right = np.searchsorted(ts, ref)
+        left = np.maximum(right - 1, 0)
+        right = np.minimum(right, len(ts) - 1)
+        nearest = np.where(
+            np.abs(ts[left] - ref) <= np.abs(ts[right] - ref), left, right
+        )
+        diff = np.abs(ts[nearest] - ref)
+        rows = np.flatnonzero(diff <= tolerance)
+
+        # Keep only the closest row for frames claimed by several rows
+        order = rows[np.lexsort((diff[rows], nearest[rows]))]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = nearest[order][1:] != nearest[order][:-1]
+        rows = order[first]
+
+        matches[rows, camera] = nearest[rows]
+        used = np.zeros(len(ts), dtype=bool)
+        used[nearest[rows]] = True
+        unmatched.append(np.flatnonzero(~used))
+    return matches, unmatched
+
+
+def playback_rows(camera_dirs, streams, tolerance_ms=100):
+    """Rows of stream positions to show together, one column per camera.
+
+    Uses the capture manifests to match frames by host timestamp. Frames
+    without a match within ``tolerance_ms`` get a row of their own, so every
+    frame is shown and gaps of a camera show up as rows without its frame.
+    Falls back to pairing frames by position when a camera has no manifest.
+
+    Args:
+        camera_dirs (list): Camera directories
+        streams (list): utils.session_reader.StreamReader of each camera
+        tolerance_ms (float): Maximum capture time difference within a row
+
+    Returns:
+        np.ndarray: (N, cameras) positions into ``streams``, -1 if missing,
+            in capture time order
+    """
+    num_frames = max(len(stream) for stream in streams)
+    if not all((camera_dir / MANIFEST_FILE).exists() for camera_dir in camera_dirs):
+        print("No capture manifest for every camera, pairing frames by position")
+        positions = np.arange(num_frames)
+        return np.stack(
+            [np.where(positions < len(s), positions, -1) for s in streams], axis=1
+        )
+
+    timestamps, positions = [], []
+    for camera_dir, stream in zip(camera_dirs, streams):
+        records = read_manifest(camera_dir)
+        i = np.searchsorted(records["frame"], stream.frame_numbers)
+        i = np.minimum(i, max(len(records) - 1, 0))
+        found = (
+            records["frame"][i] == stream.frame_numbers
+            if len(records)
+            else np.zeros(len(stream), dtype=bool)
+        )
+        if not found.all():
+            print(
+                f"{camera_dir.name}: {len(found) - found.sum()} frames missing from the capture manifest, not shown"
+            )
+        timestamps.append(records["host_ns"][i[found]])
+        positions.append(np.flatnonzero(found))
+
+    reference = int(np.argmin([len(ts) for ts in timestamps]))
+    matches, unmatched = match_frames(timestamps, tolerance_ms * 1e6, reference)
+    row_ns = [timestamps[reference][matches[:, reference]]]
+    for camera, frames in enumerate(unmatched):
+        if not len(frames):
+            continue
+        print(
+            f"{camera_dirs[camera].name}: {len(frames)} frames without a match within {tolerance_ms:g} ms, shown in rows of their own"
+        )
+        alone = np.full((len(frames), len(timestamps)), -1, dtype=np.int64)
+        alone[:, camera] = frames
+        matches = np.concatenate([matches, alone])
+        row_ns.append(timestamps[camera][frames])
+    matches = matches[np.argsort(np.concatenate(row_ns), kind="stable")]
+
+    rows = np.full(matches.shape, -1, dtype=np.int64)
+    for camera, camera_positions in enumerate(positions):
+        matched = matches[:, camera] >= 0
+        rows[matched, camera] = camera_positions[matches[matched, camera]]
+        if len(camera_dirs) > 1 and not matched.all():
+            print(
+                f"{camera_dirs[camera].name}: no frame in {len(matched) - matched.sum()} of {len(matched)} rows"
+            )
+    return rows
@@ -0,0 +1,140 @@
+"""Opt-in stage tracing of the capture and write paths.
+
+Each process traces into its own ring buffer. Instrumented code marks the end
+of every stage with
+
+    if tracing.tracer:
+        tracing.tracer.lap("align")
+
+which records a span from the previous lap of the same thread to now, so a
+loop instrumented at every stage boundary is covered without gaps. With
+tracing disabled ``tracer`` is None and a lap costs one branch.
+
+On ``stop`` every process saves its spans as ``trace.<pid>.json`` in the trace
+directory; ``merge_traces`` combines them into one Chrome trace, to open in
+``chrome://tracing`` or https://ui.perfetto.dev. Timestamps are
+``time.monotonic_ns()``, shared by all processes of the host.
+
+Usage:
+    python main.py --rs --zed --trace  # recorded_data/<timestamp>/trace.json
+"""
+
+from pathlib import Path
+import itertools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+TRACE_FILE = "trace.json"
+
+# Tracer of this process, None while tracing is disabled
+tracer = None
+
+
+class Tracer:
+    """Ring buffer of the spans of one process.
+
+    Args:
+        trace_dir (Path): Directory the spans are saved to on ``stop``
+        process_name (str): Name of the process in the trace
+        capacity (int): Spans kept, the oldest are overwritten
+    """
+
+    def __init__(self, trace_dir, process_name, capacity=1 << 16):
+        self.trace_dir = Path(trace_dir)
+        self.process_name = process_name
+        self.capacity = capacity
+        # (name, thread, start_ns, end_ns) of every span
+        self.spans = np.zeros((capacity, 4), dtype=np.int64)
+        self.names = {}
+        self.threads = {}
+        self.index = itertools.count()
+        self.start_ns = time.monotonic_ns()
+        self.last_ns = {}
+
+    def lap(self, name):
+        """Record the stage ending now, ``name``, in the calling thread."""
+        now_ns = time.monotonic_ns()
+        thread = threading.get_ident()
+        start_ns = self.last_ns.get(thread, self.start_ns)
+        self.last_ns[thread] = now_ns
+        name_id = self.names.setdefault(name, len(self.names))
+        thread_id = self.threads.setdefault(thread, len(self.threads))
+        # next() on a count is atomic, threads never share a row
+        self.spans[next(self.index) % self.capacity] = (
+            name_id,
+            thread_id,
+            start_ns,
+            now_ns,
+        )
+
+    def reset(self):
+        """Start the next span of the calling thread now, e.g. after idling."""
+        self.last_ns[threading.get_ident()] = time.monotonic_ns()
+
+    def events(self):
+        """Spans as Chrome trace events."""
+        count = next(self.index)
+        if count > self.capacity:
+            order = np.roll(np.arange(self.capacity), -(count % self.capacity))
+            spans = self.spans[order]
+        else:
+            spans = self.spans[:count]
+        names = {name_id: name for name, name_id in self.names.items()}
+        pid = os.getpid()
+        events = [
+            dict(
+                name="process_name", ph="M", pid=pid, args=dict(name=self.process_name)
+            )
+        ]
+        for name_id, thread_id, start_ns, end_ns in spans.tolist():
+            events.append(
+                dict(
+                    name=names[name_id],
+                    ph="X",
+                    pid=pid,
+                    tid=thread_id,
+                    ts=start_ns / 1000,
+                    dur=(end_ns - start_ns) / 1000,
+                )
+            )
+        return events
+
+    def save(self):
+        self.trace_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.trace_dir / f"trace.{os.getpid()}.json", "w") as f:
+            json.dump(self.events(), f)
+
+
+def start(trace_dir, process_name, capacity=1 << 16):
+    """Enable tracing in this process, replacing an inherited tracer."""
+    global tracer
+    tracer = Tracer(trace_dir, process_name, capacity)
+
+
+def stop():
+    """Save the spans of this process and disable tracing."""
+    global tracer
+    if tracer is not None:
+        tracer.save()
+        tracer = None
+
+
+def merge_traces(trace_dir, output_file):
+    """Combine the per-process span files of ``trace_dir`` into one trace."""
+    trace_dir = Path(trace_dir)
+    events = []
+    parts = sorted(trace_dir.glob("trace.*.json"))
+    for part in parts:
+        with open(part) as f:
+            events.extend(json.load(f))
+    with open(output_file, "w") as f:
+        json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f)
+    for part in parts:
+        part.unlink()
+    if not any(trace_dir.iterdir()):
+        trace_dir.rmdir()
+    print(f"Trace of {len(parts)} processes saved to {output_file}")
@@ -0,0 +1,193 @@
+"""Software trigger synchronizing the capture of several camera processes.
+
+The coordinator ticks on a drift-free grid (see ``utils.scheduler``). Each
+tick it stores the tick number in shared memory and releases one semaphore per
+camera; every recorder waiting on its ``CameraTrigger`` wakes, grabs its
+freshest frame and writes the frame number and grab time into a shared ring.
+The coordinator collects the ring into one frame set per tick, with the
+capture skew between cameras, and saves them to ``frame_sets.csv``.
+
+A camera still busy when the next tick comes skips the ticks it missed, so the
+trigger rate can be raised until the slowest camera saturates; its column of
+the missed frame sets is -1.
+"""
+
+from collections import deque
+from multiprocessing import RawArray, RawValue, Semaphore
+import math
+import time
+
+import numpy as np
+
+from utils.scheduler import CaptureScheduler, SampleWindow
+
+FRAME_SETS_FILE = "frame_sets.csv"
+
+
+class SoftwareTrigger:
+    """Shared state of the trigger, created before the camera processes.
+
+    Args:
+        camera_names (list): Names of the triggered cameras
+        ring_size (int): Ticks of completions kept in shared memory
+    """
+
+    def __init__(self, camera_names, ring_size=256):
+        self.camera_names = list(camera_names)
+        self.ring_size = ring_size
+        self.tick = RawValue("q", -1)
+        self.stopped = RawValue("b", 0)
+        self.ready = RawArray("b", len(self.camera_names))
+        self.semaphores = [Semaphore(0) for _ in self.camera_names]
+        # (tick, frame, grab_ns) of every camera for the last ring_size ticks
+        self.completions = RawArray("q", len(self.camera_names) * ring_size * 3)
+        self._ring = None
+        self.ring[..., 0] = -1
+
+    @property
+    def ring(self):
+        if self._ring is None:
+            self._ring = np.frombuffer(self.completions, dtype=np.int64).reshape(
+                len(self.camera_names), self.ring_size, 3
+            )
+        return self._ring
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_ring"] = None
+        return state
+
+    def camera(self, index):
+        """Trigger of the ``index``-th camera, passed to its recorder."""
+        return CameraTrigger(self, index)
+
+    def fire(self, tick):
+        self.tick.value = tick
+        for semaphore in self.semaphores:
+            semaphore.release()
+
+    def stop(self):
+        self.stopped.value = 1
+        for semaphore in self.semaphores:
+            semaphore.release()
+
+
+class CameraTrigger:
+    """One camera's end of a SoftwareTrigger."""
+
+    def __init__(self, trigger, index):
+        self.trigger = trigger
+        self.index = index
+        self.semaphore = trigger.semaphores[index]
+
+    def set_ready(self, ready=True):
+        """Mark the camera as waiting for ticks, or as done recording."""
+        self.trigger.ready[self.index] = int(ready)
+
+    def wait(self):
+        """Block until the next tick and return it, None once stopped."""
+        self.semaphore.acquire()
+        # Ticks fired while this camera was busy are skipped
+        while self.semaphore.acquire(False):
+            pass
+        if self.trigger.stopped.value:
+            return None
+        return self.trigger.tick.value
+
+    def done(self, tick, frame, grab_ns):
+        """Report the frame grabbed for ``tick``."""
+        row = self.trigger.ring[self.index, tick % self.trigger.ring_size]
+        row[1] = frame
+        row[2] = grab_ns
+        # Written last, marks the row complete for the coordinator
+        row[0] = tick
+
+
+def run_trigger(trigger, rate, processes, output_file=None, timeout_s=1.0):
+    """Tick the cameras at ``rate`` until their processes exit or Ctrl-C.
+
+    Starts once every camera is ready and stops once none is. A frame set is emitted when all cameras
+    completed its tick, or with the missing cameras at -1 after ``timeout_s``.
+
+    Args:
+        trigger (SoftwareTrigger): Trigger shared with the camera processes
+        rate (float): Ticks per second
+        processes (list): Camera processes, in the order of the trigger's
+            camera names
+        output_file (Path): CSV of the frame sets, None to only print stats
+    """
+    names = trigger.camera_names
+    ring = trigger.ring
+    lag = min(max(2, math.ceil(timeout_s * rate)), trigger.ring_size // 2)
+
+    def alive():
+        return [p.is_alive() for p in processes]
+
+    def recording():
+        return any(ready and a for ready, a in zip(trigger.ready, alive()))
+
+    while not all(trigger.ready[i] or not a for i, a in enumerate(alive())):
+        time.sleep(0.01)
+    print(f"Trigger: {len(names)} cameras ready, triggering at {rate:g} fps")
+
+    csv = None
+    if output_file is not None:
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        csv = open(output_file, "w")
+        csv.write(",".join(["tick", "trigger_ns", "skew_us"] + names) + "\n")
+
+    pending = deque()
+    # Skew percentiles over the latest frame sets, memory stays bounded
+    skews = SampleWindow()
+    complete = 0
+    missed = np.zeros(len(names), dtype=np.int64)
+
+    def emit(tick, trigger_ns):
+        nonlocal complete
+        rows = ring[:, tick % trigger.ring_size]
+        done = rows[:, 0] == tick
+        frames = np.where(done, rows[:, 1], -1)
+        missed[~done] += 1
+        skew_us = -1
+        if done.any():
+            grab_ns = rows[done, 2]
+            skew_us = (grab_ns.max() - grab_ns.min()) // 1000
+        if done.all():
+            complete += 1
+            skews.add(skew_us)
+        if csv is not None:
+            csv.write(
+                ",".join(map(str, [tick, trigger_ns, skew_us, *frames.tolist()])) + "\n"
+            )
+
+    scheduler = CaptureScheduler(rate)
+    try:
+        while recording():
+            tick = scheduler.wait()
+            trigger_ns = time.monotonic_ns()
+            trigger.fire(tick)
+            pending.append((tick, trigger_ns))
+            while pending:
+                oldest, oldest_ns = pending[0]
+                rows = ring[:, oldest % trigger.ring_size]
+                if not (rows[:, 0] == oldest).all() and tick - oldest < lag:
+                    break
+                emit(oldest, oldest_ns)
+                pending.popleft()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        trigger.stop()
+        while pending:
+            emit(*pending.popleft())
+        if csv is not None:
+            csv.close()
+
+    summary = f"Trigger: {scheduler.summary()}, {complete} complete frame sets"
+    if skews:
+        p50, p99 = skews.percentiles([50, 99])
+        summary += f", skew p50 {p50 / 1e3:.2f} ms p99 {p99 / 1e3:.2f} ms max {skews.max / 1e3:.2f} ms"
+    print(summary)
+    for name, count in zip(names, missed):
+        if count:
+            print(f"Trigger: {name} missed {count} ticks")
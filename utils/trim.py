@@ -0,0 +1,389 @@
+"""Remove a range of frames from every camera and stream of a session.
+
+Each camera directory is scanned once, and cameras are trimmed in parallel.
+Loose frame files in the range are moved to the trash; container shards and
+the manifest, write and drop logs holding frames of the range are rewritten
+without them, and their originals moved to the trash, so the session stays
+consistent and a trim can be undone exactly. The session's ``frame_sets.csv``
+of the software trigger is rewritten the same way: the trimmed frames of a
+frame set become -1, like frames a camera missed, and frame sets left without
+any frame are dropped.
+
+Every trim is a batch in ``<recorded_data>/.trash/<timestamp>/<batch>``;
+``--undo`` restores the newest batch of a session. ``--delete`` removes the
+frames for good instead.
+
+Usage:
+    python -m utils.trim recorded_data/<timestamp> 100 250 --dry_run
+    python -m utils.trim recorded_data/<timestamp> 100 250 --cameras "camera_zed2i_*"
+    python -m utils.trim recorded_data/<timestamp> --undo
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from fnmatch import fnmatch
+from pathlib import Path
+import argparse
+import csv
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from utils.container import (
+    COMPRESSIONS,
+    SUFFIX as CONTAINER_SUFFIX,
+    ContainerReader,
+    ContainerWriter,
+    loose_file_pattern,
+)
+from utils.manifest import (
+    DROP_LOG_FILE,
+    MANIFEST_FILE,
+    WRITE_LOG_PREFIX,
+    drop_log_dtype,
+    manifest_dtype,
+    write_log_dtype,
+)
+from utils.trigger import FRAME_SETS_FILE
+
+TRASH_DIR = ".trash"
+TRIM_FILE = "trim.json"
+PARTIAL_SUFFIX = ".partial"
+
+
+def log_dtype(name):
+    """Record dtype of a per-frame log file, None for other files."""
+    if name == MANIFEST_FILE:
+        return manifest_dtype
+    if name == DROP_LOG_FILE:
+        return drop_log_dtype
+    if name.startswith(WRITE_LOG_PREFIX) and name.endswith(".bin"):
+        return write_log_dtype
+    return None
+
+
+def trash_root(session_dir):
+    """Trash batches of a session, next to the sessions so no tool scans them."""
+    session_dir = Path(session_dir)
+    return session_dir.parent / TRASH_DIR / session_dir.name
+
+
+def _rewrite_container(path, output_path, keep):
+    reader = ContainerReader(path)
+    compressions = {code: name for name, code in COMPRESSIONS.items()}
+    compression = compressions[int(reader.chunks["compression"][0])]
+    with ContainerWriter(output_path, compression=compression) as writer:
+        for frame_number in reader.frame_numbers[keep]:
+            writer.append(int(frame_number), reader[frame_number])
+    reader.close()
+
+
+def trim_camera(camera_dir, first, last, trash_dir=None, dry_run=False):
+    """Remove frames ``first`` to ``last`` (inclusive) of one camera directory.
+
+    Args:
+        camera_dir (Path): Camera directory
+        first (int): First frame number to remove
+        last (int): Last frame number to remove
+        trash_dir (Path): Directory the removed files and the originals of
+            rewritten files are moved to, None to delete them
+        dry_run (bool): Only count what would be removed
+
+    Returns:
+        dict: Numbers of removed loose files, container frames and log records
+    """
+    camera_dir = Path(camera_dir)
+    counts = dict(files=0, container_frames=0, log_records=0)
+
+    def discard(name):
+        if trash_dir is None:
+            os.remove(camera_dir / name)
+        else:
+            os.replace(camera_dir / name, trash_dir / name)
+
+    def replace(name, write):
+        # The original is only discarded once its trimmed copy is complete
+        partial = camera_dir / (name + PARTIAL_SUFFIX)
+        write(partial)
+        discard(name)
+        os.replace(partial, camera_dir / name)
+
+    loose, shards, logs = [], [], []
+    with os.scandir(camera_dir) as entries:
+        for entry in entries:
+            match = loose_file_pattern.match(entry.name)
+            if match:
+                if first <= int(match["frame"]) <= last:
+                    loose.append(entry.name)
+            elif entry.name.endswith(CONTAINER_SUFFIX):
+                shards.append(entry.name)
+            elif log_dtype(entry.name) is not None:
+                logs.append(entry.name)
+
+    if trash_dir is not None and not dry_run:
+        trash_dir.mkdir(parents=True, exist_ok=True)
+
+    counts["files"] = len(loose)
+    if not dry_run:
+        for name in loose:
+            discard(name)
+
+    for name in shards:
+        reader = ContainerReader(camera_dir / name)
+        frame_numbers = reader.frame_numbers
+        reader.close()
+        keep = (frame_numbers < first) | (frame_numbers > last)
+        removed = int(len(keep) - keep.sum())
+        counts["container_frames"] += removed
+        if dry_run or not removed:
+            continue
+        if keep.any():
+            replace(
+                name,
+                lambda partial: _rewrite_container(camera_dir / name, partial, keep),
+            )
+        else:
+            discard(name)
+
+    for name in logs:
+        records = np.fromfile(camera_dir / name, dtype=log_dtype(name))
+        keep = (records["frame"] < first) | (records["frame"] > last)
+        removed = int(len(keep) - keep.sum())
+        counts["log_records"] += removed
+        if dry_run or not removed:
+            continue
+        if keep.any():
+            replace(name, lambda partial: records[keep].tofile(partial))
+        else:
+            discard(name)
+    return counts
+
+
+def trim_frame_sets(session_dir, first, last, camera_names, trash_dir, dry_run):
+    """Remove frames ``first`` to ``last`` of cameras from ``frame_sets.csv``.
+
+    Args:
+        session_dir (Path): recorded_data/<timestamp>
+        first (int): First frame number to remove
+        last (int): Last frame number to remove
+        camera_names (list): Trimmed camera directories, ``camera_<name>``
+        trash_dir (Path): Directory the original is moved to, None to delete it
+        dry_run (bool): Only count what would be removed
+
+    Returns:
+        int: Number of frame set entries removed
+    """
+    path = Path(session_dir) / FRAME_SETS_FILE
+    if not path.exists():
+        return 0
+    with open(path, newline="") as f:
+        header, *rows = list(csv.reader(f))
+    # Columns after tick, trigger_ns and skew_us are the frames of each camera
+    columns = [
+        i
+        for i, name in enumerate(header)
+        if i >= 3 and f"camera_{name}" in camera_names
+    ]
+    removed = 0
+    kept = []
+    for row in rows:
+        for i in columns:
+            if first <= int(row[i]) <= last:
+                row[i] = "-1"
+                removed += 1
+        if any(int(frame) >= 0 for frame in row[3:]):
+            kept.append(row)
+    if dry_run or not removed:
+        return removed
+
+    partial = path.with_name(path.name + PARTIAL_SUFFIX)
+    with open(partial, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(kept)
+    if trash_dir is None:
+        os.remove(path)
+    else:
+        os.replace(path, trash_dir / FRAME_SETS_FILE)
+    os.replace(partial, path)
+    return removed
+
+
+def trim_session(
+    session_dir,
+    first,
+    last,
+    cameras=None,
+    delete=False,
+    dry_run=False,
+    num_workers=None,
+):
+    """Remove frames ``first`` to ``last`` from every camera of a session.
+
+    Args:
+        session_dir (Path): recorded_data/<timestamp>
+        first (int): First frame number to remove
+        last (int): Last frame number to remove
+        cameras (list): Patterns of the camera directories to trim, e.g.
+            ``camera_zed2i_*``, default all
+        delete (bool): Delete the frames instead of moving them to the trash
+        dry_run (bool): Only report what would be removed
+        num_workers (int): Cameras trimmed at once, default all
+    """
+    session_dir = Path(session_dir)
+    camera_dirs = [
+        Path(entry.path)
+        for entry in sorted(os.scandir(session_dir), key=lambda e: e.name)
+        if entry.is_dir()
+        and any(fnmatch(entry.name, pattern) for pattern in cameras or ["camera_*"])
+    ]
+    if not camera_dirs:
+        print(f"No cameras to trim in {session_dir}")
+        return
+
+    batch_dir = None
+    if not delete and not dry_run:
+        batch_dir = trash_root(session_dir) / datetime.now().strftime("%Y%m%d_%H%M%S")
+        while batch_dir.exists():
+            batch_dir = batch_dir.with_name(batch_dir.name + "_")
+        batch_dir.mkdir(parents=True)
+        with open(batch_dir / TRIM_FILE, "w") as f:
+            json.dump(
+                dict(
+                    first=first,
+                    last=last,
+                    cameras=[camera_dir.name for camera_dir in camera_dirs],
+                ),
+                f,
+                indent=2,
+            )
+
+    start_time = time.time()
+    with ThreadPoolExecutor(num_workers or len(camera_dirs)) as executor:
+        results = list(
+            executor.map(
+                lambda camera_dir: trim_camera(
+                    camera_dir,
+                    first,
+                    last,
+                    batch_dir / camera_dir.name if batch_dir is not None else None,
+                    dry_run,
+                ),
+                camera_dirs,
+            )
+        )
+    # In the same batch as the cameras, so undo restores both
+    frame_set_entries = trim_frame_sets(
+        session_dir,
+        first,
+        last,
+        [camera_dir.name for camera_dir in camera_dirs],
+        batch_dir,
+        dry_run,
+    )
+    elapsed = time.time() - start_time
+
+    action = "Would remove" if dry_run else "Deleted" if delete else "Trashed"
+    for camera_dir, counts in zip(camera_dirs, results):
+        print(
+            f"{action} frames {first}-{last} of {camera_dir.name}: {counts['files']} files, {counts['container_frames']} container frames, {counts['log_records']} log records"
+        )
+    if frame_set_entries:
+        print(f"{action} {frame_set_entries} entries of {FRAME_SETS_FILE}")
+    print(f"{len(camera_dirs)} cameras in {elapsed:.1f} s")
+    if batch_dir is not None:
+        print(f"Undo with: python -m utils.trim {session_dir} --undo")
+
+
+def undo_trim(session_dir):
+    """Restore the newest trash batch of a session."""
+    session_dir = Path(session_dir)
+    root = trash_root(session_dir)
+    batches = sorted(root.iterdir()) if root.is_dir() else []
+    if not batches:
+        print(f"Nothing to undo for {session_dir}")
+        return
+    batch_dir = batches[-1]
+    with open(batch_dir / TRIM_FILE) as f:
+        trim = json.load(f)
+
+    restored = 0
+    for camera in trim["cameras"]:
+        trash_dir = batch_dir / camera
+        if not trash_dir.is_dir():
+            continue
+        # Originals of rewritten shards and logs replace their trimmed copies
+        with os.scandir(trash_dir) as entries:
+            for entry in entries:
+                os.replace(entry.path, session_dir / camera / entry.name)
+                restored += 1
+    if (batch_dir / FRAME_SETS_FILE).exists():
+        os.replace(batch_dir / FRAME_SETS_FILE, session_dir / FRAME_SETS_FILE)
+        restored += 1
+    shutil.rmtree(batch_dir)
+    for directory in (root, root.parent):
+        if not any(directory.iterdir()):
+            directory.rmdir()
+    print(
+        f"Restored frames {trim['first']}-{trim['last']} of {len(trim['cameras'])} cameras ({restored} files)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Remove a range of frames from every camera of a session"
+    )
+    parser.add_argument("session_dir", type=str, help="recorded_data/<timestamp>")
+    parser.add_argument(
+        "first", type=int, nargs="?", help="First frame number to remove"
+    )
+    parser.add_argument(
+        "last", type=int, nargs="?", help="Last frame number to remove, inclusive"
+    )
+    parser.add_argument(
+        "--cameras",
+        type=str,
+        nargs="+",
+        help="Camera directories to trim, e.g. 'camera_zed2i_*', default all",
+        default=None,
+    )
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="Delete the frames instead of moving them to the trash",
+    )
+    parser.add_argument(
+        "--dry_run", action="store_true", help="Only report what would be removed"
+    )
+    parser.add_argument(
+        "--undo", action="store_true", help="Restore the newest trimmed batch"
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help="Cameras trimmed at once, default all",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    if args.undo:
+        undo_trim(args.session_dir)
+        return
+    if args.first is None or args.last is None:
+        parser.error("first and last frame numbers are required")
+    trim_session(
+        args.session_dir,
+        args.first,
+        args.last,
+        args.cameras,
+        args.delete,
+        args.dry_run,
+        args.num_workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
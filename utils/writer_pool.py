@@ -0,0 +1,264 @@
+from collections import deque
+from multiprocessing import Lock, Process, Queue, RawArray, Value
+import signal
+import time
+
+from utils import tracing
+from utils.frame_store import close_stores
+
+DROP_POLICIES = ["block", "drop_newest", "drop_oldest", "decimate"]
+
+# slot_frames value of a slot that is free or being written
+NO_FRAME = -1
+
+
+def _writer_loop(
+    target, queue, finished, failed, written_bytes, ring, slot_state, metrics, trace
+):
+    # Ctrl-C is delivered to the whole process group; writers must keep going
+    # until the recorder sends the stop sentinel so queued frames are flushed.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if trace is not None:
+        tracing.start(*trace)
+
+    while True:
+        args = queue.get()
+        if tracing.tracer:
+            tracing.tracer.lap("queue_get")
+        if args is None:
+            break
+        try:
+            if ring is None:
+                target(*args)
+            else:
+                slot, frame, skip, queued_ns, *args = args
+                lock, slot_frames = slot_state
+                with lock:
+                    if slot_frames[slot] != frame:
+                        # Replaced by a newer frame, see WriterPool.push
+                        continue
+                    slot_frames[slot] = NO_FRAME
+                try:
+                    streams = {
+                        name: view
+                        for name, view in ring.views(slot).items()
+                        if name not in skip
+                    }
+                    target(*args, **streams)
+                finally:
+                    ring.release(slot)
+                    if tracing.tracer:
+                        tracing.tracer.lap("release")
+                nbytes = sum(view.nbytes for view in streams.values())
+                with written_bytes.get_lock():
+                    written_bytes.value += nbytes
+                if metrics is not None:
+                    metrics.count("written_bytes", nbytes)
+                    metrics.observe(
+                        "write_latency", (time.monotonic_ns() - queued_ns) // 1000
+                    )
+        except Exception as e:
+            print(f"Writer error - {e}")
+            with failed.get_lock():
+                failed.value += 1
+            if metrics is not None:
+                metrics.count("failed_writes")
+        else:
+            with finished.get_lock():
+                finished.value += 1
+            if metrics is not None:
+                metrics.count("written_frames")
+
+    close_stores()
+    tracing.stop()
+
+
+class WriterPool:
+    """Long-lived pool of writer processes consuming frames from a bounded queue.
+
+    Replaces spawning one ``Process(target=save_data, ...)`` per frame. ``submit``
+    blocks once ``max_pending`` frames are queued, so a slow disk slows the
+    capture loop down instead of piling up writer processes.
+
+    With a ``ring``, frames are passed through shared memory instead of being
+    pickled: ``push(frame, streams, *args)`` copies ``streams`` into a slot and
+    calls ``target(*args, **slot_arrays)``, with the arrays passed by stream
+    name, releasing the slot once the frame is written. The ring's slots bound
+    the frames in flight, and ``policy`` decides what happens when they are
+    all taken:
+
+    - ``block``: wait for a writer to free a slot
+    - ``drop_newest``: drop the frame being pushed
+    - ``drop_oldest``: replace the oldest frame no writer has started on
+    - ``decimate``: once half the slots are taken, skip the
+      ``droppable_streams`` of new frames; block when all are taken
+
+    Args:
+        target (callable): Function called as ``target(*args)`` for each frame
+        num_workers (int): Number of writer processes
+        max_pending (int): Maximum number of frames waiting in the queue
+        ring (SharedFrameRing): Optional shared-memory ring holding the frames,
+            closed together with the pool
+        policy (str): One of ``DROP_POLICIES``
+        droppable_streams (list): Streams ``decimate`` skips first
+        metrics (utils.metrics.CameraMetrics): Metrics of the camera, every
+            writer updates its own row
+        trace (tuple): (trace_dir, name) to trace the writers into, see
+            ``utils.tracing``
+    """
+
+    def __init__(
+        self,
+        target,
+        num_workers=2,
+        max_pending=32,
+        ring=None,
+        policy="block",
+        droppable_streams=(),
+        metrics=None,
+        trace=None,
+    ):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {policy}")
+        self.target = target
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.ring = ring
+        self.policy = policy
+        self.droppable_streams = set(droppable_streams)
+        self.metrics = metrics
+        self.trace = trace
+        self.submitted = 0
+        self.replaced = 0
+        self._finished = Value("Q", 0)
+        self._failed = Value("Q", 0)
+        self._written_bytes = Value("Q", 0)
+        self.workers = []
+
+    def start(self):
+        if self.ring is None:
+            self.queue = Queue(maxsize=self.max_pending)
+            self.slot_state = None
+        else:
+            # The ring bounds the frames in flight; replaced frames leave stale
+            # entries behind, so the queue itself must not block
+            self.queue = Queue()
+            self.slot_state = (Lock(), RawArray("q", [NO_FRAME] * self.ring.num_slots))
+            self.in_flight = deque()
+        for i in range(self.num_workers):
+            worker = Process(
+                target=_writer_loop,
+                args=(
+                    self.target,
+                    self.queue,
+                    self._finished,
+                    self._failed,
+                    self._written_bytes,
+                    self.ring,
+                    self.slot_state,
+                    None if self.metrics is None else self.metrics.writer(i),
+                    (
+                        None
+                        if self.trace is None
+                        else (self.trace[0], f"{self.trace[1]} writer {i}")
+                    ),
+                ),
+                daemon=True,
+            )
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, *args):
+        self.queue.put(args)
+        self.submitted += 1
+
+    def _replace_oldest(self):
+        """Take over the slot of the oldest frame no writer has started on.
+
+        Returns:
+            tuple: (slot, frame) of the replaced frame, None if every queued
+                frame is being written
+        """
+        lock, slot_frames = self.slot_state
+        with lock:
+            while self.in_flight:
+                slot, frame = self.in_flight.popleft()
+                if slot_frames[slot] == frame:
+                    slot_frames[slot] = NO_FRAME
+                    return slot, frame
+        return None
+
+    def push(self, frame, streams, *args):
+        """Queue a frame held in ``streams`` through the ring.
+
+        Returns:
+            list: Dropped (frame, stream) pairs, stream None when the whole
+                frame was dropped
+        """
+        dropped = []
+        skip = ()
+        slot = self.ring.try_acquire()
+        if slot is None:
+            if self.policy == "drop_newest":
+                return [(frame, None)]
+            if self.policy == "drop_oldest":
+                replaced = self._replace_oldest()
+                if replaced is not None:
+                    slot, old_frame = replaced
+                    self.replaced += 1
+                    dropped.append((old_frame, None))
+        if (
+            self.policy == "decimate"
+            and self.pending + 1 > self.ring.num_slots // 2
+            and self.droppable_streams
+        ):
+            skip = tuple(sorted(self.droppable_streams & set(streams)))
+            dropped.extend((frame, stream) for stream in skip)
+        if slot is None:
+            slot = self.ring.acquire()
+
+        views = self.ring.views(slot)
+        for name, array in streams.items():
+            if name not in skip:
+                views[name][...] = array
+        _, slot_frames = self.slot_state
+        slot_frames[slot] = frame
+        while self.in_flight:
+            # Frames writers have started on can no longer be replaced
+            first_slot, first_frame = self.in_flight[0]
+            if slot_frames[first_slot] == first_frame:
+                break
+            self.in_flight.popleft()
+        self.in_flight.append((slot, frame))
+        self.submit(slot, frame, skip, time.monotonic_ns(), *args)
+        return dropped
+
+    @property
+    def finished(self):
+        return self._finished.value
+
+    @property
+    def failed(self):
+        return self._failed.value
+
+    @property
+    def written_bytes(self):
+        """Bytes of frame data handed to the writer target so far."""
+        return self._written_bytes.value
+
+    @property
+    def pending(self):
+        return self.submitted - self.replaced - self.finished - self.failed
+
+    def close(self):
+        """Flush all queued frames and stop the writer processes."""
+        if not self.workers:
+            return
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        if self.ring is not None:
+            self.ring.close()
+        print(f"Writers flushed: {self.finished} frames written, {self.failed} failed")
@@ -0,0 +1,178 @@
+"""Export many recorded sessions in one run.
+
+Discovers the sessions of ``recorded_data`` (or the given ones) and exports the
+videos, mosaic and thumbnails of each into ``<session>/videos``, see
+``visualization.export_video``. The jobs of all sessions share one pool of
+worker processes. Outputs newer than the camera data they are made from are
+skipped, and outputs only get their name once complete, so an interrupted run
+resumes where it stopped when started again. ``--force`` exports everything
+again, e.g. after changing the options.
+
+Usage:
+    python -m visualization.batch_export  # every session in recorded_data
+    python -m visualization.batch_export 20250101_1200 20250101_1300 --streams color depth
+"""
+
+from pathlib import Path
+import argparse
+import os
+
+from utils.container import SUFFIX as CONTAINER_SUFFIX
+from utils.manifest import MANIFEST_FILE
+from utils.session_reader import session_cameras
+from visualization.export_video import (
+    OUTPUT_DIR,
+    STREAMS,
+    run_tasks,
+    video_tasks,
+)
+
+
+def find_sessions(root):
+    """Session directories of ``root`` that contain cameras, in name order."""
+    root = Path(root)
+    if not root.is_dir():
+        return []
+    return [
+        Path(entry.path)
+        for entry in sorted(os.scandir(root), key=lambda e: e.name)
+        if entry.is_dir() and session_cameras(entry.path)
+    ]
+
+
+def data_mtime(camera_dirs):
+    """Last change of the recorded data of ``camera_dirs``.
+
+    Adding or removing loose frame files changes the directory; containers
+    and manifests are appended to in place.
+    """
+    mtime = 0
+    for camera_dir in camera_dirs:
+        mtime = max(mtime, os.stat(camera_dir).st_mtime)
+        with os.scandir(camera_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(CONTAINER_SUFFIX) or entry.name == MANIFEST_FILE:
+                    mtime = max(mtime, entry.stat().st_mtime)
+    return mtime
+
+
+def up_to_date(output_file, mtime):
+    try:
+        return os.stat(output_file).st_mtime >= mtime
+    except FileNotFoundError:
+        return False
+
+
+def batch_export(sessions, num_workers=None, force=False, **export_kwargs):
+    """Export every session of ``sessions`` on one pool of worker processes.
+
+    Args:
+        sessions (list): Session directories
+        num_workers (int): Worker processes, default one per job up to the
+            CPU count
+        force (bool): Export outputs that are up to date as well
+        **export_kwargs: Options of ``visualization.export_video.video_tasks``
+    """
+    tasks = []
+    skipped = 0
+    for session_dir in sessions:
+        camera_dirs = session_cameras(session_dir)
+        session_tasks = video_tasks(
+            camera_dirs, Path(session_dir) / OUTPUT_DIR, **export_kwargs
+        )
+        mtime = data_mtime(camera_dirs)
+        for task in session_tasks:
+            if not force and up_to_date(task[1], mtime):
+                skipped += 1
+            else:
+                tasks.append(task)
+    print(
+        f"{len(sessions)} sessions: {len(tasks)} files to export, {skipped} up to date"
+    )
+    run_tasks(tasks, num_workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the videos and thumbnails of many sessions"
+    )
+    parser.add_argument(
+        "sessions",
+        type=str,
+        nargs="*",
+        help="Session timestamps or directories, default every session of --root",
+    )
+    parser.add_argument(
+        "--root", type=str, help="Directory of the sessions", default="recorded_data"
+    )
+    parser.add_argument("--fps", type=float, help="Video frame rate", default=10)
+    parser.add_argument(
+        "--streams",
+        type=str,
+        nargs="+",
+        choices=STREAMS,
+        help="Streams to export",
+        default=["color"],
+    )
+    parser.add_argument(
+        "--no_mosaic",
+        action="store_true",
+        help="Do not tile the streams of every camera into one video",
+    )
+    parser.add_argument(
+        "--thumbnails",
+        type=int,
+        help="Frames in a contact sheet of every camera, 0 for none",
+        default=8,
+    )
+    parser.add_argument(
+        "--depth_range",
+        type=float,
+        nargs=2,
+        help="Depth in millimeters shown in the lowest and highest color",
+        default=[0, 2000],
+    )
+    parser.add_argument("--cmap", type=str, help="Depth colormap", default="spectral")
+    parser.add_argument(
+        "--tolerance_ms",
+        type=float,
+        help="Maximum capture time difference of matched frames",
+        default=100,
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help="Number of worker processes, default one per job up to the CPU count",
+        default=None,
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Export up to date outputs as well"
+    )
+    args = parser.parse_args()
+
+    if args.sessions:
+        sessions = [
+            Path(s) if os.path.isdir(s) else Path(args.root) / s for s in args.sessions
+        ]
+        for session_dir in sessions:
+            if not session_dir.is_dir():
+                print(f"The directory '{session_dir}' does not exist.")
+                return
+    else:
+        sessions = find_sessions(args.root)
+    batch_export(
+        sessions,
+        args.num_workers,
+        args.force,
+        fps=args.fps,
+        streams=args.streams,
+        mosaic=not args.no_mosaic,
+        thumbnails=args.thumbnails,
+        tolerance_ms=args.tolerance_ms,
+        depth_range=tuple(args.depth_range),
+        cmap=args.cmap,
+    )
+
+
+if __name__ == "__main__":
+    main()
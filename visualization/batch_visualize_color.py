@@ -1,36 +1,27 @@
 import sys
-import subprocess
 import os
 
+from utils.session_reader import session_cameras
+from visualization.visualize_color import visualize_image_sequences
+
 
 def main():
     if len(sys.argv) != 3:
-        print("Usage: python translate_bash.py <timestep> <fps>")
+        print("Usage: python -m visualization.batch_visualize_color <timestep> <fps>")
         sys.exit(1)
 
     # Get the base directory (the equivalent of $1 in the bash script)
     base_directory = os.path.join("recorded_data", sys.argv[1])
-
-    # List of camera directories
-    camera_directories = os.listdir(base_directory)
-    camera_directories = [
-        os.path.join(sys.argv[1], directory) for directory in camera_directories
-    ]
+    if not os.path.isdir(base_directory):
+        print(f"The directory '{base_directory}' does not exist.")
+        sys.exit(1)
 
     # FPS value
     fps = int(sys.argv[2])
 
-    # Create the command to run visualize_color.py with the constructed arguments
-    command = (
-        ["python", "visualization/visualize_color.py"] + camera_directories + [str(fps)]
-    )
-
-    # Run the command
-    try:
-        subprocess.run(command, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error running the command: {e}")
-        sys.exit(1)
+    # Play the cameras of the session in this process, see
+    # visualization.batch_export for headless export of many sessions
+    visualize_image_sequences(session_cameras(base_directory), fps)
 
 
 if __name__ == "__main__":
@@ -1,37 +1,41 @@
+import argparse
 import sys
-import subprocess
 import os
 
+from utils.session_reader import session_cameras
+from visualization.visualize_depth import visualize_image_sequences
+
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python translate_bash.py <timestep> <fps>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Play the depth of every camera of a session",
+    )
+    parser.add_argument("timestep", help="Session under recorded_data")
+    parser.add_argument("fps", type=int, help="Playback rate")
+    parser.add_argument(
+        "--depth_range",
+        type=float,
+        nargs=2,
+        help="Depth in millimeters shown in the lowest and highest color",
+        default=[0, 2000],
+    )
+    args = parser.parse_args()
 
     # Get the base directory (the equivalent of $1 in the bash script)
-    base_directory = os.path.join("recorded_data", sys.argv[1])
-
-    # List of camera directories
-    camera_directories = os.listdir(base_directory)
-    camera_directories = [
-        os.path.join(sys.argv[1], directory) for directory in camera_directories
-    ]
+    base_directory = os.path.join("recorded_data", args.timestep)
+    if not os.path.isdir(base_directory):
+        print(f"The directory '{base_directory}' does not exist.")
+        sys.exit(1)
 
     # FPS value
-    fps = int(sys.argv[2])
+    fps = args.fps
 
-    # Create the command to run visualize_depth.py with the constructed arguments
-    command = (
-        ["python", "visualization/visualize_depth.py"] + camera_directories + [str(fps)]
+    # Play the cameras of the session in this process, see
+    # visualization.batch_export for headless export of many sessions
+    visualize_image_sequences(
+        session_cameras(base_directory), fps, depth_range=tuple(args.depth_range)
     )
 
-    # Run the command
-    try:
-        subprocess.run(command, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error running the command: {e}")
-        sys.exit(1)
-
 
 if __name__ == "__main__":
     main()
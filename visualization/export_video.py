@@ -0,0 +1,446 @@
+"""Export recorded sessions as videos.
+
+Every camera and stream is encoded by its own worker process, which streams
+frames from the decoder to the encoder one at a time, so a session exports in
+about the time of its slowest camera. Frames are matched across cameras by
+capture time (``utils.sync.playback_rows``), so all videos stay in step; a
+camera without a frame for a row repeats its previous frame.
+
+- ``color``: ``<camera>_color.mp4``
+- ``depth``: ``<camera>_depth.mp4``, colorized over ``--depth_range`` in
+  millimeters, whatever the units and encoding the depth is stored in
+- ``--mosaic``: ``mosaic.mp4``, the exported streams of every camera tiled
+  into one video, decoded by a thread pool within its worker
+- ``--thumbnails N``: ``<camera>.jpg``, a contact sheet of N frames
+
+Videos are written under a ``.partial`` name and renamed when complete.
+
+Usage:
+    python -m visualization.export_video recorded_data/<timestamp> --fps 10
+    python -m visualization.export_video recorded_data/<timestamp> --streams color depth --mosaic
+"""
+
+from collections import Counter
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+import argparse
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+from utils.colorize import colorize
+from utils.depth_encoding import read_depth_info, stored_depth_range
+from utils.preview import DEPTH_STREAMS, fit, to_bgr
+from utils.session_reader import CameraReader, session_cameras
+from utils.sync import playback_rows
+from visualization.playback import FramePrefetcher
+
+STREAMS = ["color", "depth"]
+MOSAIC_FILE = "mosaic.mp4"
+OUTPUT_DIR = "videos"
+
+
+def stream_name(camera, stream):
+    """Stored stream of ``camera`` exported as ``stream``, None if missing.
+
+    Depth is taken from the streams ``depth.json`` describes, so raw depth is
+    preferred over depth a camera colorized when recording (Mech-Eye's
+    ``depth``); without it, from the first of ``DEPTH_STREAMS``.
+    """
+    if stream != "depth":
+        return stream if stream in camera else None
+    info = read_depth_info(camera.camera_dir)
+    encoded = info["streams"] if info is not None else ()
+    present = [s for s in DEPTH_STREAMS if s in camera]
+    return next((s for s in present if s in encoded), next(iter(present), None))
+
+
+def video_frame(image, depth_range=(0, 2000), cmap="spectral"):
+    """BGR video frame of a stored frame, depth is colorized.
+
+    ``depth_range`` is in the stored values of the frame's stream, see
+    ``utils.depth_encoding.stored_depth_range``.
+    """
+    if image.ndim == 2:
+        return colorize(image, *depth_range, cmap=cmap)
+    # Depth that was colorized when recorded is exported as is
+    return to_bgr(np.asarray(image))
+
+
+def partial_file(output_file):
+    """Name ``output_file`` is written under until it is complete."""
+    output_file = Path(output_file)
+    return output_file.with_name(f"{output_file.stem}.partial{output_file.suffix}")
+
+
+def _export_stream(output_file, camera_dir, stream, positions, fps, depth_range, cmap):
+    start_time = time.time()
+    frames = CameraReader(camera_dir)[stream]
+    first = positions[positions >= 0][0]
+    height, width = video_frame(frames[first], depth_range, cmap).shape[:2]
+    out = cv2.VideoWriter(
+        str(partial_file(output_file)),
+        cv2.VideoWriter_fourcc(*"mp4v"),
+        fps,
+        (width, height),
+    )
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    for i in positions:
+        if i >= 0:
+            frame = video_frame(frames[i], depth_range, cmap)
+        out.write(frame)
+    out.release()
+    os.replace(partial_file(output_file), output_file)
+    return output_file, len(positions), time.time() - start_time
+
+
+def _export_mosaic(output_file, columns, rows, fps, tile_size, depth_ranges, cmap):
+    start_time = time.time()
+    height, width = tile_size
+
+    def thumbnail(image, depth_range):
+        tile = np.zeros((height, width, 3), dtype=np.uint8)
+        if image.ndim == 2:
+            # Depth must not be averaged across edges, downscale before colorizing
+            small = np.zeros((height, width), dtype=image.dtype)
+            fit(image, small, cv2.INTER_NEAREST)
+            tile[...] = colorize(small, *depth_range, cmap=cmap)
+        else:
+            fit(to_bgr(np.asarray(image)), tile)
+        return tile
+
+    # Cameras are laid out in a grid, each with its streams side by side
+    streams_per_camera = Counter(camera_dir for camera_dir, _ in columns)
+    cameras = list(streams_per_camera)
+    grid_columns = math.ceil(math.sqrt(len(cameras)))
+    grid_rows = math.ceil(len(cameras) / grid_columns)
+    cell_width = max(streams_per_camera.values()) * width
+    mosaic = np.zeros((grid_rows * height, grid_columns * cell_width, 3), np.uint8)
+    tiles = []
+    placed = Counter()
+    for camera_dir, _ in columns:
+        cell = cameras.index(camera_dir)
+        top = cell // grid_columns * height
+        left = cell % grid_columns * cell_width + placed[camera_dir] * width
+        placed[camera_dir] += 1
+        tiles.append(mosaic[top : top + height, left : left + width])
+
+    readers = {camera_dir: CameraReader(camera_dir) for camera_dir in cameras}
+    prefetcher = FramePrefetcher(
+        [readers[camera_dir][stream] for camera_dir, stream in columns],
+        rows,
+        [partial(thumbnail, depth_range=depth_range) for depth_range in depth_ranges],
+    )
+    out = cv2.VideoWriter(
+        str(partial_file(output_file)),
+        cv2.VideoWriter_fourcc(*"mp4v"),
+        fps,
+        (mosaic.shape[1], mosaic.shape[0]),
+    )
+    try:
+        for row in range(len(rows)):
+            for (camera_dir, stream), tile, image in zip(
+                columns, tiles, prefetcher.get(row)
+            ):
+                if image is None:
+                    continue
+                tile[...] = image
+                cv2.putText(
+                    tile,
+                    f"{Path(camera_dir).name} {stream}",
+                    (8, 20),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.6,
+                    (255, 255, 255),
+                    1,
+                    cv2.LINE_AA,
+                )
+            out.write(mosaic)
+    finally:
+        prefetcher.close()
+        out.release()
+    os.replace(partial_file(output_file), output_file)
+    return output_file, len(rows), time.time() - start_time
+
+
+def _export_thumbnails(
+    output_file, camera_dir, streams, count, tile_size, depth_ranges, cmap
+):
+    """Contact sheet of ``count`` evenly spaced frames, one row per stream."""
+    start_time = time.time()
+    height, width = tile_size
+    camera = CameraReader(camera_dir)
+    sheet = np.zeros((len(streams) * height, count * width, 3), dtype=np.uint8)
+    for row, (stream, depth_range) in enumerate(zip(streams, depth_ranges)):
+        frames = camera[stream]
+        positions = np.linspace(0, len(frames) - 1, min(count, len(frames)))
+        for column, i in enumerate(positions.round().astype(int)):
+            fit(
+                video_frame(frames[i], depth_range, cmap),
+                sheet[
+                    row * height : (row + 1) * height,
+                    column * width : (column + 1) * width,
+                ],
+            )
+    cv2.imwrite(str(partial_file(output_file)), sheet)
+    os.replace(partial_file(output_file), output_file)
+    return output_file, count * len(streams), time.time() - start_time
+
+
+def video_tasks(
+    camera_dirs,
+    output_dir,
+    fps=10,
+    streams=("color",),
+    mosaic=False,
+    thumbnails=0,
+    tolerance_ms=100,
+    depth_range=(0, 2000),
+    cmap="spectral",
+    tile_size=(360, 640),
+    prefix="",
+):
+    """Export jobs of several cameras, see ``export_videos``.
+
+    Returns:
+        list: (export, output_file, args) of every job, run with ``run_tasks``
+    """
+    cameras = []
+    for camera_dir in camera_dirs:
+        camera = CameraReader(camera_dir)
+        names = [stream_name(camera, stream) for stream in streams]
+        if not any(name is not None and len(camera[name]) for name in names):
+            print(f"No {' or '.join(streams)} frames found in {camera_dir}")
+            continue
+        cameras.append((camera, names))
+    if not cameras:
+        return []
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Rows are matched on one stream of each camera, the others follow it by
+    # frame number
+    references = [
+        camera[next(name for name in names if name is not None)]
+        for camera, names in cameras
+    ]
+    rows = playback_rows(
+        [camera.camera_dir for camera, _ in cameras], references, tolerance_ms
+    )
+
+    tasks = []
+    columns, column_positions, column_ranges = [], [], []
+    for c, ((camera, names), reference) in enumerate(zip(cameras, references)):
+        camera_dir = str(camera.camera_dir)
+        frame_numbers = np.where(
+            rows[:, c] >= 0, reference.frame_numbers[rows[:, c]], -1
+        )
+        for stream, name in zip(streams, names):
+            if name is None:
+                continue
+            frames = camera[name]
+            positions = np.array([frames.index(n) for n in frame_numbers])
+            if not (positions >= 0).any():
+                print(f"No {stream} frames of {camera.name} matched the other cameras")
+                continue
+            stored_range = stored_depth_range(camera_dir, name, depth_range)
+            columns.append((camera_dir, name))
+            column_positions.append(positions)
+            column_ranges.append(stored_range)
+            tasks.append(
+                (
+                    _export_stream,
+                    output_dir / f"{prefix}{camera.name}_{stream}.mp4",
+                    (camera_dir, name, positions, fps, stored_range, cmap),
+                )
+            )
+        if thumbnails:
+            stored = [name for name in names if name is not None]
+            tasks.append(
+                (
+                    _export_thumbnails,
+                    output_dir / f"{prefix}{camera.name}.jpg",
+                    (
+                        camera_dir,
+                        stored,
+                        thumbnails,
+                        (tile_size[0] // 2, tile_size[1] // 2),
+                        [
+                            stored_depth_range(camera_dir, name, depth_range)
+                            for name in stored
+                        ],
+                        cmap,
+                    ),
+                )
+            )
+    if mosaic and columns:
+        # Started first, it decodes every camera
+        tasks.insert(
+            0,
+            (
+                _export_mosaic,
+                output_dir / f"{prefix}{MOSAIC_FILE}",
+                (
+                    columns,
+                    np.stack(column_positions, axis=1),
+                    fps,
+                    tile_size,
+                    column_ranges,
+                    cmap,
+                ),
+            ),
+        )
+    return tasks
+
+
+def _run_task(task):
+    export, output_file, args = task
+    return export(output_file, *args)
+
+
+def run_tasks(tasks, num_workers=None):
+    """Run export jobs on a pool of worker processes and report throughput.
+
+    Args:
+        tasks (list): Jobs of ``video_tasks``
+        num_workers (int): Worker processes, default one per job up to the
+            CPU count
+    """
+    if not tasks:
+        return
+    num_workers = num_workers or min(len(tasks), os.cpu_count() or 1)
+    start_time = time.time()
+    frames, busy = 0, 0
+    with Pool(num_workers) as pool:
+        for output_file, count, seconds in pool.imap_unordered(_run_task, tasks):
+            print(
+                f"Saved {output_file}: {count} frames in {seconds:.1f} s ({count / max(seconds, 1e-9):.1f} fps)"
+            )
+            frames += count
+            busy += seconds
+    elapsed = time.time() - start_time
+    print(
+        f"{len(tasks)} files, {frames} frames in {elapsed:.1f} s ({frames / max(elapsed, 1e-9):.1f} fps, {busy:.1f} s of encoding on {num_workers} workers)"
+    )
+
+
+def export_videos(
+    camera_dirs,
+    output_dir,
+    fps=10,
+    streams=("color",),
+    mosaic=False,
+    thumbnails=0,
+    tolerance_ms=100,
+    depth_range=(0, 2000),
+    cmap="spectral",
+    tile_size=(360, 640),
+    num_workers=None,
+    prefix="",
+):
+    """Encode the streams of several cameras as videos, in parallel.
+
+    Args:
+        camera_dirs (list): Camera directories
+        output_dir (Path): Directory of the videos
+        fps (float): Frame rate of the videos
+        streams (list): Streams to export, of ``STREAMS``
+        mosaic (bool): Also tile the streams of every camera into one video
+        thumbnails (int): Frames in a contact sheet of every camera, 0 for none
+        tolerance_ms (float): Maximum capture time difference of matched frames
+        depth_range (tuple): Depth in millimeters shown in the lowest and
+            highest color
+        cmap (str): Depth colormap, see ``utils.colorize``
+        tile_size (tuple): (height, width) of each stream in the mosaic
+        num_workers (int): Encoding processes, default one per video up to
+            the CPU count
+        prefix (str): Prefix of the video file names
+    """
+    tasks = video_tasks(
+        camera_dirs,
+        output_dir,
+        fps,
+        streams,
+        mosaic,
+        thumbnails,
+        tolerance_ms,
+        depth_range,
+        cmap,
+        tile_size,
+        prefix,
+    )
+    run_tasks(tasks, num_workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a session as videos")
+    parser.add_argument("session_dir", type=str, help="recorded_data/<timestamp>")
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        help="Directory of the videos, default <session_dir>/videos",
+        default=None,
+    )
+    parser.add_argument("--fps", type=float, help="Video frame rate", default=10)
+    parser.add_argument(
+        "--streams",
+        type=str,
+        nargs="+",
+        choices=STREAMS,
+        help="Streams to export",
+        default=["color"],
+    )
+    parser.add_argument(
+        "--mosaic",
+        action="store_true",
+        help="Also tile the streams of every camera into one video",
+    )
+    parser.add_argument(
+        "--thumbnails",
+        type=int,
+        help="Frames in a contact sheet of every camera, 0 for none",
+        default=0,
+    )
+    parser.add_argument(
+        "--depth_range",
+        type=float,
+        nargs=2,
+        help="Depth in millimeters shown in the lowest and highest color",
+        default=[0, 2000],
+    )
+    parser.add_argument("--cmap", type=str, help="Depth colormap", default="spectral")
+    parser.add_argument(
+        "--tolerance_ms",
+        type=float,
+        help="Maximum capture time difference of matched frames",
+        default=100,
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help="Number of encoding processes, default one per video up to the CPU count",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    session_dir = Path(args.session_dir)
+    export_videos(
+        session_cameras(session_dir),
+        args.output_dir or session_dir / OUTPUT_DIR,
+        args.fps,
+        args.streams,
+        args.mosaic,
+        args.thumbnails,
+        args.tolerance_ms,
+        tuple(args.depth_range),
+        args.cmap,
+        num_workers=args.num_workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Playback of recorded sessions at a steady frame rate.
+
+``FramePrefetcher`` decodes the rows of ``utils.sync.playback_rows`` ahead of
+the display on a thread pool, OpenCV releases the GIL while decoding, and keeps
+at most ``read_ahead`` rows in flight. ``play`` shows one row per ``1 / fps``
+and skips rows that are already late instead of slowing down, so playback
+keeps its rate however many cameras are shown.
+
+Keys: Esc quits, space pauses, ``a`` / ``d`` seek back / forward one second.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Move windows to different positions on the screen to avoid overlap
+WINDOW_POSITIONS = [
+    (0, 0),
+    (500, 0),
+    (1000, 0),
+    (1500, 0),
+    (0, 500),
+    (500, 500),
+    (1000, 500),
+    (1500, 500),
+    (0, 1000),
+    (500, 1000),
+    (1000, 1000),
+    (1500, 1000),
+]  # Adjust positions as necessary
+
+# Shown for a camera without a frame before its first frame was decoded
+BLANK_SHAPE = (480, 640, 3)
+
+
+class FramePrefetcher:
+    """Decodes upcoming rows of frames in the background.
+
+    Args:
+        streams (list): utils.session_reader.StreamReader of each camera
+        rows (np.ndarray): (N, cameras) positions into ``streams``, -1 if
+            missing, see ``utils.sync.playback_rows``
+        transform (callable): Applied to every frame in the decoding thread,
+            or a list of one per stream
+        read_ahead (int): Rows decoded ahead of the one shown
+        num_threads (int): Decoding threads, default depends on the CPU count
+    """
+
+    def __init__(self, streams, rows, transform=None, read_ahead=8, num_threads=None):
+        self.streams = streams
+        self.rows = rows
+        self.transform = transform
+        self.read_ahead = max(1, read_ahead)
+        self.executor = ThreadPoolExecutor(num_threads)
+        # Containers are read through one file handle, one frame at a time
+        self.locks = [
+            threading.Lock() if stream.container is not None else None
+            for stream in streams
+        ]
+        # Row -> futures of its frames, None where a camera has no frame
+        self.pending = {}
+        self.position = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _load(self, column, i):
+        stream = self.streams[column]
+        try:
+            if self.locks[column] is None:
+                image = stream[i]
+            else:
+                with self.locks[column]:
+                    image = stream[i]
+            transform = self.transform
+            if isinstance(transform, list):
+                transform = transform[column]
+            return image if transform is None else transform(image)
+        except ValueError as e:
+            print(f"Error reading frame {stream.frame_numbers[i]}: {e}. Skipping.")
+            return None
+
+    def _fill(self):
+        end = min(self.position + self.read_ahead, len(self.rows))
+        for row in range(self.position, end):
+            if row not in self.pending:
+                self.pending[row] = [
+                    self.executor.submit(self._load, column, i) if i >= 0 else None
+                    for column, i in enumerate(self.rows[row])
+                ]
+
+    def seek(self, row):
+        """Decode from ``row`` on, dropping the rows outside the read-ahead."""
+        self.position = row
+        for pending_row in list(self.pending):
+            if not row <= pending_row < row + self.read_ahead:
+                for future in self.pending.pop(pending_row):
+                    if future is not None:
+                        future.cancel()
+        self._fill()
+
+    def get(self, row):
+        """Frames of ``row``, waiting for their decoding if needed.
+
+        Returns:
+            list: Frame of each camera, None where it has none
+        """
+        if row != self.position:
+            self.seek(row)
+        self._fill()
+        futures = self.pending.pop(row)
+        self.position = row + 1
+        self._fill()
+        return [None if future is None else future.result() for future in futures]
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pending = {}
+
+
+def open_windows(names):
+    for i, name in enumerate(names):
+        cv2.namedWindow(name, cv2.WINDOW_NORMAL)
+        if i < len(WINDOW_POSITIONS):
+            cv2.moveWindow(name, *WINDOW_POSITIONS[i])
+
+
+def play(names, prefetcher, fps):
+    """Show the rows of ``prefetcher`` at ``fps``, one window per camera.
+
+    Every row is due at a fixed time from the start; rows that are already
+    late when the previous one was shown are skipped.
+
+    Args:
+        names (list): Window name of each camera
+        prefetcher (FramePrefetcher): Frames to show
+        fps (float): Rows shown per second
+    """
+    open_windows(names)
+    blanks = [np.zeros(BLANK_SHAPE, dtype=np.uint8) for _ in names]
+    seek_rows = max(1, round(fps))
+    period = 1 / fps
+    row, skipped = 0, 0
+    paused = False
+    start = time.monotonic()
+    while 0 <= row < len(prefetcher):
+        images = prefetcher.get(row)
+        for column, (name, image) in enumerate(zip(names, images)):
+            if image is None:
+                # The camera has no frame for this row, show a black image
+                image = blanks[column]
+            elif image.shape != blanks[column].shape:
+                blanks[column] = np.zeros_like(image)
+            cv2.imshow(name, image)
+
+        if paused:
+            key = cv2.waitKey(0)
+        else:
+            delay = start + (row + 1) * period - time.monotonic()
+            key = cv2.waitKey(max(1, int(delay * 1000)))
+        key &= 0xFF
+        if key == 27:  # Escape key to stop early
+            break
+        if key == ord(" "):
+            paused = not paused
+            # Rows are due relative to the one following the pause
+            start = time.monotonic() - (row + 1) * period
+        if key in (ord("a"), ord("d")):
+            row += seek_rows if key == ord("d") else -seek_rows
+            row = min(max(row, 0), len(prefetcher) - 1)
+            start = time.monotonic() - row * period
+        elif not paused:
+            # Skip the rows that are due already
+            due = int((time.monotonic() - start) * fps)
+            skipped += max(due - row - 1, 0)
+            row = max(row + 1, due)
+
+    cv2.destroyAllWindows()
+    if skipped:
+        print(f"Skipped {skipped} of {len(prefetcher)} rows to keep {fps} fps")
@@ -1,126 +1,76 @@
-import cv2
+from functools import partial
+import argparse
 import os
 import sys
-import numpy as np
-import matplotlib
 
+from utils.depth_encoding import stored_depth_range
+from utils.session_reader import CameraReader
+from utils.sync import playback_rows
+from visualization.export_video import stream_name, video_frame
+from visualization.playback import FramePrefetcher, play
 
-def colorize_depth_map(depth_map, min_value=None, max_value=None, cmap="Spectral"):
-    # Normalize the depth map to range [0, 1]
-    if min_value is None:
-        min_value = depth_map.min()
-    if max_value is None:
-        max_value = depth_map.max()
-    depth = (depth_map - min_value) / (max_value - min_value)
 
-    cm = matplotlib.cm.get_cmap(cmap)
-    depth_map_color = cm(depth, bytes=False)[:, :, :3]
-
-    return depth_map_color
-
-
-def visualize_image_sequences(directories_paths, fps):
-    # List all PNG files in each directory, grouped by cameras
-    image_files_per_camera = []
+def visualize_image_sequences(
+    directories_paths, fps, tolerance_ms=100, read_ahead=8, depth_range=(0, 2000)
+):
+    # Index the depth frames of each camera once
+    frames_per_camera = []
+    camera_dirs = []
+    transforms = []
 
     for directory_path in directories_paths:
-        image_files = [
-            f
-            for f in os.listdir(directory_path)
-            if f.endswith(".png") and f.startswith("depth_")
-        ]
-        image_files = [
-            f
-            for f in sorted(
-                image_files, key=lambda x: int(x.replace(".png", "").split("_")[-1])
-            )
-        ]
-
-        if not image_files:
-            print(f"No PNG images found in directory {directory_path}.")
+        camera = CameraReader(directory_path)
+        stream = stream_name(camera, "depth")
+        if stream is None or not len(camera[stream]):
+            print(f"No depth frames found in directory {directory_path}.")
             return
-        image_files_per_camera.append(image_files)
-
-    # Create a window to display images for each camera
-    windows = [name.split("/")[-1] for name in directories_paths]
-    for window in windows:
-        cv2.namedWindow(window, cv2.WINDOW_NORMAL)
-
-    # Move windows to different positions on the screen to avoid overlap
-    window_positions = [
-        (0, 0),
-        (500, 0),
-        (1000, 0),
-        (1500, 0),
-        (0, 500),
-        (500, 500),
-        (1000, 500),
-        (1500, 500),
-        (0, 1000),
-        (500, 1000),
-        (1000, 1000),
-        (1500, 1000),
-    ]  # Adjust positions as necessary
-    for i, window in enumerate(windows):
-        if i < len(window_positions):
-            cv2.moveWindow(window, *window_positions[i])
-
-    # Read and display images in sequence for each camera
-    # Determine the maximum number of frames (longest sequence length)
-    num_frames = max(len(image_files) for image_files in image_files_per_camera)
-
-    # Read and display images in sequence for each camera
-    for i in range(num_frames):
-        images = []
-        # For each camera, load the corresponding image if it exists
-        for idx, directory_path in enumerate(directories_paths):
-            # Check if the current camera has a frame for this index
-            if i < len(image_files_per_camera[idx]):
-                image_file = image_files_per_camera[idx][i]
-                image_path = os.path.join(directory_path, image_file)
-                print(f"Displaying {image_path}")
-
-                # Read the image
-                image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
-                if image is None:
-                    print(
-                        f"Error reading image {image_file} for camera {idx+1}. Skipping."
-                    )
-                    continue
-
-                image = colorize_depth_map(image, min_value=0, max_value=2000)
-                images.append(image)
-            else:
-                # If the camera doesn't have more frames, append a black image (or leave it empty)
-                images.append(
-                    np.zeros_like(images[0])
-                    if images
-                    else np.zeros((480, 640, 3), dtype=np.uint8)
-                )  # Modify size as necessary
-
-        # Show the image in each window
-        for idx, image in enumerate(images):
-            cv2.imshow(windows[idx], image)
+        frames_per_camera.append(camera[stream])
+        camera_dirs.append(camera.camera_dir)
+        # depth_range is in millimeters, colorized in the stored units
+        transforms.append(
+            partial(
+                video_frame,
+                depth_range=stored_depth_range(camera.camera_dir, stream, depth_range),
+            )
+        )
 
-        # Wait for the appropriate amount of time based on the FPS
-        key = cv2.waitKey(int(1000 / fps))  # Convert FPS to milliseconds
-        if key == 27:  # Escape key to stop early
-            break
+    # Match frames captured at the same time across cameras
+    rows = playback_rows(camera_dirs, frames_per_camera, tolerance_ms)
 
-    # Close all OpenCV windows
-    cv2.destroyAllWindows()
+    # Frames are decoded and colorized ahead of the display; depth colorized
+    # when recording is shown as is
+    prefetcher = FramePrefetcher(
+        frames_per_camera,
+        rows,
+        transforms,
+        read_ahead,
+    )
+    try:
+        play([name.split("/")[-1] for name in directories_paths], prefetcher, fps)
+    finally:
+        prefetcher.close()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print(
-            "Usage: python visualize_image_sequence.py <directory_path_1> <directory_path_2> ... <fps>"
-        )
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Play the depth of several cameras side by side",
+    )
+    parser.add_argument(
+        "directories", nargs="+", help="Camera directories under recorded_data"
+    )
+    parser.add_argument("fps", type=int, help="Playback rate")
+    parser.add_argument(
+        "--depth_range",
+        type=float,
+        nargs=2,
+        help="Depth in millimeters shown in the lowest and highest color",
+        default=[0, 2000],
+    )
+    args = parser.parse_args()
 
     # Get the directory paths and FPS from command-line arguments
-    directories_paths = [os.path.join("recorded_data", arg) for arg in sys.argv[1:-1]]
-    fps = int(sys.argv[-1])
+    directories_paths = [os.path.join("recorded_data", arg) for arg in args.directories]
+    fps = args.fps
 
     # Check if the directories exist
     for directory_path in directories_paths:
@@ -129,4 +79,6 @@ if __name__ == "__main__":
             sys.exit(1)
 
     # Call the function to visualize image sequences
-    visualize_image_sequences(directories_paths, fps)
+    visualize_image_sequences(
+        directories_paths, fps, depth_range=tuple(args.depth_range)
+    )